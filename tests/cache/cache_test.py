@@ -0,0 +1,174 @@
+import dns.flags
+import dns.message
+import dns.name
+import dns.rcode
+import dns.rrset
+import pytest
+
+from toy_dns_server.cache.cache import DNSCache
+
+KEY = "www.example.|1|1"
+QUESTION = dns.message.make_query("www.example.", "A").to_wire()[12:]
+
+
+@pytest.fixture(params=["memory", "shared_memory"])
+def cache(request, make_config, tmp_path):
+    config = make_config({
+        "resolver": {
+            "cache": {
+                "backend": request.param,
+                "shared_memory": {"path": str(tmp_path / "cache")},
+                "prefetch": {"enabled": False},
+            },
+        },
+    })
+    cache = DNSCache(config.resolver.cache)
+    yield cache
+    cache.close()
+
+
+def test_hit_gets_the_transaction_id_of_the_query(cache):
+    cache.set(KEY, QUESTION, _response(id=0x1234).to_wire())
+
+    hit = dns.message.from_wire(cache.get(KEY, QUESTION, 0xBEEF))
+
+    assert hit.id == 0xBEEF
+    assert hit.answer[0] == _response().answer[0]
+
+
+def test_hit_counts_the_ttl_down(cache, clock):
+    cache.set(KEY, QUESTION, _response(ttl=300).to_wire())
+
+    clock[0] += 100
+    hit = dns.message.from_wire(cache.get(KEY, QUESTION, 1))
+
+    assert [rrset.ttl for rrset in hit.answer] == [199, 199]
+
+
+def test_hit_keeps_the_edns_flags(cache):
+    response = _response()
+    response.use_edns(0, dns.flags.DO, 1232)
+    cache.set(KEY, QUESTION, response.to_wire())
+
+    hit = dns.message.from_wire(cache.get(KEY, QUESTION, 1))
+
+    assert hit.ednsflags & dns.flags.DO
+    assert hit.payload == 1232
+
+
+def test_hit_counts_the_soa_ttl_of_a_negative_entry_down(cache, clock):
+    response = _response(answer=False)
+    response.set_rcode(dns.rcode.NXDOMAIN)
+    response.authority.append(
+        dns.rrset.from_text("example.", 600, "IN", "SOA", "ns.example. admin.example. 1 7200 900 1209600 60")
+    )
+    cache.set(KEY, QUESTION, response.to_wire())
+
+    clock[0] += 20
+    hit = dns.message.from_wire(cache.get(KEY, QUESTION, 1))
+
+    assert hit.rcode() == dns.rcode.NXDOMAIN
+    assert hit.authority[0].ttl == 39
+
+
+def test_expired_entry_is_a_miss(cache, clock):
+    cache.set(KEY, QUESTION, _response(ttl=30).to_wire())
+
+    clock[0] += 31
+
+    assert cache.get(KEY, QUESTION, 1) is None
+
+
+def test_entry_for_another_question_is_a_miss(cache):
+    cache.set(KEY, QUESTION, _response().to_wire())
+    other = dns.message.make_query(dns.name.Name([b"www.example", b""]), "A").to_wire()[12:]
+
+    assert cache.get(KEY, other, 1) is None
+
+
+def test_response_to_another_question_is_not_cached(cache):
+    other = dns.message.make_query("mail.example.", "A").to_wire()[12:]
+    cache.set(KEY, other, _response().to_wire())
+
+    assert cache.get(KEY, QUESTION, 1) is None
+    assert cache.get(KEY, other, 1) is None
+
+
+def test_question_case_does_not_matter(cache):
+    cache.set(KEY, QUESTION, _response().to_wire())
+
+    assert cache.get(KEY, dns.message.make_query("WWW.Example.", "A").to_wire()[12:], 1) is not None
+
+
+def test_hits_recorded_from_a_cache_in_front_drive_prefetching(make_config, clock):
+    config = make_config({"resolver": {"cache": {"prefetch": {"enabled": True, "min_hits": 3, "threshold_percent": 10}}}})
+    cache = DNSCache(config.resolver.cache)
+    refreshed = []
+    cache.set_refresh_handler(lambda key, query: refreshed.append(key))
+    try:
+        cache.set(KEY, QUESTION, _response(ttl=100).to_wire())
+        clock[0] += 95
+
+        for _ in range(3):
+            cache.record_hit(KEY, QUESTION, "doh")
+
+        assert refreshed == [KEY]
+    finally:
+        cache.close()
+
+
+def test_negative_entry_lives_for_the_lower_of_the_soa_ttl_and_minimum(cache, clock):
+    cache.set(KEY, QUESTION, _negative_response(dns.rcode.NXDOMAIN, soa_ttl=600, minimum=60).to_wire())
+
+    clock[0] += 59
+    assert cache.get(KEY, QUESTION, 1) is not None
+    clock[0] += 1
+    assert cache.get(KEY, QUESTION, 1) is None
+
+
+def test_nodata_entry_lives_for_the_soa_ttl(cache, clock):
+    cache.set(KEY, QUESTION, _negative_response(dns.rcode.NOERROR, soa_ttl=60, minimum=600).to_wire())
+
+    clock[0] += 59
+    hit = dns.message.from_wire(cache.get(KEY, QUESTION, 1))
+    clock[0] += 1
+
+    assert hit.rcode() == dns.rcode.NOERROR
+    assert not hit.answer
+    assert cache.get(KEY, QUESTION, 1) is None
+
+
+def test_negative_entry_ttl_is_capped(cache, clock):
+    cache.set(KEY, QUESTION, _negative_response(dns.rcode.NXDOMAIN, soa_ttl=86400, minimum=86400).to_wire())
+
+    clock[0] += 3599
+    assert cache.get(KEY, QUESTION, 1) is not None
+    clock[0] += 1
+    assert cache.get(KEY, QUESTION, 1) is None
+
+
+def test_negative_response_without_an_soa_is_not_cached(cache):
+    response = _response(answer=False)
+    response.set_rcode(dns.rcode.NXDOMAIN)
+    cache.set(KEY, QUESTION, response.to_wire())
+
+    assert cache.get(KEY, QUESTION, 1) is None
+
+
+def _negative_response(rcode: int, soa_ttl: int, minimum: int) -> dns.message.Message:
+    response = _response(answer=False)
+    response.set_rcode(rcode)
+    response.authority.append(
+        dns.rrset.from_text("example.", soa_ttl, "IN", "SOA", f"ns.example. admin.example. 1 7200 900 1209600 {minimum}")
+    )
+    return response
+
+
+def _response(id: int = 0, ttl: int = 300, answer: bool = True) -> dns.message.Message:
+    query = dns.message.make_query("www.example.", "A")
+    query.id = id
+    response = dns.message.make_response(query)
+    if answer:
+        response.answer.append(dns.rrset.from_text("www.example.", ttl, "IN", "CNAME", "web.example."))
+        response.answer.append(dns.rrset.from_text("web.example.", ttl, "IN", "A", "192.0.2.1"))
+    return response
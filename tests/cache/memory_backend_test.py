@@ -0,0 +1,89 @@
+import time
+
+import pytest
+
+from toy_dns_server.cache.entry import CacheEntry
+from toy_dns_server.cache.memory_backend import MemoryBackend
+
+NOW = 1_000_000.0
+RETENTION_SECONDS = 60
+
+
+@pytest.fixture
+def backend():
+    backend = MemoryBackend(3, RETENTION_SECONDS)
+    yield backend
+    backend.close()
+
+
+def test_full_store_evicts_the_least_recently_used_entry(backend):
+    for key in ("a", "b", "c"):
+        backend.set(key, _entry(), NOW)
+    backend.touch("a", backend.get("a", NOW))
+
+    backend.set("d", _entry(), NOW)
+
+    assert sorted(key for key, _ in backend.items()) == ["a", "c", "d"]
+
+
+def test_full_store_drops_an_entry_past_its_retention_before_evicting(backend):
+    backend.set("a", _entry(), NOW)
+    backend.set("b", _entry(expires_at=NOW - RETENTION_SECONDS), NOW)
+    backend.set("c", _entry(), NOW)
+
+    backend.set("d", _entry(), NOW)
+
+    assert sorted(key for key, _ in backend.items()) == ["a", "c", "d"]
+
+
+def test_overwriting_a_key_does_not_evict(backend):
+    for key in ("a", "b", "c"):
+        backend.set(key, _entry(), NOW)
+
+    backend.set("a", _entry(), NOW)
+
+    assert sorted(key for key, _ in backend.items()) == ["a", "b", "c"]
+
+
+def test_entry_is_kept_for_the_retention_period(backend):
+    backend.set("a", _entry(expires_at=NOW), NOW)
+
+    assert backend.get("a", NOW + RETENTION_SECONDS - 1) is not None
+    assert backend.get("a", NOW + RETENTION_SECONDS) is None
+
+
+def test_sweeper_removes_entries_past_their_retention(backend):
+    now = time.time()
+    backend.set("old", _entry(expires_at=now - RETENTION_SECONDS - 1), now)
+    backend.set("new", _entry(expires_at=now + 60), now)
+
+    assert backend._sweep_expired_entries() == 1
+    assert [key for key, _ in backend.items()] == ["new"]
+
+
+def test_sweeper_skips_heap_items_of_overwritten_entries(backend):
+    now = time.time()
+    backend.set("a", _entry(expires_at=now - RETENTION_SECONDS - 1), now)
+    backend.set("a", _entry(expires_at=now + 60), now)
+
+    assert backend._sweep_expired_entries() == 0
+    assert [key for key, _ in backend.items()] == ["a"]
+
+
+def test_sweeper_compacts_a_heap_grown_by_overwrites():
+    backend = MemoryBackend(10, RETENTION_SECONDS)
+    try:
+        now = time.time()
+        for i in range(3 * MemoryBackend.SWEEP_BATCH_SIZE):
+            backend.set("a", _entry(expires_at=now + 60 + i), now)
+
+        while backend._compact_expiry_heap_step():
+            pass
+
+        assert len(backend._expiry_heap) == 1
+    finally:
+        backend.close()
+
+
+def _entry(expires_at: float = NOW + 60) -> CacheEntry:
+    return CacheEntry(b"response", expires_at, 60, (), 12)
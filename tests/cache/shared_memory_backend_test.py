@@ -0,0 +1,194 @@
+import struct
+import sys
+import threading
+
+import pytest
+
+from toy_dns_server.cache.entry import CacheEntry
+from toy_dns_server.cache.shared_memory_backend import SharedMemoryBackend
+
+NOW = 1_000_000.0
+SLOT_SIZE = 256
+RETENTION_SECONDS = 60
+
+
+@pytest.fixture
+def path(tmp_path):
+    return str(tmp_path / "cache")
+
+
+@pytest.fixture
+def backend(path):
+    backend = SharedMemoryBackend(path, 64, SLOT_SIZE, RETENTION_SECONDS)
+    yield backend
+    backend.close()
+
+
+@pytest.fixture
+def one_window(path):
+    """A table with a single home slot, so every key lands in the same probe window."""
+    backend = SharedMemoryBackend(path, 1, SLOT_SIZE, RETENTION_SECONDS)
+    yield backend
+    backend.close()
+
+
+def test_entry_round_trips(backend):
+    entry = _entry(b"response", expires_at=NOW + 30, ttl_offsets=(12, 40))
+    entry.negative = True
+    entry.cached_by = "doh"
+    backend.set("a", entry, NOW)
+
+    stored = backend.get("a", NOW)
+
+    assert stored.response_data == b"response"
+    assert stored.expires_at == NOW + 30
+    assert stored.ttl_offsets == (12, 40)
+    assert stored.negative
+    assert stored.cached_by == "doh"
+
+
+def test_entries_are_shared_between_mappings_of_the_same_file(backend, path):
+    other = SharedMemoryBackend(path, 64, SLOT_SIZE, RETENTION_SECONDS)
+    try:
+        other.set("a", _entry(b"from another process"), NOW)
+
+        assert backend.get("a", NOW).response_data == b"from another process"
+    finally:
+        other.close()
+
+
+def test_overwriting_a_key_reuses_its_slot(backend):
+    backend.set("a", _entry(b"old"), NOW)
+    backend.set("a", _entry(b"new"), NOW)
+
+    assert backend.get("a", NOW).response_data == b"new"
+    assert [key for key, _ in backend.items()] == ["a"]
+
+
+def test_colliding_keys_probe_the_following_slots(one_window):
+    keys = [f"key{i}" for i in range(SharedMemoryBackend.PROBE_LIMIT)]
+    for key in keys:
+        one_window.set(key, _entry(key.encode()), NOW)
+
+    assert [one_window.get(key, NOW).response_data for key in keys] == [key.encode() for key in keys]
+
+
+def test_full_probe_window_evicts_the_entry_expiring_soonest(one_window):
+    for i in range(SharedMemoryBackend.PROBE_LIMIT):
+        one_window.set(f"key{i}", _entry(b"x", expires_at=NOW + 100 + i), NOW)
+
+    one_window.set("new", _entry(b"new"), NOW)
+
+    assert one_window.get("key0", NOW) is None
+    assert one_window.get("new", NOW).response_data == b"new"
+    assert all(one_window.get(f"key{i}", NOW) is not None for i in range(1, SharedMemoryBackend.PROBE_LIMIT))
+
+
+def test_full_probe_window_reuses_a_slot_past_its_retention_first(one_window):
+    for i in range(SharedMemoryBackend.PROBE_LIMIT):
+        expires_at = NOW - RETENTION_SECONDS - 1 if i == 3 else NOW + 100 + i
+        one_window.set(f"key{i}", _entry(b"x", expires_at=expires_at), NOW)
+
+    one_window.set("new", _entry(b"new"), NOW)
+
+    assert one_window.get("key3", NOW) is None
+    assert one_window.get("key0", NOW) is not None
+
+
+def test_entry_is_kept_for_the_retention_period(backend):
+    backend.set("a", _entry(b"x", expires_at=NOW), NOW)
+
+    assert backend.get("a", NOW + RETENTION_SECONDS - 1) is not None
+    assert backend.get("a", NOW + RETENTION_SECONDS) is None
+
+
+def test_response_larger_than_a_slot_is_not_cached(backend):
+    backend.set("a", _entry(bytes(SLOT_SIZE)), NOW)
+
+    assert backend.get("a", NOW) is None
+
+
+def test_entry_with_hundreds_of_records_round_trips(path):
+    backend = SharedMemoryBackend(path, 4, 65536, RETENTION_SECONDS)
+    try:
+        ttl_offsets = tuple(range(12, 12 + 300 * 16, 16))
+        backend.set("a", _entry(bytes(300 * 16), ttl_offsets=ttl_offsets), NOW)
+
+        assert backend.get("a", NOW).ttl_offsets == ttl_offsets
+    finally:
+        backend.close()
+
+
+def test_slot_being_written_is_not_read(backend):
+    backend.set("a", _entry(b"x"), NOW)
+    offset = backend.get("a", NOW).slot_offset
+    _set_seq(backend, offset, _seq(backend, offset) + 1)
+
+    assert backend.get("a", NOW) is None
+
+
+def test_slot_left_behind_by_a_dead_writer_is_rewritten(backend):
+    backend.set("a", _entry(b"x"), NOW)
+    offset = backend.get("a", NOW).slot_offset
+    _set_seq(backend, offset, _seq(backend, offset) + 1)
+
+    backend.set("a", _entry(b"y"), NOW)
+
+    assert backend.get("a", NOW).response_data == b"y"
+    assert _seq(backend, offset) % 2 == 0
+
+
+def test_copy_of_a_rewritten_slot_does_not_write_to_it(backend):
+    backend.set("a", _entry(b"x"), NOW)
+    stale = backend.get("a", NOW)
+    backend.set("a", _entry(b"y"), NOW)
+
+    backend.touch("a", stale)
+
+    assert not backend.mark_refreshing("a", stale)
+    fresh = backend.get("a", NOW)
+    assert fresh.hits == 0
+    assert backend.mark_refreshing("a", fresh)
+    assert not backend.mark_refreshing("a", fresh)
+
+
+def test_reads_never_see_a_half_written_slot(backend):
+    # Switch threads as often as possible, so reads and writes interleave mid-slot.
+    previous_interval = sys.getswitchinterval()
+    sys.setswitchinterval(1e-6)
+    values = [b"a" * 10, b"b" * 150]
+    stop = threading.Event()
+
+    def write():
+        i = 0
+        while not stop.is_set():
+            backend.set("key", _entry(values[i % 2], ttl_offsets=(i % 2,) * (i % 2 + 1)), NOW)
+            i += 1
+
+    backend.set("key", _entry(values[0], ttl_offsets=(0,)), NOW)
+    writer = threading.Thread(target=write)
+    writer.start()
+    try:
+        for _ in range(20000):
+            entry = backend.get("key", NOW)
+            if entry is None:
+                # Retries ran out while the writer held the slot.
+                continue
+            index = values.index(entry.response_data)
+            assert entry.ttl_offsets == (index,) * (index + 1)
+    finally:
+        stop.set()
+        writer.join()
+        sys.setswitchinterval(previous_interval)
+
+
+def _entry(data: bytes, expires_at: float = NOW + 60, ttl_offsets: tuple[int, ...] = ()) -> CacheEntry:
+    return CacheEntry(data, expires_at, 60, ttl_offsets, 12)
+
+
+def _seq(backend: SharedMemoryBackend, offset: int) -> int:
+    return struct.unpack_from("=I", backend._mmap, offset)[0]
+
+
+def _set_seq(backend: SharedMemoryBackend, offset: int, seq: int):
+    struct.pack_into("=I", backend._mmap, offset, seq)
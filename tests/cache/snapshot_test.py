@@ -0,0 +1,117 @@
+import dns.message
+import dns.rrset
+import pytest
+
+from toy_dns_server.cache.cache import DNSCache
+from toy_dns_server.cache.entry import CacheEntry
+from toy_dns_server.cache.snapshot import SnapshotReader, encode_record, write_snapshot
+
+STALE_WINDOW_SECONDS = 10
+
+
+@pytest.fixture
+def make_cache(make_config, tmp_path):
+    caches = []
+
+    def make() -> DNSCache:
+        config = make_config({
+            "resolver": {
+                "cache": {
+                    "backend": "memory",
+                    "prefetch": {"enabled": False},
+                    "stale": {"window_seconds": STALE_WINDOW_SECONDS},
+                    "snapshot": {"enabled": True, "path": str(tmp_path / "cache.snapshot")},
+                },
+            },
+        })
+        cache = DNSCache(config.resolver.cache)
+        caches.append(cache)
+        # Wait for the previous snapshot to be indexed.
+        for thread in cache._snapshot_threads:
+            if thread.name == "cache-snapshot-loader":
+                thread.join()
+        return cache
+
+    yield make
+    for cache in caches:
+        cache.close()
+
+
+def test_restarted_cache_answers_from_the_snapshot(make_cache, clock):
+    cache = make_cache()
+    question, response = _question_and_response("www.example.", ttl=300)
+    cache.set("www", question, response)
+    cache.close()
+
+    clock[0] += 100
+    hit = dns.message.from_wire(make_cache().get("www", question, 0x1234))
+
+    assert hit.id == 0x1234
+    assert str(hit.answer[0][0]) == "192.0.2.1"
+    assert hit.answer[0].ttl == 199
+
+
+def test_restarted_cache_drops_entries_past_the_stale_window(make_cache, clock):
+    cache = make_cache()
+    short_question, short_response = _question_and_response("short.example.", ttl=30)
+    long_question, long_response = _question_and_response("long.example.", ttl=300)
+    cache.set("short", short_question, short_response)
+    cache.set("long", long_question, long_response)
+    cache.close()
+
+    clock[0] += 30 + STALE_WINDOW_SECONDS
+    restarted = make_cache()
+
+    assert restarted.get_stale("short", short_question, 1) is None
+    assert restarted.get("long", long_question, 1) is not None
+
+
+def test_unrestored_entries_are_carried_over_to_the_next_snapshot(make_cache):
+    cache = make_cache()
+    question, response = _question_and_response("www.example.", ttl=300)
+    cache.set("www", question, response)
+    cache.close()
+
+    make_cache().close()
+
+    assert make_cache().get("www", question, 1) is not None
+
+
+def test_reader_indexes_records_expiring_after_the_cutoff(tmp_path):
+    path = str(tmp_path / "cache.snapshot")
+    entries = {
+        "old": CacheEntry(b"old", 100.0, 60, (), 12),
+        "new": CacheEntry(b"new", 200.0, 60, (14, 30), 12, negative=True),
+    }
+    assert write_snapshot(path, (encode_record(key, entry) for key, entry in entries.items())) == 2
+
+    reader = SnapshotReader(path)
+    try:
+        index = reader.index(keep_after=150.0, limit=10)
+        entry = reader.entry(index["new"])
+    finally:
+        reader.close()
+
+    assert list(index) == ["new"]
+    assert (entry.response_data, entry.expires_at, entry.ttl_offsets, entry.negative) == (b"new", 200.0, (14, 30), True)
+    assert entry.cached_by == "snapshot"
+
+
+def test_truncated_snapshot_is_rejected(tmp_path):
+    path = tmp_path / "cache.snapshot"
+    write_snapshot(str(path), [encode_record("www", CacheEntry(b"response", 200.0, 60, (), 12))])
+    path.write_bytes(path.read_bytes()[:-4])
+
+    reader = SnapshotReader(str(path))
+    try:
+        with pytest.raises(ValueError):
+            reader.index(keep_after=0.0, limit=10)
+    finally:
+        reader.close()
+
+
+def _question_and_response(name: str, ttl: int) -> tuple[bytes, bytes]:
+    query = dns.message.make_query(name, "A")
+    response = dns.message.make_response(query)
+    response.answer.append(dns.rrset.from_text(name, ttl, "IN", "A", "192.0.2.1"))
+    return query.to_wire()[12:], response.to_wire()
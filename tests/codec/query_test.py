@@ -0,0 +1,28 @@
+import dns.message
+import dns.name
+import pytest
+
+from toy_dns_server.codec.query import parse_query
+
+
+def test_cache_key_ignores_case():
+    assert _cache_key(dns.name.from_text("WWW.Example.COM.")) == _cache_key(dns.name.from_text("www.example.com."))
+
+
+@pytest.mark.parametrize("first, second", [
+    ([b"www.example", b"com"], [b"www", b"example", b"com"]),
+    ([b"a\\", b"b"], [b"a\\.b"]),
+    ([b"\\xff"], [b"\xff"]),
+])
+def test_distinct_names_get_distinct_cache_keys(first, second):
+    assert _cache_key(dns.name.Name(first + [b""])) != _cache_key(dns.name.Name(second + [b""]))
+
+
+def test_qname_escapes_like_dnspython():
+    name = dns.name.Name([b"www.example", b"c\\m", b""])
+
+    assert parse_query(dns.message.make_query(name, "A").to_wire()).qname == name.to_text()
+
+
+def _cache_key(name: dns.name.Name) -> str:
+    return parse_query(dns.message.make_query(name, "A").to_wire()).cache_key
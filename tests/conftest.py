@@ -0,0 +1,192 @@
+import os
+import socket
+import struct
+import threading
+import time
+from typing import Optional
+
+import dns.flags
+import dns.message
+import dns.name
+import dns.rcode
+import dns.rrset
+import pytest
+import yaml
+
+from toy_dns_server.config.schema import ConfigSchema
+from toy_dns_server.resolver.dns_resolver import DNSResolver
+from toy_dns_server.utils.deep_merge import deep_merge
+
+DEFAULT_CONFIG_PATH = os.path.join(os.path.dirname(__file__), "..", "config", "config.default.yml")
+
+
+@pytest.fixture
+def make_config():
+    """Build a `ConfigSchema` from the default configuration, with `overrides` merged in."""
+    with open(DEFAULT_CONFIG_PATH) as f:
+        default_config = yaml.safe_load(f)
+
+    def make(overrides: dict) -> ConfigSchema:
+        return ConfigSchema(**deep_merge(default_config, overrides))
+
+    return make
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    """Freeze `time.time`; tests move it forward by adding to `clock[0]`."""
+    now = [time.time()]
+    monkeypatch.setattr(time, "time", lambda: now[0])
+    return now
+
+
+class FakeUpstream:
+    """A DNS server on 127.0.0.1 answering over UDP and TCP on the same port.
+
+    Names starting with "big" get an answer too large for UDP: over UDP it is truncated to an
+    empty response with the TC bit, over TCP it comes in full. Names in `nxdomain` get NXDOMAIN
+    with an SOA record, names in `servfail` get SERVFAIL. Every query is recorded, with the transport it arrived on, and answered
+    after `delay` seconds, plus the delay of its name in `delays`.
+    """
+    BIG_ANSWER_RECORDS = 64
+
+    def __init__(self):
+        self.queries: list[tuple[str, dns.message.Message]] = []
+        self.delay = 0.0
+        self.delays: dict[dns.name.Name, float] = {}
+        self.nxdomain: set[dns.name.Name] = set()
+        self.servfail: set[dns.name.Name] = set()
+        self._udp, self._tcp = _bind_udp_and_tcp()
+        self.port = self._udp.getsockname()[1]
+        self._closed = False
+        threading.Thread(target=self._serve_udp, daemon=True).start()
+        threading.Thread(target=self._serve_tcp, daemon=True).start()
+
+    def close(self):
+        self._closed = True
+        self._udp.close()
+        self._tcp.close()
+
+    def _serve_udp(self):
+        while not self._closed:
+            try:
+                data, addr = self._udp.recvfrom(4096)
+            except OSError:
+                return
+            threading.Thread(target=self._answer_udp, args=(data, addr), daemon=True).start()
+
+    def _answer_udp(self, data: bytes, addr):
+        response = self._answer("udp", data)
+        try:
+            self._udp.sendto(response, addr)
+        except OSError:
+            # Closed while the answer was delayed.
+            return
+
+    def _serve_tcp(self):
+        while not self._closed:
+            try:
+                conn, _ = self._tcp.accept()
+            except OSError:
+                return
+            threading.Thread(target=self._handle_tcp, args=(conn,), daemon=True).start()
+
+    def _handle_tcp(self, conn: socket.socket):
+        with conn:
+            while True:
+                try:
+                    length = struct.unpack("!H", _recv_exactly(conn, 2))[0]
+                    response = self._answer("tcp", _recv_exactly(conn, length))
+                    conn.sendall(struct.pack("!H", len(response)) + response)
+                except (OSError, EOFError):
+                    return
+
+    def _answer(self, transport: str, data: bytes) -> bytes:
+        query = dns.message.from_wire(data)
+        self.queries.append((transport, query))
+        question = query.question[0]
+        time.sleep(self.delay + self.delays.get(question.name, 0.0))
+
+        response = dns.message.make_response(query)
+        if question.name in self.servfail:
+            response.set_rcode(dns.rcode.SERVFAIL)
+        elif question.name in self.nxdomain:
+            response.set_rcode(dns.rcode.NXDOMAIN)
+            response.authority.append(
+                dns.rrset.from_text("example.", 300, "IN", "SOA", "ns.example. admin.example. 1 7200 900 1209600 300")
+            )
+        elif not question.name.labels[0].startswith(b"big"):
+            response.answer.append(dns.rrset.from_text(question.name, 60, "IN", "A", "192.0.2.1"))
+        elif transport == "udp":
+            response.flags |= dns.flags.TC
+        else:
+            addresses = [f"192.0.2.{i}" for i in range(1, self.BIG_ANSWER_RECORDS + 1)]
+            response.answer.append(dns.rrset.from_text(question.name, 60, "IN", "A", *addresses))
+        return response.to_wire(max_size=65535)
+
+
+@pytest.fixture
+def upstream():
+    upstream = FakeUpstream()
+    yield upstream
+    upstream.close()
+
+
+@pytest.fixture
+def second_upstream():
+    """Another `FakeUpstream`, for tests with more than one upstream server."""
+    upstream = FakeUpstream()
+    yield upstream
+    upstream.close()
+
+
+@pytest.fixture
+def make_resolver(make_config, upstream):
+    """Build a `DNSResolver` that forwards to the `upstream` fixture, with `overrides` merged into its configuration."""
+    resolvers = []
+
+    def make(overrides: Optional[dict] = None) -> DNSResolver:
+        config = make_config(deep_merge({
+            "resolver": {
+                "upstream": {
+                    "servers": [{"address": "127.0.0.1", "port": upstream.port}],
+                    "timeout_ms": 1000,
+                    "hedging": {"enabled": False},
+                },
+                "cache": {"enabled": False},
+                "security": {"dnssec_validation": False},
+            },
+        }, overrides or {}))
+        resolver = DNSResolver(config.resolver)
+        resolvers.append(resolver)
+        return resolver
+
+    yield make
+    for resolver in resolvers:
+        resolver.close()
+
+
+def _bind_udp_and_tcp() -> tuple[socket.socket, socket.socket]:
+    # Let the kernel pick a free UDP port, and retry if TCP happens to have it taken.
+    while True:
+        udp = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        udp.bind(("127.0.0.1", 0))
+        tcp = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        try:
+            tcp.bind(("127.0.0.1", udp.getsockname()[1]))
+        except OSError:
+            udp.close()
+            tcp.close()
+            continue
+        tcp.listen()
+        return udp, tcp
+
+
+def _recv_exactly(conn: socket.socket, size: int) -> bytes:
+    data = b""
+    while len(data) < size:
+        chunk = conn.recv(size - len(data))
+        if not chunk:
+            raise EOFError("Connection closed")
+        data += chunk
+    return data
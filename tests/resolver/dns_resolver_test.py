@@ -0,0 +1,183 @@
+import time
+from typing import Union
+
+import dns.flags
+import dns.message
+import dns.name
+import dns.rcode
+
+from toy_dns_server.codec.query import parse_query
+from toy_dns_server.resolver.dns_resolver import DNSResolver
+
+
+def test_concurrent_queries_for_the_same_question_share_one_upstream_query(make_resolver, upstream):
+    resolver = make_resolver()
+    upstream.delay = 0.3
+    queries = [_query("www.example.", id) for id in (0x1111, 0x2222, 0x3333)]
+
+    futures = [resolver.submit(parse_query(query.to_wire())) for query in queries]
+    responses = [dns.message.from_wire(future.result(timeout=5)) for future in futures]
+
+    assert len(upstream.queries) == 1
+    for query, response in zip(queries, responses):
+        assert response.id == query.id
+        assert str(response.answer[0][0]) == "192.0.2.1"
+
+
+def test_concurrent_queries_for_different_questions_are_not_shared(make_resolver, upstream):
+    resolver = make_resolver()
+    upstream.delay = 0.3
+    queries = [_query("www.example.", 0x1111), _query("mail.example.", 0x2222)]
+
+    futures = [resolver.submit(parse_query(query.to_wire())) for query in queries]
+    responses = [dns.message.from_wire(future.result(timeout=5)) for future in futures]
+
+    assert sorted(query.question[0].name.to_text() for _, query in upstream.queries) == ["mail.example.", "www.example."]
+    assert [response.question[0].name for response in responses] == [query.question[0].name for query in queries]
+
+
+def test_cache_hit_gets_the_transaction_id_of_the_query(make_resolver, upstream):
+    resolver = make_resolver({"resolver": {"cache": {"enabled": True}}})
+    resolver.submit(parse_query(_query("www.example.", 0x1111).to_wire())).result(timeout=5)
+
+    hit = resolver.resolve_cached(parse_query(_query("www.example.", 0x2222).to_wire()))
+
+    assert len(upstream.queries) == 1
+    assert dns.message.from_wire(hit).id == 0x2222
+
+
+def test_truncated_udp_answer_is_retried_over_tcp(make_resolver, upstream):
+    resolver = make_resolver()
+
+    response = dns.message.from_wire(resolver.submit(parse_query(_query("big.example.", 0x1111).to_wire())).result(timeout=5))
+
+    assert [transport for transport, _ in upstream.queries] == ["udp", "tcp"]
+    assert response.id == 0x1111
+    assert not response.flags & dns.flags.TC
+    assert len(response.answer[0]) == upstream.BIG_ANSWER_RECORDS
+
+
+def test_nxdomain_for_a_name_with_a_dotted_label_does_not_answer_the_real_name(make_resolver, upstream):
+    resolver = make_resolver({"resolver": {"cache": {"enabled": True}}})
+    dotted = dns.name.Name([b"www.example", b"com", b""])
+    upstream.nxdomain.add(dotted)
+    poisoned = dns.message.from_wire(resolver.submit(parse_query(_query(dotted, 0x1111).to_wire())).result(timeout=5))
+
+    response = dns.message.from_wire(resolver.submit(parse_query(_query("www.example.com.", 0x2222).to_wire())).result(timeout=5))
+
+    assert poisoned.rcode() == dns.rcode.NXDOMAIN
+    assert response.rcode() == dns.rcode.NOERROR
+    assert response.question[0].name == dns.name.from_text("www.example.com.")
+    assert str(response.answer[0][0]) == "192.0.2.1"
+
+
+def test_stale_entry_is_served_when_upstream_is_slower_than_the_client_timeout(make_resolver, upstream, clock):
+    resolver = _stale_resolver(make_resolver)
+    resolver.submit(parse_query(_query("www.example.", 0x1111).to_wire())).result(timeout=5)
+    clock[0] += 61
+    upstream.delay = 0.5
+
+    response = dns.message.from_wire(resolver.submit(parse_query(_query("www.example.", 0x2222).to_wire())).result(timeout=5))
+
+    assert response.id == 0x2222
+    assert str(response.answer[0][0]) == "192.0.2.1"
+    assert response.answer[0].ttl == 30
+
+
+def test_stale_entry_is_served_when_upstream_answers_servfail(make_resolver, upstream, clock):
+    resolver = _stale_resolver(make_resolver)
+    resolver.submit(parse_query(_query("www.example.", 0x1111).to_wire())).result(timeout=5)
+    clock[0] += 61
+    upstream.servfail.add(dns.name.from_text("www.example."))
+
+    response = dns.message.from_wire(resolver.submit(parse_query(_query("www.example.", 0x2222).to_wire())).result(timeout=5))
+
+    assert len(upstream.queries) == 2
+    assert response.rcode() == dns.rcode.NOERROR
+    assert response.id == 0x2222
+    assert str(response.answer[0][0]) == "192.0.2.1"
+
+
+def test_stale_entry_is_not_served_past_the_stale_window(make_resolver, upstream, clock):
+    resolver = _stale_resolver(make_resolver)
+    resolver.submit(parse_query(_query("www.example.", 0x1111).to_wire())).result(timeout=5)
+    clock[0] += 61 + 3600
+    upstream.servfail.add(dns.name.from_text("www.example."))
+
+    response = dns.message.from_wire(resolver.submit(parse_query(_query("www.example.", 0x2222).to_wire())).result(timeout=5))
+
+    assert response.rcode() == dns.rcode.SERVFAIL
+
+
+def test_popular_entry_is_refreshed_before_it_expires(make_resolver, upstream, clock):
+    resolver = _prefetching_resolver(make_resolver)
+    resolver.submit(parse_query(_query("www.example.", 0x1111).to_wire())).result(timeout=5)
+    clock[0] += 55
+
+    for id in (0x2222, 0x3333, 0x4444):
+        assert resolver.resolve_cached(parse_query(_query("www.example.", id).to_wire())) is not None
+    _wait_for_queries(upstream, 2)
+    clock[0] += 10
+
+    # Past the original expiry: only the refreshed entry can answer, once the refresh has landed.
+    deadline = time.monotonic() + 5
+    while resolver.resolve_cached(parse_query(_query("www.example.", 0x5555).to_wire())) is None:
+        assert time.monotonic() < deadline
+        time.sleep(0.01)
+    assert len(upstream.queries) == 2
+
+
+def test_entry_with_few_hits_is_not_refreshed(make_resolver, upstream, clock):
+    resolver = _prefetching_resolver(make_resolver)
+    resolver.submit(parse_query(_query("www.example.", 0x1111).to_wire())).result(timeout=5)
+    clock[0] += 55
+
+    for id in (0x2222, 0x3333):
+        resolver.resolve_cached(parse_query(_query("www.example.", id).to_wire()))
+    time.sleep(0.1)
+
+    assert len(upstream.queries) == 1
+
+
+def test_entry_is_not_refreshed_early_in_its_ttl(make_resolver, upstream, clock):
+    resolver = _prefetching_resolver(make_resolver)
+    resolver.submit(parse_query(_query("www.example.", 0x1111).to_wire())).result(timeout=5)
+    clock[0] += 30
+
+    for id in range(0x2222, 0x2232):
+        resolver.resolve_cached(parse_query(_query("www.example.", id).to_wire()))
+    time.sleep(0.1)
+
+    assert len(upstream.queries) == 1
+
+
+def _prefetching_resolver(make_resolver) -> DNSResolver:
+    return make_resolver({
+        "resolver": {"cache": {"enabled": True, "prefetch": {"enabled": True, "threshold_percent": 10, "min_hits": 3}}},
+    })
+
+
+def _wait_for_queries(upstream, count: int):
+    deadline = time.monotonic() + 5
+    while len(upstream.queries) < count and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert len(upstream.queries) == count
+
+
+def _stale_resolver(make_resolver) -> DNSResolver:
+    return make_resolver({
+        "resolver": {
+            "cache": {
+                "enabled": True,
+                "prefetch": {"enabled": False},
+                "stale": {"enabled": True, "window_seconds": 3600, "answer_ttl_seconds": 30, "client_timeout_ms": 100},
+            },
+        },
+    })
+
+
+def _query(name: Union[str, dns.name.Name], id: int) -> dns.message.Message:
+    query = dns.message.make_query(name, "A")
+    query.id = id
+    return query
+
@@ -0,0 +1,102 @@
+import time
+
+import dns.message
+import pytest
+
+from toy_dns_server.codec.query import parse_query
+from toy_dns_server.resolver.hedging import HedgingPolicy
+from toy_dns_server.resolver.upstream_manager import UpstreamManager
+
+SERVER = "udp://192.0.2.1:53"
+
+
+@pytest.fixture
+def make_policy(make_config):
+    managers = []
+
+    def make(hedging: dict) -> tuple[HedgingPolicy, UpstreamManager]:
+        config = make_config({
+            "resolver": {"upstream": {"servers": ["192.0.2.1"], "timeout_ms": 1000, "hedging": hedging}},
+        })
+        manager = UpstreamManager(config.resolver.upstream, lambda server: None)
+        managers.append(manager)
+        return HedgingPolicy(config.resolver.upstream.hedging, manager, 1.0), manager
+
+    yield make
+    for manager in managers:
+        manager.close()
+
+
+def test_hedge_delay_is_the_rtt_percentile(make_policy):
+    policy, manager = make_policy({"enabled": True, "percentile": 90, "min_delay_ms": 10})
+    for rtt in range(1, 101):
+        manager.record_success(SERVER, rtt / 1000)
+
+    assert policy.delay(SERVER) == 0.091
+
+
+def test_hedge_delay_is_bounded(make_policy):
+    policy, manager = make_policy({"enabled": True, "percentile": 90, "min_delay_ms": 50})
+    manager.record_success(SERVER, 0.001)
+    assert policy.delay(SERVER) == 0.05
+
+    for _ in range(100):
+        manager.record_success(SERVER, 5.0)
+    assert policy.delay(SERVER) == 1.0
+
+
+def test_server_without_samples_is_hedged_after_half_the_timeout(make_policy):
+    policy, _ = make_policy({"enabled": True})
+
+    assert policy.delay(SERVER) == 0.5
+
+
+def test_disabled_hedging_waits_for_the_timeout(make_policy):
+    policy, manager = make_policy({"enabled": False})
+    manager.record_success(SERVER, 0.001)
+
+    assert policy.delay(SERVER) == 1.0
+
+
+def test_hedges_are_limited_by_the_budget(make_policy):
+    policy, _ = make_policy({"enabled": True, "budget_percent": 50})
+    spent = [policy.acquire() for _ in range(int(HedgingPolicy.MAX_TOKENS))]
+    assert all(spent)
+    assert not policy.acquire()
+
+    # Every query earns half a hedge back.
+    for _ in range(2):
+        policy.delay(SERVER)
+    assert policy.acquire()
+    assert not policy.acquire()
+
+
+@pytest.mark.parametrize("enabled", [True, False])
+def test_slow_primary_is_hedged_to_the_next_server(make_resolver, upstream, second_upstream, enabled):
+    resolver = make_resolver({
+        "resolver": {
+            "upstream": {
+                "servers": [
+                    {"address": "127.0.0.1", "port": upstream.port},
+                    {"address": "127.0.0.1", "port": second_upstream.port},
+                ],
+                "hedging": {"enabled": enabled, "min_delay_ms": 50},
+            },
+        },
+    })
+    # Give both servers an RTT, then slow down whichever is asked first.
+    for id in (1, 2):
+        resolver.submit(parse_query(dns.message.make_query("www.example.", "A", id=id).to_wire())).result(timeout=5)
+    servers = {f"udp://127.0.0.1:{server.port}": server for server in (upstream, second_upstream)}
+    servers[resolver._upstreams.ordered_servers()[0]].delay = 0.8
+
+    start = time.monotonic()
+    resolver.submit(parse_query(dns.message.make_query("www.example.", "A", id=3).to_wire())).result(timeout=5)
+    elapsed = time.monotonic() - start
+
+    if enabled:
+        assert len(upstream.queries) + len(second_upstream.queries) == 4
+        assert elapsed < 0.5
+    else:
+        assert len(upstream.queries) + len(second_upstream.queries) == 3
+        assert elapsed >= 0.8
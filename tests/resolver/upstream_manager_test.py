@@ -0,0 +1,107 @@
+import pytest
+
+from toy_dns_server.resolver.upstream_manager import UpstreamManager
+
+FAST, SLOW = "udp://192.0.2.1:53", "udp://192.0.2.2:53"
+
+
+@pytest.fixture
+def make_manager(make_config):
+    managers = []
+
+    def make(probe=lambda server: None) -> UpstreamManager:
+        config = make_config({
+            "resolver": {
+                "upstream": {
+                    "servers": ["192.0.2.1", "192.0.2.2"],
+                    "timeout_ms": 1000,
+                    "health": {"failure_threshold": 3, "backoff_initial_ms": 60000, "backoff_max_ms": 300000},
+                },
+            },
+        })
+        manager = UpstreamManager(config.resolver.upstream, probe)
+        managers.append(manager)
+        return manager
+
+    yield make
+    for manager in managers:
+        manager.close()
+
+
+def test_faster_server_is_asked_first(make_manager):
+    manager = make_manager()
+    manager.record_success(FAST, 0.01)
+    manager.record_success(SLOW, 0.2)
+
+    assert manager.ordered_servers() == [FAST, SLOW]
+
+
+def test_errors_count_against_a_fast_server(make_manager):
+    manager = make_manager()
+    manager.record_success(FAST, 0.01)
+    manager.record_success(SLOW, 0.2)
+    manager.record_failure(FAST)
+
+    assert manager.ordered_servers() == [SLOW, FAST]
+
+
+def test_server_is_backed_off_after_consecutive_failures(make_manager):
+    manager = make_manager()
+    for _ in range(3):
+        manager.record_failure(FAST)
+
+    assert manager.ordered_servers() == [SLOW]
+
+
+def test_success_resets_the_consecutive_failures(make_manager):
+    manager = make_manager()
+    for _ in range(2):
+        manager.record_failure(FAST)
+    manager.record_success(FAST, 0.01)
+    for _ in range(2):
+        manager.record_failure(FAST)
+
+    assert FAST in manager.ordered_servers()
+
+
+def test_every_server_is_asked_when_none_is_healthy(make_manager):
+    manager = make_manager()
+    for server in (FAST, SLOW):
+        for _ in range(3):
+            manager.record_failure(server)
+
+    assert manager.ordered_servers() == [FAST, SLOW]
+
+
+def test_successful_probe_brings_a_server_back(make_manager):
+    manager = make_manager()
+    for _ in range(3):
+        manager.record_failure(FAST)
+
+    manager._probe_server(FAST)
+
+    assert FAST in manager.ordered_servers()
+
+
+def test_failed_probe_doubles_the_backoff(make_manager):
+    def probe(server: str):
+        raise TimeoutError("no answer")
+
+    manager = make_manager(probe)
+    for _ in range(3):
+        manager.record_failure(FAST)
+
+    manager._probe_server(FAST)
+    manager._probe_server(FAST)
+
+    assert manager._states[FAST].backoff == 240
+    assert manager.ordered_servers() == [SLOW]
+
+
+def test_rtt_percentile_of_recent_samples(make_manager):
+    manager = make_manager()
+    for rtt in range(1, 101):
+        manager.record_success(FAST, rtt / 1000)
+
+    assert manager.rtt_percentile(FAST, 95) == 0.096
+    assert manager.rtt_percentile(SLOW, 95) is None
@@ -0,0 +1,72 @@
+import asyncio
+import socket
+
+import dns.message
+import dns.rrset
+
+from toy_dns_server.config.schema import UpstreamServerConfig
+from toy_dns_server.resolver.upstream_pool import UpstreamSocketPool
+
+
+def test_response_is_matched_by_id_and_question_and_gets_the_original_id_back():
+    async def exchange(server: socket.socket, pool: UpstreamSocketPool, key: str):
+        query = dns.message.make_query("www.example.", "A")
+        query.id = 0x1234
+        future = pool.submit(key, query.to_wire())
+        data, addr = server.recvfrom(512)
+        sent = dns.message.from_wire(data)
+
+        # A response with another ID, and one for another question, must not complete the query.
+        wrong_id = _response(sent, "192.0.2.66")
+        wrong_id.id = sent.id ^ 0xFFFF
+        other_question = _response(dns.message.make_query("mail.example.", "A"), "192.0.2.67")
+        other_question.id = sent.id
+        for response in (wrong_id, other_question, _response(sent, "192.0.2.1")):
+            server.sendto(response.to_wire(), addr)
+
+        return sent, dns.message.from_wire(await asyncio.wait_for(future, 5))
+
+    sent, response = _with_pool(exchange)
+
+    assert str(response.answer[0][0]) == "192.0.2.1"
+    assert response.id == 0x1234
+    assert sent.question == response.question
+
+
+def test_question_is_matched_case_insensitively():
+    async def exchange(server: socket.socket, pool: UpstreamSocketPool, key: str):
+        future = pool.submit(key, dns.message.make_query("www.example.", "A").to_wire())
+        data, addr = server.recvfrom(512)
+        sent = dns.message.from_wire(data)
+        response = _response(dns.message.make_query("WWW.Example.", "A"), "192.0.2.1")
+        response.id = sent.id
+        server.sendto(response.to_wire(), addr)
+
+        return dns.message.from_wire(await asyncio.wait_for(future, 5))
+
+    assert str(_with_pool(exchange).answer[0][0]) == "192.0.2.1"
+
+
+def _with_pool(exchange):
+    server = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    server.bind(("127.0.0.1", 0))
+    server.settimeout(5)
+    config = UpstreamServerConfig(address="127.0.0.1", port=server.getsockname()[1])
+
+    async def run():
+        pool = UpstreamSocketPool([config], 2)
+        try:
+            return await exchange(server, pool, config.key)
+        finally:
+            pool.close()
+
+    try:
+        return asyncio.run(run())
+    finally:
+        server.close()
+
+
+def _response(query: dns.message.Message, address: str) -> dns.message.Message:
+    response = dns.message.make_response(query)
+    response.answer.append(dns.rrset.from_text(query.question[0].name, 60, "IN", "A", address))
+    return response
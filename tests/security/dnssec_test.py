@@ -0,0 +1,178 @@
+import asyncio
+import time
+
+import dns.dnssec
+import dns.flags
+import dns.message
+import dns.name
+import dns.rcode
+import dns.rdataclass
+import dns.rdatatype
+import dns.rrset
+from cryptography.hazmat.primitives.asymmetric import ed25519
+
+from toy_dns_server.config.schema import DNSSECVerificationConfig, ResolverSecurityConfig
+from toy_dns_server.security.dnssec import DNSSECValidator
+
+ZONE = dns.name.from_text("example.")
+KEY = ed25519.Ed25519PrivateKey.generate()
+DNSKEY = dns.dnssec.make_dnskey(KEY.public_key(), dns.dnssec.Algorithm.ED25519, flags=257)
+DNSKEY_RRSET = dns.rrset.from_rdata_list(ZONE, 3600, [DNSKEY])
+TRUST_ANCHOR = f"example. {dns.dnssec.make_ds(ZONE, DNSKEY, 'SHA256').to_text()}"
+
+# The NSEC chain of the zone: example. -> unsigned.example. (an unsigned delegation) -> *.wild.example.
+# -> www.example.
+NSEC = {
+    "example.": "unsigned.example. SOA NS DNSKEY NSEC RRSIG",
+    "unsigned.example.": "*.wild.example. NS NSEC RRSIG",
+    "*.wild.example.": "www.example. A NSEC RRSIG",
+    "www.example.": "example. A NSEC RRSIG",
+}
+
+
+def test_signed_answer_is_secure():
+    response = _response("www.example.", "A", answer=[_signed("www.example.", "A", "192.0.2.1")])
+
+    assert _validate(response)
+
+
+def test_answer_with_a_bad_signature_is_bogus():
+    rrset, rrsigs = _signed("www.example.", "A", "192.0.2.1")
+    forged = dns.rrset.from_text("www.example.", 300, "IN", "A", "203.0.113.66")
+    response = _response("www.example.", "A", answer=[(forged, rrsigs)])
+
+    assert not _validate(response)
+
+
+def test_answer_stripped_of_signatures_is_bogus():
+    rrset, _ = _signed("www.example.", "A", "192.0.2.1")
+    response = _response("www.example.", "A", answer=[(rrset, None)])
+
+    assert not _validate(response)
+
+
+def test_unsigned_answer_below_an_unsigned_delegation_is_insecure():
+    rrset = dns.rrset.from_text("host.unsigned.example.", 300, "IN", "A", "192.0.2.2")
+    response = _response("host.unsigned.example.", "A", answer=[(rrset, None)])
+
+    assert _validate(response)
+
+
+def test_wildcard_answer_with_a_proof_of_no_closer_match_is_secure():
+    response = _response("host.wild.example.", "A", answer=[_expanded("host.wild.example.")], authority=[_nsec("*.wild.example.")])
+
+    assert _validate(response)
+
+
+def test_wildcard_answer_without_a_proof_of_no_closer_match_is_bogus():
+    response = _response("host.wild.example.", "A", answer=[_expanded("host.wild.example.")])
+
+    assert not _validate(response)
+
+
+def test_wildcard_answer_with_a_proof_that_does_not_cover_the_name_is_bogus():
+    response = _response("host.wild.example.", "A", answer=[_expanded("host.wild.example.")], authority=[_nsec("example.")])
+
+    assert not _validate(response)
+
+
+def test_signed_nxdomain_is_secure():
+    response = _response(
+        "missing.example.", "A", rcode=dns.rcode.NXDOMAIN, authority=[_nsec("example.")]
+    )
+
+    assert _validate(response)
+
+
+def test_nxdomain_without_a_denial_is_bogus():
+    response = _response("missing.example.", "A", rcode=dns.rcode.NXDOMAIN)
+
+    assert not _validate(response)
+
+
+def test_nxdomain_with_a_denial_that_does_not_cover_the_name_is_bogus():
+    response = _response(
+        "missing.example.", "A", rcode=dns.rcode.NXDOMAIN, authority=[_nsec("unsigned.example.")]
+    )
+
+    assert not _validate(response)
+
+
+def test_signed_nodata_is_secure():
+    response = _response("www.example.", "AAAA", authority=[_nsec("www.example.")])
+
+    assert _validate(response)
+
+
+def test_nodata_for_an_existing_type_is_bogus():
+    response = _response("www.example.", "A", authority=[_nsec("www.example.")])
+
+    assert not _validate(response)
+
+
+def _validate(response: dns.message.Message) -> bool:
+    async def validate():
+        validator = DNSSECValidator(_config(), _exchange)
+        try:
+            return await validator.validate(response.to_wire())
+        finally:
+            validator.close()
+
+    return asyncio.run(validate())
+
+
+def _config() -> ResolverSecurityConfig:
+    return ResolverSecurityConfig(
+        dnssec_validation=True,
+        trust_anchors=[TRUST_ANCHOR],
+        verification=DNSSECVerificationConfig(processes=0, queue_depth=1),
+    )
+
+
+async def _exchange(query_wire: bytes) -> bytes:
+    """Answer the validator's DNSKEY and DS lookups from the test zone."""
+    query = dns.message.from_wire(query_wire)
+    question = query.question[0]
+    name = question.name.to_text()
+    if question.rdtype == dns.rdatatype.DNSKEY and question.name == ZONE:
+        response = _response(name, "DNSKEY", answer=[(DNSKEY_RRSET, _sign(DNSKEY_RRSET))])
+    elif name in NSEC:
+        response = _response(name, "DS", authority=[_nsec(name)])
+    else:
+        response = _response(name, "DS", rcode=dns.rcode.NXDOMAIN, authority=[_nsec("example.")])
+    response.id = query.id
+    return response.to_wire()
+
+
+def _response(qname: str, rdtype: str, rcode: int = dns.rcode.NOERROR, answer=(), authority=()) -> dns.message.Message:
+    response = dns.message.make_response(dns.message.make_query(qname, rdtype, want_dnssec=True))
+    response.set_rcode(rcode)
+    for section, rrsets in ((response.answer, answer), (response.authority, authority)):
+        for rrset, rrsigs in rrsets:
+            section.append(rrset)
+            if rrsigs is not None:
+                section.append(rrsigs)
+    return response
+
+
+def _signed(name: str, rdtype: str, *rdatas: str) -> tuple[dns.rrset.RRset, dns.rrset.RRset]:
+    rrset = dns.rrset.from_text(name, 300, "IN", rdtype, *rdatas)
+    return rrset, _sign(rrset)
+
+
+def _expanded(name: str) -> tuple[dns.rrset.RRset, dns.rrset.RRset]:
+    """The A RRset of `name` as synthesized from *.wild.example., with the wildcard's signature."""
+    rrset, rrsigs = _signed("*.wild.example.", "A", "192.0.2.3")
+    return (
+        dns.rrset.from_rdata_list(name, rrset.ttl, list(rrset)),
+        dns.rrset.from_rdata_list(name, rrsigs.ttl, list(rrsigs)),
+    )
+
+
+def _nsec(name: str) -> tuple[dns.rrset.RRset, dns.rrset.RRset]:
+    return _signed(name, "NSEC", NSEC[name])
+
+
+def _sign(rrset: dns.rrset.RRset) -> dns.rrset.RRset:
+    rrsig = dns.dnssec.sign(rrset, KEY, ZONE, DNSKEY, inception=time.time() - 60, lifetime=3600)
+    return dns.rrset.from_rdata_list(rrset.name, rrset.ttl, [rrsig])
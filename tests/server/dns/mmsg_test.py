@@ -0,0 +1,72 @@
+import socket
+
+import pytest
+
+from toy_dns_server.server.dns import mmsg
+from toy_dns_server.server.dns.mmsg import MMsgSocket
+
+pytestmark = pytest.mark.skipif(not mmsg.is_supported(), reason="recvmmsg/sendmmsg are not available")
+
+
+@pytest.fixture
+def server():
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sock.bind(("127.0.0.1", 0))
+    sock.setblocking(False)
+    yield sock
+    sock.close()
+
+
+@pytest.fixture
+def clients():
+    socks = [socket.socket(socket.AF_INET, socket.SOCK_DGRAM) for _ in range(3)]
+    for sock in socks:
+        sock.bind(("127.0.0.1", 0))
+        sock.settimeout(5)
+    yield socks
+    for sock in socks:
+        sock.close()
+
+
+def test_one_call_receives_a_burst_with_each_sender(server, clients):
+    for i, client in enumerate(clients):
+        client.sendto(f"query {i}".encode(), server.getsockname())
+
+    datagrams = MMsgSocket(server, 8).recv()
+
+    assert datagrams == [(f"query {i}".encode(), client.getsockname()) for i, client in enumerate(clients)]
+
+
+def test_receive_is_limited_to_the_batch_size(server, clients):
+    for client in clients:
+        client.sendto(b"query", server.getsockname())
+    batched = MMsgSocket(server, 2)
+
+    assert len(batched.recv()) == 2
+    assert len(batched.recv()) == 1
+
+
+def test_receive_without_datagrams_would_block(server):
+    with pytest.raises(BlockingIOError):
+        MMsgSocket(server, 8).recv()
+
+
+def test_one_call_sends_to_each_receiver(server, clients):
+    datagrams = [(f"answer {i}".encode(), client.getsockname()) for i, client in enumerate(clients)]
+
+    sent = MMsgSocket(server, 8).send(datagrams)
+
+    assert sent == len(clients)
+    assert [client.recvfrom(512) for client in clients] == [(data, server.getsockname()) for data, _ in datagrams]
+
+
+def test_send_is_limited_to_the_batch_size(server, clients):
+    datagrams = [(b"answer", client.getsockname()) for client in clients]
+
+    assert MMsgSocket(server, 2).send(datagrams) == 2
+
+
+def test_ipv6_addresses_round_trip():
+    addr = ("2001:db8::1", 53, 0, 0)
+
+    assert mmsg._decode_sockaddr(mmsg._encode_sockaddr(socket.AF_INET6, addr)) == addr
@@ -0,0 +1,111 @@
+import socket
+import struct
+
+import dns.message
+import dns.name
+import pytest
+
+from toy_dns_server.config.schema import DNSTCPConfig
+from toy_dns_server.server.dns.tcp_server import AsyncTCPServer
+
+
+@pytest.fixture
+def make_server(make_resolver):
+    servers = []
+
+    def make(max_connections: int = 8, idle_timeout_ms: int = 5000) -> tuple:
+        config = DNSTCPConfig(enabled=True, max_connections=max_connections, idle_timeout_ms=idle_timeout_ms, pipeline_depth=8)
+        server = AsyncTCPServer(("127.0.0.1", 0), make_resolver(), config)
+        server.start()
+        servers.append(server)
+        return server._server.sockets[0].getsockname()
+
+    yield make
+    for server in servers:
+        server.stop()
+
+
+def test_pipelined_queries_are_answered_as_they_resolve(make_server, upstream):
+    address = make_server()
+    upstream.delays[dns.name.from_text("slow.example.")] = 0.3
+    slow, fast = _query("slow.example.", 0x1111), _query("fast.example.", 0x2222)
+
+    with _connect(address) as conn:
+        conn.sendall(_frame(slow) + _frame(fast))
+        responses = [_receive(conn), _receive(conn)]
+
+    assert [response.id for response in responses] == [fast.id, slow.id]
+    assert [response.question for response in responses] == [fast.question, slow.question]
+
+
+def test_connection_is_reused_for_further_queries(make_server, upstream):
+    address = make_server()
+
+    with _connect(address) as conn:
+        for id in (0x1111, 0x2222, 0x3333):
+            conn.sendall(_frame(_query("www.example.", id)))
+            assert _receive(conn).id == id
+
+
+def test_connections_beyond_the_limit_are_closed(make_server, upstream):
+    address = make_server(max_connections=1)
+
+    with _connect(address) as first:
+        first.sendall(_frame(_query("www.example.", 0x1111)))
+        _receive(first)
+
+        with _connect(address) as second:
+            assert second.recv(2) == b""
+
+        first.sendall(_frame(_query("www.example.", 0x2222)))
+        assert _receive(first).id == 0x2222
+
+
+def test_idle_connection_is_closed(make_server, upstream):
+    address = make_server(idle_timeout_ms=100)
+
+    with _connect(address) as conn:
+        conn.sendall(_frame(_query("www.example.", 0x1111)))
+        _receive(conn)
+
+        assert conn.recv(2) == b""
+
+
+def test_connection_waiting_for_an_answer_is_not_idle(make_server, upstream):
+    address = make_server(idle_timeout_ms=100)
+    upstream.delay = 0.3
+
+    with _connect(address) as conn:
+        conn.sendall(_frame(_query("www.example.", 0x1111)))
+
+        assert _receive(conn).id == 0x1111
+
+
+def _query(name: str, id: int) -> dns.message.Message:
+    query = dns.message.make_query(name, "A")
+    query.id = id
+    return query
+
+
+def _connect(address) -> socket.socket:
+    return socket.create_connection(address, timeout=5)
+
+
+def _frame(query: dns.message.Message) -> bytes:
+    data = query.to_wire()
+    return struct.pack("!H", len(data)) + data
+
+
+def _receive(conn: socket.socket) -> dns.message.Message:
+    length = struct.unpack("!H", _recv_exactly(conn, 2))[0]
+    return dns.message.from_wire(_recv_exactly(conn, length))
+
+
+def _recv_exactly(conn: socket.socket, size: int) -> bytes:
+    data = b""
+    while len(data) < size:
+        chunk = conn.recv(size - len(data))
+        if not chunk:
+            raise EOFError("Connection closed")
+        data += chunk
+    return data
@@ -0,0 +1,106 @@
+import socket
+import threading
+import time
+
+import dns.flags
+import dns.message
+import pytest
+
+from toy_dns_server.config.schema import DNSUDPBatchingConfig
+from toy_dns_server.server.dns import async_server
+from toy_dns_server.server.dns.async_server import AsyncUDPServer
+from toy_dns_server.server.dns.handler import DNSRequestHandler
+from toy_dns_server.server.dns.server import ThreadedUDPServer
+
+
+@pytest.fixture(params=["threaded", "asyncio", "asyncio_batched", "asyncio_batched_fallback"])
+def server_address(request, make_resolver, monkeypatch):
+    resolver = make_resolver()
+    if request.param == "asyncio_batched_fallback":
+        # As on a platform without recvmmsg/sendmmsg.
+        monkeypatch.setattr(async_server, "mmsg_supported", lambda: False)
+
+    if request.param == "threaded":
+        server = ThreadedUDPServer(("127.0.0.1", 0), DNSRequestHandler, resolver)
+        address = server.server_address
+    else:
+        address = ("127.0.0.1", _free_port())
+        batching = DNSUDPBatchingConfig(enabled=request.param.startswith("asyncio_batched"), batch_size=32)
+        server = AsyncUDPServer(address, resolver, batching)
+
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    _wait_until_bound(address)
+    yield address
+    server.shutdown()
+    thread.join()
+    server.server_close()
+
+
+def test_answer_retried_over_tcp_is_sent_in_full_when_it_fits(server_address, upstream):
+    query = dns.message.make_query("big.example.", "A", use_edns=0, payload=4096)
+
+    response = _ask(server_address, query)
+
+    assert [transport for transport, _ in upstream.queries] == ["udp", "tcp"]
+    assert not response.flags & dns.flags.TC
+    assert len(response.answer[0]) == upstream.BIG_ANSWER_RECORDS
+
+
+def test_answer_retried_over_tcp_is_truncated_to_512_bytes_without_edns(server_address, upstream):
+    query = dns.message.make_query("big.example.", "A")
+
+    response, size = _ask(server_address, query, with_size=True)
+
+    assert size <= 512
+    assert response.flags & dns.flags.TC
+    assert response.id == query.id
+    assert response.question == query.question
+    assert not response.answer
+
+
+def test_answer_retried_over_tcp_is_truncated_to_the_edns_payload_size(server_address, upstream):
+    query = dns.message.make_query("big.example.", "A", use_edns=0, payload=600)
+
+    response, size = _ask(server_address, query, with_size=True)
+
+    assert size <= 600
+    assert response.flags & dns.flags.TC
+    assert response.edns == 0
+    assert not response.answer
+
+
+def test_small_answer_is_not_truncated(server_address, upstream):
+    response = _ask(server_address, dns.message.make_query("www.example.", "A"))
+
+    assert not response.flags & dns.flags.TC
+    assert str(response.answer[0][0]) == "192.0.2.1"
+
+
+def _ask(address, query: dns.message.Message, with_size: bool = False):
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sock:
+        sock.settimeout(5)
+        sock.sendto(query.to_wire(), address)
+        data = sock.recv(65535)
+
+    response = dns.message.from_wire(data)
+    return (response, len(data)) if with_size else response
+
+
+def _wait_until_bound(address):
+    # The asyncio engines bind on the resolver's loop, after serve_forever has started.
+    deadline = time.monotonic() + 5
+    while time.monotonic() < deadline:
+        with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sock:
+            try:
+                sock.bind(address)
+            except OSError:
+                return
+        time.sleep(0.01)
+    raise TimeoutError(f"Server did not bind {address}")
+
+
+def _free_port() -> int:
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
@@ -0,0 +1,339 @@
+import base64
+import contextlib
+import http.client
+import socket
+import ssl
+import threading
+import time
+from typing import Iterator, Optional
+
+import dns.message
+import dns.name
+import dns.rcode
+import h2.config
+import h2.connection
+import h2.events
+import pytest
+
+from toy_dns_server.server.doh.async_server import MAX_QUERY_BYTES, AsyncDoHServer
+from toy_dns_server.server.doh.messages import DNS_MESSAGE_TYPE
+from toy_dns_server.server.doh.tls import ServerTLS
+from toy_dns_server.utils.deep_merge import deep_merge
+
+
+@pytest.fixture
+def make_server(make_config, make_resolver, certificate):
+    servers = []
+
+    def make(overrides: Optional[dict] = None, https: bool = False) -> tuple:
+        """Start a server; `overrides` are merged into the configuration of both it and its resolver."""
+        config = make_config(deep_merge({
+            "server": {"doh": {"engine": "asyncio", "https": {"security": certificate}}},
+        }, overrides or {}))
+        tls = None
+        if https:
+            alpn_protocols = ["h2", "http/1.1"] if config.server.doh.http2.enabled else ["http/1.1"]
+            tls = ServerTLS(config.server.doh.https.security, alpn_protocols)
+        server = AsyncDoHServer(("127.0.0.1", 0), make_resolver(overrides), config.server.doh, tls)
+        threading.Thread(target=server.run, daemon=True).start()
+        servers.append(server)
+        return server._socket.getsockname()
+
+    yield make
+    for server in servers:
+        server.stop()
+
+
+@pytest.fixture
+def connection(make_server):
+    conn = http.client.HTTPConnection(*make_server(), timeout=5)
+    yield conn
+    conn.close()
+
+
+def test_post_query_is_answered(connection, upstream):
+    query = _query("www.example.", 0x1234)
+
+    response = _post(connection, query.to_wire())
+
+    assert response.status == 200
+    assert response.getheader("Content-Type") == DNS_MESSAGE_TYPE
+    answer = dns.message.from_wire(response.read())
+    assert answer.id == 0x1234
+    assert str(answer.answer[0][0]) == "192.0.2.1"
+
+
+def test_get_query_is_decoded_from_unpadded_base64url(connection, upstream):
+    query = _query("www.example.", 0)
+    encoded = base64.urlsafe_b64encode(query.to_wire()).rstrip(b"=").decode()
+
+    connection.request("GET", f"/dns-query?dns={encoded}")
+    response = connection.getresponse()
+
+    assert response.status == 200
+    assert dns.message.from_wire(response.read()).question == query.question
+
+
+def test_connection_is_kept_alive_between_requests(connection, upstream):
+    _post(connection, _query("www.example.", 1).to_wire()).read()
+    sock = connection.sock
+
+    response = _post(connection, _query("mail.example.", 2).to_wire())
+
+    assert response.status == 200
+    assert dns.message.from_wire(response.read()).id == 2
+    assert connection.sock is sock
+
+
+def test_connection_close_is_honored(connection, upstream):
+    connection.request("POST", "/dns-query", _query("www.example.", 1).to_wire(), {
+        "Content-Type": DNS_MESSAGE_TYPE,
+        "Connection": "close",
+    })
+    response = connection.getresponse()
+    response.read()
+
+    assert response.getheader("Connection") == "close"
+    assert connection.sock is None
+
+
+@pytest.mark.parametrize("target", ["/dns-query", "/dns-query?dns=", "/dns-query?dns=!!!"])
+def test_get_without_a_valid_dns_parameter_is_a_bad_request(connection, upstream, target):
+    connection.request("GET", target)
+
+    assert connection.getresponse().status == 400
+
+
+def test_malformed_query_is_a_bad_request(connection, upstream):
+    assert _post(connection, b"\x00\x01").status == 400
+
+
+def test_unsupported_method_is_not_allowed(connection, upstream):
+    connection.request("PUT", "/dns-query", _query("www.example.", 1).to_wire())
+    response = connection.getresponse()
+
+    assert response.status == 405
+    assert response.getheader("Allow") == "GET, POST"
+
+
+def test_post_of_another_content_type_is_unsupported(connection, upstream):
+    connection.request("POST", "/dns-query", _query("www.example.", 1).to_wire(), {"Content-Type": "text/plain"})
+
+    assert connection.getresponse().status == 415
+
+
+def test_oversized_body_is_rejected(connection, upstream):
+    connection.putrequest("POST", "/dns-query")
+    connection.putheader("Content-Type", DNS_MESSAGE_TYPE)
+    connection.putheader("Content-Length", str(MAX_QUERY_BYTES + 1))
+    connection.endheaders()
+
+    response = connection.getresponse()
+
+    assert response.status == 413
+    assert response.getheader("Connection") == "close"
+
+
+def test_answer_is_cacheable_for_its_smallest_ttl(connection, upstream):
+    response = _post(connection, _query("www.example.", 1).to_wire())
+
+    assert response.getheader("Cache-Control") == "max-age=60"
+    assert response.getheader("Age") is None
+
+
+def test_negative_answer_is_cacheable_for_its_soa_ttl(connection, upstream):
+    upstream.nxdomain.add(dns.name.from_text("missing.example."))
+
+    response = _post(connection, _query("missing.example.", 1).to_wire())
+
+    assert response.getheader("Cache-Control") == "max-age=300"
+
+
+def test_servfail_is_not_cacheable(connection, upstream):
+    upstream.servfail.add(dns.name.from_text("www.example."))
+
+    response = _post(connection, _query("www.example.", 1).to_wire())
+
+    assert dns.message.from_wire(response.read()).rcode() == dns.rcode.SERVFAIL
+    assert response.getheader("Cache-Control") is None
+
+
+def test_repeated_question_is_answered_from_the_response_cache(connection, upstream):
+    _post(connection, _query("www.example.", 0x1111).to_wire()).read()
+
+    response = _post(connection, _query("WWW.example.", 0x2222).to_wire())
+
+    assert len(upstream.queries) == 1
+    assert response.getheader("Age") == "0"
+    assert response.getheader("Cache-Control") == "max-age=60"
+    assert dns.message.from_wire(response.read()).id == 0x2222
+
+
+def test_response_cache_hits_drive_prefetching_of_the_resolver_entry(make_server, upstream, clock):
+    address = make_server({
+        "resolver": {"cache": {"enabled": True, "prefetch": {"enabled": True, "min_hits": 3, "threshold_percent": 10}}},
+    })
+    connection = http.client.HTTPConnection(*address, timeout=5)
+    try:
+        _post(connection, _query("www.example.", 1).to_wire()).read()
+        # Into the last 10% of the resolver entry's TTL; the response cache keeps its own monotonic time.
+        clock[0] += 55
+        for id in (2, 3, 4):
+            response = _post(connection, _query("www.example.", id).to_wire())
+            response.read()
+            assert response.getheader("Age") is not None
+    finally:
+        connection.close()
+
+    deadline = time.monotonic() + 5
+    while len(upstream.queries) < 2 and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert len(upstream.queries) == 2
+
+
+def test_http2_streams_are_answered_as_they_resolve(make_server, upstream):
+    upstream.delays[dns.name.from_text("slow.example.")] = 0.3
+    with _http2_connection(make_server(https=True)) as (sock, conn):
+        slow = conn.get_next_available_stream_id()
+        _send_post(sock, conn, slow, _query("slow.example.", 0x1111).to_wire())
+        fast = conn.get_next_available_stream_id()
+        _send_post(sock, conn, fast, _query("fast.example.", 0x2222).to_wire())
+
+        responses = _receive_responses(sock, conn, 2)
+
+    assert list(responses) == [fast, slow]
+    assert all(headers[":status"] == "200" for headers, _ in responses.values())
+    assert dns.message.from_wire(responses[fast][1]).id == 0x2222
+    assert dns.message.from_wire(responses[slow][1]).id == 0x1111
+
+
+def test_http2_get_query_is_answered(make_server, upstream):
+    encoded = base64.urlsafe_b64encode(_query("www.example.", 0).to_wire()).rstrip(b"=").decode()
+    with _http2_connection(make_server(https=True)) as (sock, conn):
+        stream_id = conn.get_next_available_stream_id()
+        conn.send_headers(stream_id, _request_headers("GET", f"/dns-query?dns={encoded}"), end_stream=True)
+        sock.sendall(conn.data_to_send())
+
+        headers, body = _receive_responses(sock, conn, 1)[stream_id]
+
+    assert headers[":status"] == "200"
+    assert headers["cache-control"] == "max-age=60"
+    assert str(dns.message.from_wire(body).answer[0][0]) == "192.0.2.1"
+
+
+def test_http2_advertises_the_stream_limit(make_server, upstream):
+    with _http2_connection(make_server({"server": {"doh": {"http2": {"max_concurrent_streams": 7}}}}, https=True)) as (sock, conn):
+        deadline = time.monotonic() + 5
+        while conn.remote_settings.max_concurrent_streams != 7 and time.monotonic() < deadline:
+            conn.receive_data(sock.recv(65535))
+            sock.sendall(conn.data_to_send())
+
+    assert conn.remote_settings.max_concurrent_streams == 7
+
+
+def test_https_client_without_http2_is_served_http11(make_server, upstream):
+    host, port = make_server(https=True)
+    connection = http.client.HTTPSConnection(host, port, timeout=5, context=_client_context(["http/1.1"]))
+    try:
+        response = _post(connection, _query("www.example.", 1).to_wire())
+
+        assert response.status == 200
+        assert response.version == 11
+        assert connection.sock.selected_alpn_protocol() == "http/1.1"
+    finally:
+        connection.close()
+
+
+@pytest.mark.parametrize("version", [ssl.TLSVersion.TLSv1_2, ssl.TLSVersion.TLSv1_3])
+@pytest.mark.parametrize("stateless_tickets", [True, False])
+def test_returning_https_client_resumes_its_session(make_server, upstream, version, stateless_tickets):
+    address = make_server({
+        "server": {"doh": {"https": {"security": {"session_resumption": {"stateless_tickets": stateless_tickets}}}}},
+    }, https=True)
+    context = _client_context(["http/1.1"])
+    context.maximum_version = version
+
+    session, resumed = _post_and_close(address, context)
+    _, resumed_again = _post_and_close(address, context, session)
+
+    assert not resumed
+    assert resumed_again
+
+
+def _post_and_close(address, context: ssl.SSLContext, session: Optional[ssl.SSLSession] = None) -> tuple:
+    """Send one query with `Connection: close`; returns the TLS session and whether it was resumed."""
+    body = _query("www.example.", 1).to_wire()
+    request = (
+        f"POST /dns-query HTTP/1.1\r\nHost: localhost\r\nContent-Type: {DNS_MESSAGE_TYPE}\r\n"
+        f"Content-Length: {len(body)}\r\nConnection: close\r\n\r\n"
+    ).encode() + body
+    with context.wrap_socket(socket.create_connection(address, timeout=5), session=session) as sock:
+        sock.sendall(request)
+        response = b""
+        while chunk := sock.recv(65535):
+            response += chunk
+
+        assert response.startswith(b"HTTP/1.1 200 ")
+        return sock.session, sock.session_reused
+
+
+def _client_context(alpn_protocols: list[str]) -> ssl.SSLContext:
+    context = ssl.SSLContext(ssl.PROTOCOL_TLS_CLIENT)
+    context.check_hostname = False
+    context.verify_mode = ssl.CERT_NONE
+    context.set_alpn_protocols(alpn_protocols)
+    return context
+
+
+@contextlib.contextmanager
+def _http2_connection(address) -> Iterator[tuple[ssl.SSLSocket, h2.connection.H2Connection]]:
+    """Open an HTTP/2 client connection, yielding the TLS socket and the h2 state."""
+    with _client_context(["h2"]).wrap_socket(socket.create_connection(address, timeout=5)) as sock:
+        assert sock.selected_alpn_protocol() == "h2"
+        conn = h2.connection.H2Connection(h2.config.H2Configuration(client_side=True, header_encoding="utf-8"))
+        conn.initiate_connection()
+        sock.sendall(conn.data_to_send())
+        yield sock, conn
+
+
+def _request_headers(method: str, path: str) -> list[tuple[str, str]]:
+    return [(":method", method), (":path", path), (":scheme", "https"), (":authority", "localhost")]
+
+
+def _send_post(sock: ssl.SSLSocket, conn: h2.connection.H2Connection, stream_id: int, body: bytes):
+    headers = _request_headers("POST", "/dns-query") + [("content-type", DNS_MESSAGE_TYPE)]
+    conn.send_headers(stream_id, headers)
+    conn.send_data(stream_id, body, end_stream=True)
+    sock.sendall(conn.data_to_send())
+
+
+def _receive_responses(sock: ssl.SSLSocket, conn: h2.connection.H2Connection, count: int) -> dict:
+    """Read until `count` streams have ended; returns stream ID -> (headers, body), in the order they ended."""
+    headers, bodies, ended = {}, {}, {}
+    while len(ended) < count:
+        data = sock.recv(65535)
+        if not data:
+            raise EOFError("Connection closed")
+
+        for event in conn.receive_data(data):
+            if isinstance(event, h2.events.ResponseReceived):
+                headers[event.stream_id] = dict(event.headers)
+            elif isinstance(event, h2.events.DataReceived):
+                bodies[event.stream_id] = bodies.get(event.stream_id, b"") + event.data
+                conn.acknowledge_received_data(event.flow_controlled_length, event.stream_id)
+            elif isinstance(event, h2.events.StreamEnded):
+                ended[event.stream_id] = (headers[event.stream_id], bodies.get(event.stream_id, b""))
+        sock.sendall(conn.data_to_send())
+
+    return ended
+
+
+def _query(name: str, id: int) -> dns.message.Message:
+    query = dns.message.make_query(name, "A")
+    query.id = id
+    return query
+
+
+def _post(connection: http.client.HTTPConnection, body: bytes) -> http.client.HTTPResponse:
+    connection.request("POST", "/dns-query", body, {"Content-Type": DNS_MESSAGE_TYPE})
+    return connection.getresponse()
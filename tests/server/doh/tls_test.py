@@ -0,0 +1,91 @@
+import socket
+import ssl
+import threading
+from typing import Optional
+
+import pytest
+
+from toy_dns_server.server.doh.tls import ServerTLS
+
+
+@pytest.fixture
+def make_tls(make_config, certificate):
+    def make(session_resumption: Optional[dict] = None, max_tls_version: str = "TLS13") -> ServerTLS:
+        config = make_config({
+            "server": {
+                "doh": {
+                    "https": {
+                        "security": {
+                            **certificate,
+                            "max_tls_version": max_tls_version,
+                            "session_resumption": session_resumption or {},
+                        },
+                    },
+                },
+            },
+        })
+        return ServerTLS(config.server.doh.https.security, ["http/1.1"])
+
+    return make
+
+
+@pytest.mark.parametrize("version", [ssl.TLSVersion.TLSv1_2, ssl.TLSVersion.TLSv1_3])
+@pytest.mark.parametrize("stateless_tickets", [True, False])
+def test_returning_client_resumes_its_session(make_tls, version, stateless_tickets):
+    tls, client = make_tls({"stateless_tickets": stateless_tickets}), _client_context(version)
+    session = _handshake(tls, client)[0]
+
+    assert _handshake(tls, client, session)[1]
+
+
+def test_tls13_sessions_are_not_resumed_without_tickets(make_tls):
+    tls, client = make_tls({"tickets_per_handshake": 0}), _client_context(ssl.TLSVersion.TLSv1_3)
+    session = _handshake(tls, client)[0]
+
+    assert session is None or not _handshake(tls, client, session)[1]
+
+
+def test_sessions_from_before_a_ticket_key_rotation_get_a_full_handshake(make_tls):
+    tls, client = make_tls(), _client_context(ssl.TLSVersion.TLSv1_3)
+    session = _handshake(tls, client)[0]
+    previous_context = tls.context()
+
+    tls._rotate_at = 0
+    rotated_context = tls.context()
+
+    assert rotated_context is not previous_context
+    assert not _handshake(tls, client, session)[1]
+
+
+def _client_context(version: ssl.TLSVersion) -> ssl.SSLContext:
+    context = ssl.SSLContext(ssl.PROTOCOL_TLS_CLIENT)
+    context.check_hostname = False
+    context.verify_mode = ssl.CERT_NONE
+    context.maximum_version = version
+    return context
+
+
+def _handshake(
+    tls: ServerTLS, client: ssl.SSLContext, session: Optional[ssl.SSLSession] = None
+) -> tuple[Optional[ssl.SSLSession], bool]:
+    """Connect `client` to `tls` over a socket pair; returns the client's session and whether it was resumed."""
+    server_end, client_end = socket.socketpair()
+    server_thread = threading.Thread(target=_serve_one_byte, args=(tls, server_end))
+    server_thread.start()
+    with client.wrap_socket(client_end, session=session) as tls_sock:
+        # TLS 1.3 tickets arrive after the handshake, with the first application data.
+        tls_sock.recv(1)
+        result = tls_sock.session, tls_sock.session_reused
+    server_thread.join()
+    return result
+
+
+def _serve_one_byte(tls: ServerTLS, sock: socket.socket):
+    with tls.wrap(sock) as tls_sock:
+        tls_sock.sendall(b"x")
+        # Like the servers, end the session cleanly, or OpenSSL drops it from its session cache.
+        tls_sock.settimeout(0)
+        try:
+            tls_sock.unwrap()
+        except OSError:
+            pass
@@ -1,27 +1,67 @@
 from concurrent.futures import ThreadPoolExecutor, as_completed
+import os
+import shutil
+import signal
+import tempfile
 import time
+from typing import Optional
 
 from toy_dns_server.config.loader import ConfigLoader, ConfigSchema
 from toy_dns_server.log.logger import Logger
 from toy_dns_server.log.base_logger import base_logger
+from toy_dns_server.resolver.dns_resolver import DNSResolver
 from toy_dns_server.server.dns.server import DNSServer
 from toy_dns_server.server.doh.server import DoHServer
 
 from toy_dns_server.metrics.exporter import Exporter
+from toy_dns_server.supervisor import WorkerSupervisor
+
+
+def _run_worker(root_dir: str, config: ConfigSchema, worker_index: int):
+    # Ctrl+C is delivered to the whole process group; shutdown is coordinated by the supervisor instead.
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, _handle_worker_termination)
+    Bootstraper(root_dir).run_worker(_worker_config(config, worker_index), worker_index)
+
+
+def _worker_config(config: ConfigSchema, worker_index: int) -> ConfigSchema:
+    # A per-process memory cache holds different entries in every worker; a shared snapshot file
+    # would only keep whichever worker wrote it last.
+    cache = config.resolver.cache
+    if cache.backend != "memory" or not cache.snapshot.enabled:
+        return config
+
+    snapshot = cache.snapshot.model_copy(update={"path": f"{cache.snapshot.path}.worker{worker_index}"})
+    resolver = config.resolver.model_copy(update={"cache": cache.model_copy(update={"snapshot": snapshot})})
+    return config.model_copy(update={"resolver": resolver})
+
+
+def _handle_worker_termination(_signum, _frame):
+    # Take the same graceful path as Ctrl+C, but only once.
+    signal.signal(signal.SIGTERM, signal.SIG_IGN)
+    raise KeyboardInterrupt
+
 
 class Bootstraper():
     _logger: Logger
     _running: bool = False
+    _stopping: bool = False
     _config: ConfigSchema
     _dns_server: DNSServer
+    _resolver: Optional[DNSResolver] = None
     _root_dir: str
     _executor: ThreadPoolExecutor
     _futures: list = []
+    _supervisor: Optional[WorkerSupervisor] = None
+    _metrics_dir: Optional[str] = None
+    _owns_metrics_dir: bool = False
 
     def __init__(self, root_dir: str):
         self._logger = Logger(self)
         self._root_dir = root_dir
         self._executor = ThreadPoolExecutor(max_workers=2)  # One for DNS, one for DoH
+        self.__dns_server = None
+        self.__doh_server = None
         self._logger.info("Bootstraper initialized.")
 
     def run(self):
@@ -39,15 +79,44 @@ class Bootstraper():
         self._load_config()
 
         self._configure_logging()
+
+        if self._config.server.workers > 1:
+            self._run_workers()
+            return
+
         self._start_metrics_server()
+        self._start_resolver()
         self._start_dns_server()
         self._start_doh_server()
 
         self._logger.info("Bootstraper finished.")
         self._monitor_threads()
 
+    def run_worker(self, config: ConfigSchema, worker_index: int):
+        """
+        Run the DNS and DoH servers of a single worker process and block until they stop.
+        """
+        self._config = config
+        self._configure_logging()
+
+        self._logger.info(f"Running worker {worker_index}...")
+        self._start_resolver()
+        self._start_dns_server()
+        self._start_doh_server()
+
+        self._monitor_threads()
+
     def stop(self):
+        if self._stopping:
+            return
+
+        self._stopping = True
         self._logger.info("Stopping bootstraper...")
+        if self._supervisor is not None:
+            self._logger.debug("Stopping worker processes...")
+            self._supervisor.stop()
+            self._cleanup_multiprocess_metrics()
+
         if self.__dns_server is not None:
             self._logger.debug("Stopping DNS server...")
             self.__dns_server.stop()
@@ -56,6 +125,10 @@ class Bootstraper():
             self._logger.debug("Stopping DoH server...")
             self.__doh_server.stop()
 
+        if self._resolver is not None:
+            self._logger.debug("Closing resolver...")
+            self._resolver.close()
+
         self._logger.debug("Shutting down thread pool executor...")
         self._executor.shutdown(wait=True)
         self._logger.info("Bootstraper stopped.")
@@ -69,6 +142,11 @@ class Bootstraper():
             base_logger.handle_configuration_error()
             raise e
 
+    def _start_resolver(self):
+        # A single resolver is shared by the DNS and DoH servers, so both frontends use the same cache.
+        self._logger.info("Starting resolver...")
+        self._resolver = DNSResolver(self._config.resolver)
+
     def _start_dns_server(self):
         if self._config.server.dns is None:
             self._logger.warn("No DNS server configuration provided. Skipping DNS server initialization.")
@@ -78,7 +156,7 @@ class Bootstraper():
             self._logger.info("DNS server is disabled. Skipping DNS server initialization.")
 
         self._logger.info("Starting DNS server...")
-        self.__dns_server = DNSServer(self._config)
+        self.__dns_server = DNSServer(self._config, self._resolver)
 
         future = self._executor.submit(self.__dns_server.run)
         self._futures.append(future)
@@ -94,22 +172,62 @@ class Bootstraper():
 
         if self._config.server.doh:
             self._logger.info("Starting DoH server...")
-            self.__doh_server = DoHServer(self._config)
+            self.__doh_server = DoHServer(self._config, self._resolver)
 
             future = self._executor.submit(self.__doh_server.run)
             self._futures.append(future)
 
-    def _start_metrics_server(self):
+    def _run_workers(self):
+        workers = self._config.server.workers
+        self._logger.info(f"Running in multi-process mode with {workers} workers...")
+
+        metrics_server = self._start_metrics_server(multiprocess=True)
+        on_worker_exit = metrics_server.mark_process_dead if metrics_server else None
+
+        self._supervisor = WorkerSupervisor(
+            workers,
+            _run_worker,
+            (self._root_dir, self._config),
+            on_worker_exit=on_worker_exit,
+        )
+
+        try:
+            self._supervisor.run()
+        except KeyboardInterrupt:
+            self._logger.debug("Received KeyboardInterrupt. Stopping workers.")
+            self.stop()
+
+    def _start_metrics_server(self, multiprocess: bool = False) -> Optional[Exporter]:
         if self._config.metrics is None:
             self._logger.warn("No metrics server configuration provided. Skipping metrics server initialization.")
-            return
+            return None
 
         if not self._config.metrics.enabled:
             self._logger.info("Metrics server is disabled. Skipping metrics server initialization.")
-            return
+            return None
+
+        if multiprocess:
+            self._prepare_multiprocess_metrics()
 
-        metrics_server = Exporter(self._config.metrics)
+        metrics_server = Exporter(self._config.metrics, self._metrics_dir)
         metrics_server.run()
+        return metrics_server
+
+    def _prepare_multiprocess_metrics(self):
+        # Must be set before the workers are spawned: prometheus_client picks the
+        # multiprocess value storage when it is first imported.
+        self._metrics_dir = os.environ.get("PROMETHEUS_MULTIPROC_DIR")
+        if not self._metrics_dir:
+            self._metrics_dir = tempfile.mkdtemp(prefix="toy-dns-metrics-")
+            self._owns_metrics_dir = True
+            os.environ["PROMETHEUS_MULTIPROC_DIR"] = self._metrics_dir
+
+        self._logger.debug(f"Using `{self._metrics_dir}` for multi-process metrics")
+
+    def _cleanup_multiprocess_metrics(self):
+        if self._owns_metrics_dir and self._metrics_dir:
+            shutil.rmtree(self._metrics_dir, ignore_errors=True)
+            self._owns_metrics_dir = False
 
     def _configure_logging(self):
         base_logger.reconfigure_logger(self._config.logging)
@@ -0,0 +1,33 @@
+from typing import Optional
+
+from toy_dns_server.cache.entry import CacheEntry
+
+
+class CacheBackend:
+    """Storage behind `DNSCache`.
+
+    `DNSCache` decides what to cache and for how long; a backend only stores entries and evicts
+    them when it runs out of room. An entry is kept until `retention_seconds` after it expires, so
+    the cache can still serve it stale. Backends must be safe for concurrent use.
+    """
+
+    def get(self, key: str, now: float) -> Optional[CacheEntry]:
+        """Return the entry for `key`, unless there is none or its retention period is over."""
+        raise NotImplementedError
+
+    def set(self, key: str, entry: CacheEntry, now: float):
+        raise NotImplementedError
+
+    def touch(self, key: str, entry: CacheEntry) -> int:
+        """Record a hit on `entry` and return its hit count."""
+        raise NotImplementedError
+
+    def mark_refreshing(self, key: str, entry: CacheEntry) -> bool:
+        """Flag `entry` as being refreshed. Returns False if it already was."""
+        raise NotImplementedError
+
+    def items(self) -> list[tuple[str, CacheEntry]]:
+        raise NotImplementedError
+
+    def close(self):
+        pass
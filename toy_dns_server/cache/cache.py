@@ -1,78 +1,358 @@
+import itertools
+import os
+import struct
+import threading
 import time
-from typing import Literal, Optional, Union
+from typing import Callable, Optional
 
-from dnslib import DNSRecord
+from toy_dns_server.cache.backend import CacheBackend
+from toy_dns_server.cache.entry import CacheEntry
+from toy_dns_server.cache.memory_backend import MemoryBackend
+from toy_dns_server.cache.shared_memory_backend import SharedMemoryBackend
+from toy_dns_server.cache.snapshot import SnapshotReader, encode_record, write_snapshot
+from toy_dns_server.codec.response import HEADER_SIZE, ResponseLayout, question_query, same_question, scan_response
+from toy_dns_server.config.schema import CacheConfig
 from toy_dns_server.log.logger import Logger
+from toy_dns_server.metrics.metrics import (
+    dns_cache_lookup_counter,
+    dns_cache_shared_hit_counter,
+    dns_prefetch_saved_hit_counter,
+)
+
+_ID = struct.Struct("!H")
+_TTL = struct.Struct("!I")
+
 
 class DNSCache:
-    def __init__(self, ttl_seconds: Union[int, Literal["auto"]], max_entries: int):
+    """DNS response cache.
+
+    Entries live in a backend: a process-local LRU store, or a table in shared memory that all
+    worker processes on the host use together.
+
+    NXDOMAIN and NODATA answers are cached as negative entries, with the TTL taken from the SOA
+    record in their authority section (RFC 2308).
+
+    Expired entries are kept for the configured stale window, so `get_stale` can still answer from
+    them when upstream resolution fails or is slow.
+
+    With snapshots enabled, the entries are written to disk periodically and on `close`. A new
+    cache maps the previous snapshot and only indexes it; records are copied into the backend when
+    they are first looked up.
+
+    With prefetching enabled, a hit on a popular entry close to its expiry hands the entry's
+    question to the refresh handler, which is expected to re-query upstream and `set` the result.
+    """
+
+    _logger: Logger
+    _backend: CacheBackend
+    _refresh_handler: Optional[Callable[[str, bytes], None]] = None
+    _snapshot: Optional[SnapshotReader] = None
+    _snapshot_path: Optional[str] = None
+
+    def __init__(self, config: CacheConfig):
         self._logger = Logger(self)
-        self._use_auto_ttl = ttl_seconds == "auto"
-        self._default_ttl = ttl_seconds if isinstance(ttl_seconds, int) else None
-        self._max_entries = max_entries
-        self._store: dict[str, tuple[bytes, float]] = {}
+        self._use_auto_ttl = config.ttl_seconds == "auto"
+        self._default_ttl = config.ttl_seconds if isinstance(config.ttl_seconds, int) else None
+        self._max_entries = config.max_entries
+        self._prefetch_enabled = config.prefetch.enabled
+        self._prefetch_window = config.prefetch.threshold_percent / 100
+        self._prefetch_min_hits = config.prefetch.min_hits
+        self._stale_window = config.stale.window_seconds if config.stale.enabled else 0
+        self._stale_answer_ttl = config.stale.answer_ttl_seconds
+        self._negative_enabled = config.negative.enabled
+        self._negative_max_ttl = config.negative.max_ttl_seconds
+        self._lookup_counters = {}
+        self._backend = self._create_backend(config)
+        self._lock = threading.Lock()
+        self._closed = threading.Event()
+        self._snapshot_index: dict[str, int] = {}
+        self._snapshot_threads: list[threading.Thread] = []
+        if config.snapshot.enabled:
+            self._snapshot_path = config.snapshot.path
+            self._snapshot_interval = config.snapshot.interval_seconds
+            self._start_snapshot_threads()
 
-        self._logger.info(f"DNS cache initialized with max entries: {max_entries}")
+        self._logger.info(f"DNS cache initialized with {config.backend} backend and max entries: {self._max_entries}")
 
-    def set(self, key: str, response_data: bytes):
-        record = DNSRecord.parse(response_data)
-        min_ttl = min([rr.ttl for rr in record.rr]) if record.rr else None
-        if min_ttl is None:
+    def set_refresh_handler(self, handler: Callable[[str, bytes], None]):
+        """Register `handler(key, query_data)`, called when a hot entry should be refreshed ahead of expiry."""
+        self._refresh_handler = handler
+
+    def set(self, key: str, question: bytes, response_data: bytes, cached_by: str = "dns"):
+        """Cache `response_data`, the answer to the query whose wire question section is `question`."""
+        try:
+            layout = scan_response(response_data)
+        except ValueError as e:
+            self._logger.warn(f"Malformed response, not caching it for key {key}: {e}")
+            return
+
+        if not same_question(response_data[HEADER_SIZE:layout.question_end], question):
+            self._logger.warn(f"Response does not answer the question of the query, not caching it for key {key}")
+            return
+
+        if layout.is_negative:
+            ttl = self._negative_ttl(key, layout)
+            if ttl is None:
+                return
+        elif layout.min_answer_ttl is None:
             self._logger.warn(f"TTL is None, not caching response for key: {key}")
             return
+        else:
+            ttl = layout.min_answer_ttl if self._use_auto_ttl else self._default_ttl
 
-        expire_at = time.time() + min_ttl
-        self._ensure_store_capacity()
+        now = time.time()
+        if self._snapshot_index:
+            with self._lock:
+                self._snapshot_index.pop(key, None)
+
+        previous = self._backend.get(key, now)
+        refreshed_after = previous.expires_at if previous is not None and previous.refreshing else None
+        entry = CacheEntry(
+            bytes(response_data),
+            now + ttl,
+            ttl,
+            layout.ttl_offsets,
+            layout.question_end,
+            negative=layout.is_negative,
+            cached_by=cached_by,
+            refreshed_after=refreshed_after,
+        )
+        self._backend.set(key, entry, now)
 
-        self._store[key] = (response_data, expire_at)
-        self._logger.debug(f"Added entry {key} to cache with TTL {min_ttl}s")
+        self._logger.debug(f"Added entry {key} to cache with TTL {ttl}s")
 
-    def get(self, key: str) -> Optional[DNSRecord]:
-        entry = self._store.get(key)
+    def get(self, key: str, question: bytes, transaction_id: int, handler_type: str = "dns") -> Optional[bytes]:
+        """Return the cached answer to the query with the wire question section `question`."""
+        now = time.time()
+        entry = self._hit(key, question, now, handler_type)
+        if entry is None:
+            return None
+
+        self._logger.debug(f"Entry for {key} found in cache")
+        return self._format_response(entry, transaction_id, max(0, int(entry.expires_at - now - 1)))
+
+    def record_hit(self, key: str, question: bytes, handler_type: str = "dns"):
+        """Count a hit on the entry for `key` without building an answer from it.
+
+        For hits answered by a cache in front of this one, so they still drive prefetching.
+        """
+        self._hit(key, question, time.time(), handler_type)
+
+    def _hit(self, key: str, question: bytes, now: float, handler_type: str) -> Optional[CacheEntry]:
+        """Return the live entry for `key`, recording the hit, or None on a miss."""
+        entry = self._lookup(key, question, now)
         if not entry:
             self._logger.debug(f"No entry found in cache for key: {key}")
+            self._count_lookup("miss", None, handler_type)
             return None
 
-        response_data, expires_at = entry
-        if time.time() >= expires_at:
+        if now >= entry.expires_at:
             self._logger.debug(f"Entry for {key} has expired")
-            del self._store[key]
+            self._count_lookup("miss", entry, handler_type)
             return None
 
-        self._logger.debug(f"Entry for {key} found in cache")
-        return self._format_response(response_data, expires_at)
+        self._count_lookup("hit", entry, handler_type)
+        hits = self._backend.touch(key, entry)
+        refresh = (
+            self._prefetch_enabled
+            and self._should_refresh(entry, hits, now)
+            and self._backend.mark_refreshing(key, entry)
+        )
+
+        if entry.refreshed_after is not None and now >= entry.refreshed_after:
+            dns_prefetch_saved_hit_counter.inc()
+
+        if refresh and self._refresh_handler is not None:
+            self._logger.debug(f"Entry for {key} is close to expiry, scheduling a refresh")
+            self._refresh_handler(key, question_query(entry.response_data, entry.question_end))
+
+        return entry
 
-    def _format_response(self, response_data: bytes, expires_at) -> DNSRecord:
-        record = DNSRecord.parse(response_data)
-        self._adjust_ttl(record, expires_at)
-        return record
+    def get_stale(self, key: str, question: bytes, transaction_id: int, handler_type: str = "dns") -> Optional[bytes]:
+        """Return the entry for `key` even if it has expired, as long as it is within the stale window.
 
-    def _adjust_ttl(self, record: DNSRecord, expires_at) -> DNSRecord:
+        Expired entries are answered with the configured stale answer TTL.
+        """
         now = time.time()
-        remaining_ttl = max(0, int(expires_at - now - 1))
+        entry = self._lookup(key, question, now)
+        if not entry:
+            return None
+
+        if now < entry.expires_at:
+            return self._format_response(entry, transaction_id, max(0, int(entry.expires_at - now - 1)))
+
+        self._logger.debug(f"Serving stale entry for {key}")
+        self._count_lookup("stale", entry, handler_type)
+        return self._format_response(entry, transaction_id, self._stale_answer_ttl)
 
-        for section in [record.rr, record.auth, record.ar]:
-            for rr in section:
-                rr.ttl = remaining_ttl
+    def close(self):
+        if self._closed.is_set():
+            return
 
-        return record
+        self._closed.set()
+        for thread in self._snapshot_threads:
+            thread.join()
 
+        if self._snapshot_path:
+            self.dump_snapshot()
 
-    def _ensure_store_capacity(self):
-        if len(self._store) >= self._max_entries:
-            self._delete_expired_entries()
+        with self._lock:
+            snapshot = self._snapshot
+            self._snapshot = None
+            self._snapshot_index = {}
 
-        if len(self._store) >= self._max_entries:
-            self._delete_entry_with_closest_expiration()
+        if snapshot is not None:
+            snapshot.close()
 
-    def _delete_entry_with_closest_expiration(self):
-        self._logger.warn("Cache is full, removing entry with the closest expiration time")
-        min_key = min(self._store, key=lambda k: self._store[k][1])
-        del self._store[min_key]
+        self._backend.close()
 
-    def _delete_expired_entries(self):
-        self._logger.debug("Deleting expired cache entries")
+    def dump_snapshot(self):
+        """Write all live entries, including those not yet restored from the previous snapshot, to disk."""
         now = time.time()
-        expired_keys = [k for k, (_, t) in self._store.items() if now >= t]
-        for k in expired_keys:
-            del self._store[k]
+        entries = self._backend.items()
+        with self._lock:
+            snapshot = self._snapshot
+            restorable = list(self._snapshot_index.values())
+
+        records = (encode_record(key, entry) for key, entry in entries if self._removal_time(entry) > now)
+        if snapshot is not None:
+            records = itertools.chain(records, (
+                snapshot.record(offset)
+                for offset in restorable
+                if snapshot.expires_at(offset) + self._stale_window > now
+            ))
+
+        try:
+            count = write_snapshot(self._snapshot_path, records)
+        except (OSError, ValueError) as e:
+            self._logger.error(f"Failed to write cache snapshot to {self._snapshot_path}: {e}")
+            return
+
+        self._logger.info(f"Wrote {count} cache entries to snapshot {self._snapshot_path}")
+
+    def _create_backend(self, config: CacheConfig) -> CacheBackend:
+        if config.backend == "memory":
+            return MemoryBackend(config.max_entries, self._stale_window)
+        elif config.backend == "shared_memory":
+            return SharedMemoryBackend(
+                config.shared_memory.path,
+                config.max_entries,
+                config.shared_memory.slot_size_bytes,
+                self._stale_window,
+            )
+        else:
+            raise ValueError(f"Unsupported cache backend: {config.backend}")
+
+    def _lookup(self, key: str, question: bytes, now: float) -> Optional[CacheEntry]:
+        """Return the entry for `key`, unless it answers a question other than `question`."""
+        entry = self._find(key, now)
+        if entry is not None and not same_question(entry.response_data[HEADER_SIZE:entry.question_end], question):
+            self._logger.warn(f"Cached entry for {key} answers another question, ignoring it")
+            return None
+
+        return entry
+
+    def _find(self, key: str, now: float) -> Optional[CacheEntry]:
+        """Return the entry for `key`, restoring it from the snapshot if needed."""
+        entry = self._backend.get(key, now)
+        if entry is not None or not self._snapshot_index:
+            return entry
+
+        with self._lock:
+            offset = self._snapshot_index.pop(key, None)
+            snapshot = self._snapshot
+
+        if offset is None:
+            return None
+
+        entry = snapshot.entry(offset)
+        if now >= self._removal_time(entry):
+            return None
+
+        self._backend.set(key, entry, now)
+        return entry
+
+    def _count_lookup(self, result: str, entry: Optional[CacheEntry], handler_type: str):
+        entry_type = "none" if entry is None else "negative" if entry.negative else "positive"
+        counter = self._lookup_counters.get((result, entry_type, handler_type))
+        if counter is None:
+            counter = dns_cache_lookup_counter.labels(result, entry_type, handler_type)
+            self._lookup_counters[result, entry_type, handler_type] = counter
+
+        counter.inc()
+        if result == "hit" and entry.cached_by != handler_type:
+            dns_cache_shared_hit_counter.labels(handler_type, entry.cached_by).inc()
+
+    def _negative_ttl(self, key: str, layout: ResponseLayout) -> Optional[int]:
+        if not self._negative_enabled:
+            self._logger.debug(f"Negative caching is disabled, not caching response for key: {key}")
+            return None
+
+        if layout.negative_ttl is None:
+            self._logger.debug(f"Negative response has no SOA record, not caching it for key: {key}")
+            return None
+
+        return min(layout.negative_ttl, self._negative_max_ttl)
+
+    def _should_refresh(self, entry: CacheEntry, hits: int, now: float) -> bool:
+        return (
+            not entry.refreshing
+            and hits >= self._prefetch_min_hits
+            and entry.expires_at - now <= entry.ttl * self._prefetch_window
+        )
+
+    def _removal_time(self, entry: CacheEntry) -> float:
+        return entry.expires_at + self._stale_window
+
+    def _format_response(self, entry: CacheEntry, transaction_id: int, ttl: int) -> bytes:
+        # Patch the cached wire bytes in place of a parse/pack round trip through dnslib.
+        response = bytearray(entry.response_data)
+        _ID.pack_into(response, 0, transaction_id)
+
+        for offset in entry.ttl_offsets:
+            _TTL.pack_into(response, offset, ttl)
+
+        return bytes(response)
+
+    def _start_snapshot_threads(self):
+        if os.path.exists(self._snapshot_path):
+            self._snapshot_threads.append(
+                threading.Thread(target=self._load_snapshot, name="cache-snapshot-loader", daemon=True)
+            )
+
+        self._snapshot_threads.append(
+            threading.Thread(target=self._snapshot_loop, name="cache-snapshot", daemon=True)
+        )
+        for thread in self._snapshot_threads:
+            thread.start()
+
+    def _load_snapshot(self):
+        try:
+            snapshot = SnapshotReader(self._snapshot_path)
+        except (OSError, ValueError) as e:
+            self._logger.warn(f"Failed to load cache snapshot from {self._snapshot_path}: {e}")
+            return
+
+        try:
+            index = snapshot.index(keep_after=time.time() - self._stale_window, limit=self._max_entries)
+        except ValueError as e:
+            self._logger.warn(f"Failed to index cache snapshot {self._snapshot_path}: {e}")
+            snapshot.close()
+            return
+
+        with self._lock:
+            if self._closed.is_set():
+                snapshot.close()
+                return
+
+            self._snapshot = snapshot
+            # Entries cached while the snapshot was being indexed are newer than their snapshot copies.
+            self._snapshot_index = {key: offset for key, offset in index.items() if self._backend.get(key, 0) is None}
+
+        self._logger.info(
+            f"Loaded cache snapshot {self._snapshot_path}: {len(index)} of {snapshot.record_count} entries are still valid"
+        )
+
+    def _snapshot_loop(self):
+        while not self._closed.wait(self._snapshot_interval):
+            self.dump_snapshot()
@@ -0,0 +1,32 @@
+from typing import Optional
+
+
+class CacheEntry:
+    __slots__ = (
+        "response_data", "expires_at", "ttl", "ttl_offsets", "question_end",
+        "negative", "cached_by", "hits", "refreshing", "refreshed_after",
+    )
+
+    def __init__(
+        self,
+        response_data: bytes,
+        expires_at: float,
+        ttl: int,
+        ttl_offsets: tuple[int, ...],
+        question_end: int,
+        negative: bool = False,
+        cached_by: str = "dns",
+        refreshed_after: Optional[float] = None,
+    ):
+        self.response_data = response_data
+        self.expires_at = expires_at
+        self.ttl = ttl
+        self.ttl_offsets = ttl_offsets
+        self.question_end = question_end
+        self.negative = negative
+        # Frontend (handler type) of the query whose response populated the entry.
+        self.cached_by = cached_by
+        self.hits = 0
+        self.refreshing = False
+        # Expiry time of the entry this one replaced through a prefetch; hits after it were saved a miss.
+        self.refreshed_after = refreshed_after
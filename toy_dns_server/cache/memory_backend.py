@@ -0,0 +1,142 @@
+import heapq
+import threading
+import time
+from collections import OrderedDict
+from typing import Optional
+
+from toy_dns_server.cache.backend import CacheBackend
+from toy_dns_server.cache.entry import CacheEntry
+from toy_dns_server.log.logger import Logger
+
+
+class MemoryBackend(CacheBackend):
+    """Process-local cache storage with LRU eviction.
+
+    Removal times are tracked in a min-heap, so entries past their retention period can be found
+    without scanning the store. A background sweeper removes them in small batches; the insert
+    path only evicts when the store is full. The heap is never updated in place, so the sweeper
+    also compacts it once it has grown well past the store, a batch at a time.
+    """
+    SWEEP_INTERVAL_SECONDS = 1.0
+    SWEEP_BATCH_SIZE = 1000
+
+    _logger: Logger
+
+    def __init__(self, max_entries: int, retention_seconds: float):
+        self._logger = Logger(self)
+        self._max_entries = max_entries
+        self._retention_seconds = retention_seconds
+        self._store: OrderedDict[str, CacheEntry] = OrderedDict()
+        self._expiry_heap: list[tuple[float, str]] = []
+        # The heap being compacted into `_expiry_heap`, if any.
+        self._draining_heap: list[tuple[float, str]] = []
+        self._lock = threading.Lock()
+        self._closed = threading.Event()
+        self._sweeper = threading.Thread(target=self._sweep_loop, name="cache-sweeper", daemon=True)
+        self._sweeper.start()
+
+    def get(self, key: str, now: float) -> Optional[CacheEntry]:
+        with self._lock:
+            entry = self._store.get(key)
+            if entry is not None and now >= self._removal_time(entry):
+                del self._store[key]
+                return None
+
+            return entry
+
+    def set(self, key: str, entry: CacheEntry, now: float):
+        with self._lock:
+            if key not in self._store:
+                self._ensure_store_capacity(now)
+
+            self._store[key] = entry
+            self._store.move_to_end(key)
+            heapq.heappush(self._expiry_heap, (self._removal_time(entry), key))
+
+    def touch(self, key: str, entry: CacheEntry) -> int:
+        with self._lock:
+            if self._store.get(key) is entry:
+                self._store.move_to_end(key)
+
+            entry.hits += 1
+            return entry.hits
+
+    def mark_refreshing(self, key: str, entry: CacheEntry) -> bool:
+        with self._lock:
+            if entry.refreshing:
+                return False
+
+            entry.refreshing = True
+            return True
+
+    def items(self) -> list[tuple[str, CacheEntry]]:
+        with self._lock:
+            return list(self._store.items())
+
+    def close(self):
+        self._closed.set()
+        self._sweeper.join()
+
+    def _removal_time(self, entry: CacheEntry) -> float:
+        return entry.expires_at + self._retention_seconds
+
+    def _ensure_store_capacity(self, now: float):
+        if len(self._store) < self._max_entries:
+            return
+
+        if self._delete_expired_entries(now, limit=1):
+            return
+
+        self._logger.debug("Cache is full, evicting the least recently used entry")
+        self._store.popitem(last=False)
+
+    def _delete_expired_entries(self, now: float, limit: int) -> int:
+        """Pop up to `limit` expired entries off the expiry heap. Must be called with the lock held."""
+        deleted = 0
+        heap = self._expiry_heap
+        while heap and deleted < limit and heap[0][0] <= now:
+            removal_time, key = heapq.heappop(heap)
+            entry = self._store.get(key)
+            # The heap is never updated in place; skip items left behind by overwritten or evicted entries.
+            if entry is not None and self._removal_time(entry) == removal_time:
+                del self._store[key]
+                deleted += 1
+
+        return deleted
+
+    def _compact_expiry_heap_step(self) -> bool:
+        """Move a batch of items to a fresh heap, dropping the ones left behind by overwritten or
+        evicted entries. Returns whether compaction is still in progress. Must be called with the
+        lock held."""
+        if not self._draining_heap:
+            if len(self._expiry_heap) <= 2 * len(self._store) + self.SWEEP_BATCH_SIZE:
+                return False
+            self._draining_heap, self._expiry_heap = self._expiry_heap, []
+
+        old_heap = self._draining_heap
+        for _ in range(min(self.SWEEP_BATCH_SIZE, len(old_heap))):
+            removal_time, key = heapq.heappop(old_heap)
+            entry = self._store.get(key)
+            if entry is not None and self._removal_time(entry) == removal_time:
+                heapq.heappush(self._expiry_heap, (removal_time, key))
+
+        return bool(old_heap)
+
+    def _sweep_loop(self):
+        while not self._closed.wait(self.SWEEP_INTERVAL_SECONDS):
+            deleted = self._sweep_expired_entries()
+            if deleted:
+                self._logger.debug(f"Swept {deleted} expired cache entries")
+
+    def _sweep_expired_entries(self) -> int:
+        total = 0
+        while not self._closed.is_set():
+            with self._lock:
+                deleted = self._delete_expired_entries(time.time(), self.SWEEP_BATCH_SIZE)
+                compacting = self._compact_expiry_heap_step()
+
+            total += deleted
+            if deleted < self.SWEEP_BATCH_SIZE and not compacting:
+                return total
+
+        return total
@@ -0,0 +1,290 @@
+import fcntl
+import hashlib
+import mmap
+import os
+import struct
+import threading
+from typing import Optional
+
+from toy_dns_server.cache.backend import CacheBackend
+from toy_dns_server.cache.entry import CacheEntry
+from toy_dns_server.log.logger import Logger
+
+MAGIC = b"TDNSSHM2"
+FLAG_NEGATIVE = 0x01
+FLAG_REFRESHING = 0x02
+CACHED_BY = ("dns", "doh", "prefetch", "snapshot")
+
+# magic, slot count, slot size
+_FILE_HEADER = struct.Struct("=8sII")
+_FILE_HEADER_SIZE = 64
+# seq, hits, key hash, expires_at, refreshed_after, ttl, question_end, key length, data length,
+# TTL offset count, flags, cached_by
+_SLOT_HEADER = struct.Struct("=IIQddIHHHHBB")
+_SLOT_PAYLOAD_OFFSET = 48
+_SEQ = struct.Struct("=I")
+_HITS_OFFSET = 4
+_KEY_HASH = struct.Struct("=Q")
+_KEY_HASH_OFFSET = 8
+_FLAGS_OFFSET = 44
+# Lengths and counts are stored as unsigned shorts.
+_MAX_FIELD = 0xFFFF
+
+
+class SharedCacheEntry(CacheEntry):
+    """A copy of an entry read from a shared slot, remembering where it came from."""
+    __slots__ = ("slot_offset", "version")
+
+
+class SharedMemoryBackend(CacheBackend):
+    """Cache storage in a memory-mapped file shared by every process on the host.
+
+    The file holds a fixed-size, open-addressed hash table. A key hashes to a slot and may live in
+    any of the next `PROBE_LIMIT` slots; when they are all taken, the entry expiring soonest is
+    replaced. Each slot is guarded by a sequence lock: writers make the sequence number odd while
+    they rewrite the slot, and readers retry when it was odd or changed during their copy, so reads
+    never take a lock. Writers serialize on a lock over the probe window, held with `lockf` so it
+    also excludes other processes.
+    """
+    PROBE_LIMIT = 8
+    READ_RETRIES = 4
+
+    _logger: Logger
+
+    def __init__(self, path: str, slot_count: int, slot_size: int, retention_seconds: float):
+        self._logger = Logger(self)
+        self._slot_count = slot_count
+        self._slot_size = slot_size
+        self._payload_capacity = slot_size - _SLOT_PAYLOAD_OFFSET
+        self._retention_seconds = retention_seconds
+        # lockf locks belong to the process, so threads of this process also need a lock of their own.
+        self._write_lock = threading.Lock()
+        # The table has PROBE_LIMIT extra slots at the end, so a probe window never wraps around.
+        size = _FILE_HEADER_SIZE + (slot_count + self.PROBE_LIMIT) * slot_size
+        self._fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+        try:
+            self._initialize_file(size)
+            self._mmap = mmap.mmap(self._fd, size)
+        except BaseException:
+            os.close(self._fd)
+            raise
+
+        self._logger.info(f"Shared memory cache mapped from {path} with {slot_count} slots of {slot_size} bytes")
+
+    def get(self, key: str, now: float) -> Optional[CacheEntry]:
+        encoded_key = key.encode("utf-8")
+        key_hash = _hash_key(encoded_key)
+        for offset in self._probe_window(key_hash):
+            slot_hash = _KEY_HASH.unpack_from(self._mmap, offset + _KEY_HASH_OFFSET)[0]
+            if slot_hash == 0:
+                # Slots are never emptied, so the key cannot be further along the window.
+                return None
+
+            if slot_hash != key_hash:
+                continue
+
+            slot = self._read_slot(offset)
+            if slot is None or slot[0] != encoded_key:
+                continue
+
+            entry = slot[1]
+            if now >= entry.expires_at + self._retention_seconds:
+                return None
+
+            return entry
+
+        return None
+
+    def set(self, key: str, entry: CacheEntry, now: float):
+        encoded_key = key.encode("utf-8")
+        payload_size = len(encoded_key) + 2 * len(entry.ttl_offsets) + len(entry.response_data)
+        if payload_size > self._payload_capacity:
+            self._logger.debug(f"Response for {key} does not fit into a shared cache slot, not caching it")
+            return
+
+        if max(len(encoded_key), len(entry.response_data), len(entry.ttl_offsets), entry.question_end) > _MAX_FIELD:
+            self._logger.debug(f"Response for {key} exceeds the field limits of a shared cache slot, not caching it")
+            return
+
+        key_hash = _hash_key(encoded_key)
+        window = self._probe_window(key_hash)
+        window_start = window[0]
+        window_length = self.PROBE_LIMIT * self._slot_size
+        with self._write_lock:
+            fcntl.lockf(self._fd, fcntl.LOCK_EX, window_length, window_start)
+            try:
+                offset = self._choose_slot(window, key_hash, encoded_key, now)
+                self._write_slot(offset, key_hash, encoded_key, entry)
+            finally:
+                fcntl.lockf(self._fd, fcntl.LOCK_UN, window_length, window_start)
+
+    def touch(self, key: str, entry: CacheEntry) -> int:
+        # Hit counts only drive prefetching, so a racy increment that loses the odd hit is fine.
+        hits = entry.hits + 1
+        if isinstance(entry, SharedCacheEntry) and self._holds(entry):
+            _SEQ.pack_into(self._mmap, entry.slot_offset + _HITS_OFFSET, hits)
+
+        entry.hits = hits
+        return hits
+
+    def mark_refreshing(self, key: str, entry: CacheEntry) -> bool:
+        if not isinstance(entry, SharedCacheEntry) or not self._holds(entry):
+            return False
+
+        flags_offset = entry.slot_offset + _FLAGS_OFFSET
+        flags = self._mmap[flags_offset]
+        if flags & FLAG_REFRESHING:
+            return False
+
+        self._mmap[flags_offset] = flags | FLAG_REFRESHING
+        entry.refreshing = True
+        return True
+
+    def items(self) -> list[tuple[str, CacheEntry]]:
+        items = []
+        for index in range(self._slot_count + self.PROBE_LIMIT):
+            offset = _FILE_HEADER_SIZE + index * self._slot_size
+            if _KEY_HASH.unpack_from(self._mmap, offset + _KEY_HASH_OFFSET)[0] == 0:
+                continue
+
+            slot = self._read_slot(offset)
+            if slot is not None:
+                items.append((slot[0].decode("utf-8"), slot[1]))
+
+        return items
+
+    def close(self):
+        self._mmap.close()
+        os.close(self._fd)
+
+    def _initialize_file(self, size: int):
+        # Whole-file lock: the first process to start lays out the table, the others reuse it.
+        fcntl.lockf(self._fd, fcntl.LOCK_EX)
+        try:
+            header = _FILE_HEADER.pack(MAGIC, self._slot_count, self._slot_size)
+            current = os.pread(self._fd, _FILE_HEADER.size, 0)
+            if os.fstat(self._fd).st_size == size and current == header:
+                return
+
+            self._logger.info("Initializing shared memory cache file")
+            os.ftruncate(self._fd, 0)
+            os.ftruncate(self._fd, size)
+            os.pwrite(self._fd, header, 0)
+        finally:
+            fcntl.lockf(self._fd, fcntl.LOCK_UN)
+
+    def _probe_window(self, key_hash: int) -> range:
+        start = _FILE_HEADER_SIZE + (key_hash % self._slot_count) * self._slot_size
+        return range(start, start + self.PROBE_LIMIT * self._slot_size, self._slot_size)
+
+    def _holds(self, entry: SharedCacheEntry) -> bool:
+        return _SEQ.unpack_from(self._mmap, entry.slot_offset)[0] == entry.version
+
+    def _read_slot(self, offset: int) -> Optional[tuple[bytes, SharedCacheEntry]]:
+        for _ in range(self.READ_RETRIES):
+            seq = _SEQ.unpack_from(self._mmap, offset)[0]
+            if seq & 1:
+                continue
+
+            (
+                _, hits, _, expires_at, refreshed_after, ttl, question_end,
+                key_length, data_length, offset_count, flags, cached_by,
+            ) = _SLOT_HEADER.unpack_from(self._mmap, offset)
+            payload_start = offset + _SLOT_PAYLOAD_OFFSET
+            payload_end = payload_start + key_length + 2 * offset_count + data_length
+            if payload_end > offset + self._slot_size:
+                continue
+
+            payload = self._mmap[payload_start:payload_end]
+            if _SEQ.unpack_from(self._mmap, offset)[0] != seq:
+                continue
+
+            data_start = key_length + 2 * offset_count
+            entry = SharedCacheEntry(
+                payload[data_start:],
+                expires_at,
+                ttl,
+                struct.unpack_from(f"={offset_count}H", payload, key_length),
+                question_end,
+                negative=bool(flags & FLAG_NEGATIVE),
+                cached_by=CACHED_BY[cached_by - 1] if 0 < cached_by <= len(CACHED_BY) else "shared",
+                refreshed_after=refreshed_after or None,
+            )
+            entry.hits = hits
+            entry.refreshing = bool(flags & FLAG_REFRESHING)
+            entry.slot_offset = offset
+            entry.version = seq
+            return payload[:key_length], entry
+
+        return None
+
+    def _choose_slot(self, window: range, key_hash: int, encoded_key: bytes, now: float) -> int:
+        """Pick the slot to write. Must be called with the probe window locked."""
+        free = None
+        soonest, soonest_expiry = window[0], None
+        for offset in window:
+            slot_hash = _KEY_HASH.unpack_from(self._mmap, offset + _KEY_HASH_OFFSET)[0]
+            if slot_hash == 0:
+                return free if free is not None else offset
+
+            if _SEQ.unpack_from(self._mmap, offset)[0] & 1:
+                # With the window locked, nobody is writing here: a writer died halfway through.
+                if slot_hash == key_hash:
+                    return offset
+                if free is None:
+                    free = offset
+                continue
+
+            if slot_hash == key_hash:
+                slot = self._read_slot(offset)
+                if slot is not None and slot[0] == encoded_key:
+                    return offset
+
+            expires_at = _SLOT_HEADER.unpack_from(self._mmap, offset)[3]
+            if free is None and now >= expires_at + self._retention_seconds:
+                free = offset
+            elif soonest_expiry is None or expires_at < soonest_expiry:
+                soonest, soonest_expiry = offset, expires_at
+
+        if free is not None:
+            return free
+
+        self._logger.debug("Shared cache probe window is full, replacing the entry expiring soonest")
+        return soonest
+
+    def _write_slot(self, offset: int, key_hash: int, encoded_key: bytes, entry: CacheEntry):
+        seq = _SEQ.unpack_from(self._mmap, offset)[0]
+        if seq & 1:
+            # A writer died halfway through this slot; start from an even sequence number again.
+            seq += 1
+
+        _SEQ.pack_into(self._mmap, offset, (seq + 1) & 0xFFFFFFFF)
+        flags = FLAG_NEGATIVE if entry.negative else 0
+        cached_by = CACHED_BY.index(entry.cached_by) + 1 if entry.cached_by in CACHED_BY else 0
+        _SLOT_HEADER.pack_into(
+            self._mmap,
+            offset,
+            (seq + 1) & 0xFFFFFFFF,
+            0,
+            key_hash,
+            entry.expires_at,
+            entry.refreshed_after or 0.0,
+            entry.ttl,
+            entry.question_end,
+            len(encoded_key),
+            len(entry.response_data),
+            len(entry.ttl_offsets),
+            flags,
+            cached_by,
+        )
+        payload = encoded_key + struct.pack(f"={len(entry.ttl_offsets)}H", *entry.ttl_offsets) + entry.response_data
+        payload_start = offset + _SLOT_PAYLOAD_OFFSET
+        self._mmap[payload_start:payload_start + len(payload)] = payload
+        _SEQ.pack_into(self._mmap, offset, (seq + 2) & 0xFFFFFFFF)
+
+
+def _hash_key(encoded_key: bytes) -> int:
+    # Python's hash() is salted per process, so it cannot be shared between workers. Never zero,
+    # as a zero hash marks an empty slot.
+    key_hash = int.from_bytes(hashlib.blake2b(encoded_key, digest_size=8).digest(), "little")
+    return key_hash or 1
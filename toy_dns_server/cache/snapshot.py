@@ -0,0 +1,143 @@
+import mmap
+import os
+import struct
+from typing import Iterable
+
+from toy_dns_server.cache.entry import CacheEntry
+
+MAGIC = b"TDNSSNAP"
+VERSION = 1
+FLAG_NEGATIVE = 0x01
+
+# magic, version, record count
+_FILE_HEADER = struct.Struct("!8sHI")
+# expires_at, ttl, question_end, key length, data length, TTL offset count, flags
+_RECORD_HEADER = struct.Struct("!dIHHHHB")
+
+
+def encode_record(key: str, entry: CacheEntry) -> bytes:
+    """Serialize a cache entry: a fixed header, the key, the TTL offsets and the wire bytes."""
+    encoded_key = key.encode("utf-8")
+    flags = FLAG_NEGATIVE if entry.negative else 0
+    header = _RECORD_HEADER.pack(
+        entry.expires_at,
+        entry.ttl,
+        entry.question_end,
+        len(encoded_key),
+        len(entry.response_data),
+        len(entry.ttl_offsets),
+        flags,
+    )
+    offsets = struct.pack(f"!{len(entry.ttl_offsets)}H", *entry.ttl_offsets)
+    return header + encoded_key + offsets + entry.response_data
+
+
+def write_snapshot(path: str, records: Iterable[bytes]) -> int:
+    """Atomically replace the snapshot at `path` with the encoded `records`.
+
+    Returns:
+        The number of records written.
+    """
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+
+    temporary_path = f"{path}.{os.getpid()}.tmp"
+    count = 0
+    try:
+        with open(temporary_path, "wb") as file:
+            file.write(_FILE_HEADER.pack(MAGIC, VERSION, 0))
+            for record in records:
+                file.write(record)
+                count += 1
+
+            file.seek(0)
+            file.write(_FILE_HEADER.pack(MAGIC, VERSION, count))
+
+        os.replace(temporary_path, path)
+    except BaseException:
+        if os.path.exists(temporary_path):
+            os.remove(temporary_path)
+        raise
+
+    return count
+
+
+class SnapshotReader:
+    """Read-only, memory-mapped view of a snapshot file.
+
+    Only the record headers are read when indexing; the wire bytes of a record are copied out of
+    the mapping when the record is first used.
+    """
+
+    def __init__(self, path: str):
+        with open(path, "rb") as file:
+            self._mmap = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+
+        if len(self._mmap) < _FILE_HEADER.size:
+            self.close()
+            raise ValueError("Snapshot is shorter than its header")
+
+        magic, version, self.record_count = _FILE_HEADER.unpack_from(self._mmap)
+        if magic != MAGIC or version != VERSION:
+            self.close()
+            raise ValueError(f"Unsupported snapshot format (version {version})")
+
+    def index(self, keep_after: float, limit: int) -> dict[str, int]:
+        """Map the key of every record whose `expires_at` is later than `keep_after` to its offset.
+
+        Raises:
+            ValueError: If the snapshot is truncated.
+        """
+        index = {}
+        offset = _FILE_HEADER.size
+        for _ in range(self.record_count):
+            if len(index) >= limit:
+                break
+
+            expires_at, _, _, key_length, _, _, _ = self._unpack_header(offset)
+            if expires_at > keep_after:
+                key_start = offset + _RECORD_HEADER.size
+                index[self._mmap[key_start:key_start + key_length].decode("utf-8")] = offset
+
+            offset += self._record_length(offset)
+
+        return index
+
+    def entry(self, offset: int) -> CacheEntry:
+        expires_at, ttl, question_end, key_length, data_length, offset_count, flags = self._unpack_header(offset)
+        offsets_start = offset + _RECORD_HEADER.size + key_length
+        data_start = offsets_start + 2 * offset_count
+        return CacheEntry(
+            bytes(self._mmap[data_start:data_start + data_length]),
+            expires_at,
+            ttl,
+            struct.unpack_from(f"!{offset_count}H", self._mmap, offsets_start),
+            question_end,
+            negative=bool(flags & FLAG_NEGATIVE),
+            cached_by="snapshot",
+        )
+
+    def expires_at(self, offset: int) -> float:
+        return self._unpack_header(offset)[0]
+
+    def record(self, offset: int) -> bytes:
+        """Return the encoded record at `offset`, ready to be written to a new snapshot."""
+        return self._mmap[offset:offset + self._record_length(offset)]
+
+    def close(self):
+        self._mmap.close()
+
+    def _unpack_header(self, offset: int) -> tuple:
+        if offset + _RECORD_HEADER.size > len(self._mmap):
+            raise ValueError("Snapshot record is truncated")
+
+        return _RECORD_HEADER.unpack_from(self._mmap, offset)
+
+    def _record_length(self, offset: int) -> int:
+        _, _, _, key_length, data_length, offset_count, _ = self._unpack_header(offset)
+        length = _RECORD_HEADER.size + key_length + 2 * offset_count + data_length
+        if offset + length > len(self._mmap):
+            raise ValueError("Snapshot record is truncated")
+
+        return length
@@ -0,0 +1,155 @@
+import struct
+from typing import Optional
+
+from toy_dns_server.codec.response import HEADER_SIZE, QTYPE_OPT, skip_name
+
+RCODE_SERVFAIL = 2
+EDNS_DO_FLAG = 0x8000
+EDNS_UDP_PAYLOAD_SIZE = 4096
+
+_HEADER = struct.Struct("!HHHHHH")
+_QUESTION_FIXED = struct.Struct("!HH")
+_OPT_FIXED = struct.Struct("!HHBBHH")
+
+
+class ParsedQuery:
+    """The parts of a DNS query the server needs, decoded once from the wire bytes.
+
+    The same instance travels from the frontend handler through the resolver to the cache, so a
+    packet is never decoded twice. `handler_type` names the frontend that received it.
+    """
+    __slots__ = (
+        "data", "id", "flags", "qname", "qtype", "qclass", "question",
+        "has_edns", "dnssec_ok", "udp_payload_size", "handler_type", "_opt_offset",
+    )
+
+    def __init__(
+        self,
+        data: bytes,
+        id: int,
+        flags: int,
+        qname: str,
+        qtype: int,
+        qclass: int,
+        question: bytes,
+        opt_offset: Optional[int] = None,
+        udp_payload_size: int = 512,
+        dnssec_ok: bool = False,
+        handler_type: str = "dns",
+    ):
+        self.data = data
+        self.id = id
+        self.flags = flags
+        self.qname = qname
+        self.qtype = qtype
+        self.qclass = qclass
+        self.question = question
+        self.has_edns = opt_offset is not None
+        self.dnssec_ok = dnssec_ok
+        self.udp_payload_size = udp_payload_size
+        self.handler_type = handler_type
+        self._opt_offset = opt_offset
+
+    @property
+    def cache_key(self) -> str:
+        return f"{self.qname}|{self.qtype}|{self.qclass}"
+
+    def with_dnssec_ok(self) -> bytes:
+        """Return the query with the EDNS DO bit set, adding an OPT record if there is none."""
+        if self._opt_offset is not None:
+            query = bytearray(self.data)
+            flags_offset = self._opt_offset + 7
+            flags = struct.unpack_from("!H", query, flags_offset)[0]
+            struct.pack_into("!H", query, flags_offset, flags | EDNS_DO_FLAG)
+            return bytes(query)
+
+        query = bytearray(self.data)
+        arcount = struct.unpack_from("!H", query, 10)[0]
+        struct.pack_into("!H", query, 10, arcount + 1)
+        query += b"\x00" + _OPT_FIXED.pack(QTYPE_OPT, EDNS_UDP_PAYLOAD_SIZE, 0, 0, EDNS_DO_FLAG, 0)
+        return bytes(query)
+
+    def servfail_response(self) -> bytes:
+        # QR and RA set, opcode and RD copied from the query.
+        flags = 0x8000 | (self.flags & 0x7900) | 0x0080 | RCODE_SERVFAIL
+        return _HEADER.pack(self.id, flags, 1, 0, 0, 0) + self.question
+
+
+def parse_query(data: bytes, handler_type: str = "dns") -> ParsedQuery:
+    """Decode the header, the first question and the EDNS OPT record of a query.
+
+    Raises:
+        ValueError: If the packet is not a well-formed query with at least one question.
+    """
+    if len(data) < HEADER_SIZE:
+        raise ValueError("DNS message is shorter than its header")
+
+    id, flags, qdcount, ancount, nscount, arcount = _HEADER.unpack_from(data)
+    if qdcount < 1:
+        raise ValueError("DNS query has no question")
+
+    view = memoryview(data)
+    labels = []
+    offset = HEADER_SIZE
+    while True:
+        if offset >= len(data):
+            raise ValueError("Question name runs past the end of the message")
+
+        length = data[offset]
+        if length == 0:
+            offset += 1
+            break
+        if length & 0xC0:
+            raise ValueError("Compressed or extended labels are not allowed in the question name")
+
+        labels.append(_label_text(view[offset + 1:offset + 1 + length].tobytes()))
+        offset += length + 1
+
+    if offset + _QUESTION_FIXED.size > len(data):
+        raise ValueError("Question is truncated")
+
+    qtype, qclass = _QUESTION_FIXED.unpack_from(data, offset)
+    offset += _QUESTION_FIXED.size
+    question = bytes(view[HEADER_SIZE:offset])
+    qname = ".".join(labels) + "."
+
+    for _ in range(qdcount - 1):
+        offset = skip_name(data, offset) + _QUESTION_FIXED.size
+
+    opt_offset = None
+    udp_payload_size = 512
+    dnssec_ok = False
+    for index in range(ancount + nscount + arcount):
+        record_offset = offset
+        offset = skip_name(data, offset)
+        if offset + 10 > len(data):
+            raise ValueError("Resource record is truncated")
+
+        rtype, rclass, _, _, rr_flags, rdlength = _OPT_FIXED.unpack_from(data, offset)
+        if rtype == QTYPE_OPT and index >= ancount + nscount:
+            opt_offset = record_offset
+            udp_payload_size = max(512, rclass)
+            dnssec_ok = bool(rr_flags & EDNS_DO_FLAG)
+
+        offset += 10 + rdlength
+
+    return ParsedQuery(
+        data=data,
+        id=id,
+        flags=flags,
+        qname=qname,
+        qtype=qtype,
+        qclass=qclass,
+        question=question,
+        opt_offset=opt_offset,
+        udp_payload_size=udp_payload_size,
+        dnssec_ok=dnssec_ok,
+        handler_type=handler_type,
+    )
+
+
+def _label_text(label: bytes) -> str:
+    # Escape "\" and "." like dnspython's to_text, so a label containing a dot cannot pass for two
+    # labels: qname is part of the cache key, and distinct wire names must never share a key.
+    escaped = label.replace(b"\\", b"\\\\").replace(b".", b"\\.")
+    return escaped.decode("ascii", "backslashreplace").lower()
@@ -0,0 +1,163 @@
+import struct
+from typing import Optional
+
+HEADER_SIZE = 12
+QTYPE_SOA = 6
+QTYPE_OPT = 41
+RCODE_NOERROR = 0
+RCODE_NXDOMAIN = 3
+FLAG_TC = 0x0200
+
+_HEADER = struct.Struct("!HHHHHH")
+_RR_FIXED = struct.Struct("!HHIH")
+_SOA_MINIMUM = struct.Struct("!I")
+
+
+class ResponseLayout:
+    """Offsets of the mutable fields of a DNS response, found with a single pass over the wire bytes."""
+    __slots__ = ("rcode", "answer_count", "question_end", "ttl_offsets", "min_answer_ttl", "negative_ttl")
+
+    def __init__(
+        self,
+        rcode: int,
+        answer_count: int,
+        question_end: int,
+        ttl_offsets: tuple[int, ...],
+        min_answer_ttl: Optional[int],
+        negative_ttl: Optional[int] = None,
+    ):
+        self.rcode = rcode
+        self.answer_count = answer_count
+        self.question_end = question_end
+        self.ttl_offsets = ttl_offsets
+        self.min_answer_ttl = min_answer_ttl
+        # RFC 2308: the lower of the authority SOA's TTL and its MINIMUM field.
+        self.negative_ttl = negative_ttl
+
+    @property
+    def is_negative(self) -> bool:
+        """Whether this is an NXDOMAIN or NODATA answer."""
+        return self.answer_count == 0 and self.rcode in (RCODE_NOERROR, RCODE_NXDOMAIN)
+
+
+def scan_response(data: bytes) -> ResponseLayout:
+    """Locate the TTL field of every resource record in `data`.
+
+    The OPT pseudo-record is skipped, as its TTL field carries EDNS flags instead of a TTL.
+
+    Raises:
+        ValueError: If the packet is truncated or malformed.
+    """
+    if len(data) < HEADER_SIZE:
+        raise ValueError("DNS message is shorter than its header")
+
+    _, flags, qdcount, ancount, nscount, arcount = _HEADER.unpack_from(data)
+    offset = HEADER_SIZE
+    for _ in range(qdcount):
+        offset = skip_name(data, offset) + 4
+    question_end = offset
+
+    ttl_offsets = []
+    min_answer_ttl = None
+    negative_ttl = None
+    for index in range(ancount + nscount + arcount):
+        offset = skip_name(data, offset)
+        if offset + _RR_FIXED.size > len(data):
+            raise ValueError("Resource record is truncated")
+
+        rtype, _, ttl, rdlength = _RR_FIXED.unpack_from(data, offset)
+        if rtype != QTYPE_OPT:
+            ttl_offsets.append(offset + 4)
+            if index < ancount and (min_answer_ttl is None or ttl < min_answer_ttl):
+                min_answer_ttl = ttl
+            elif rtype == QTYPE_SOA and ancount <= index < ancount + nscount and rdlength >= _SOA_MINIMUM.size:
+                rdata_end = offset + _RR_FIXED.size + rdlength
+                if rdata_end <= len(data):
+                    minimum = _SOA_MINIMUM.unpack_from(data, rdata_end - _SOA_MINIMUM.size)[0]
+                    negative_ttl = min(ttl, minimum)
+
+        offset += _RR_FIXED.size + rdlength
+
+    if offset > len(data):
+        raise ValueError("Resource record data is truncated")
+
+    return ResponseLayout(flags & 0x000F, ancount, question_end, tuple(ttl_offsets), min_answer_ttl, negative_ttl)
+
+
+def skip_name(data: bytes, offset: int) -> int:
+    """Return the offset just past the (possibly compressed) domain name starting at `offset`."""
+    while True:
+        if offset >= len(data):
+            raise ValueError("Domain name runs past the end of the message")
+
+        length = data[offset]
+        if length == 0:
+            return offset + 1
+        if length & 0xC0 == 0xC0:
+            # A compression pointer always terminates the name.
+            return offset + 2
+        if length & 0xC0:
+            raise ValueError(f"Unsupported label type {length:#x}")
+
+        offset += length + 1
+
+
+def question_query(data: bytes, question_end: int) -> bytes:
+    """Build a recursive query asking the question(s) of the message `data`."""
+    qdcount = struct.unpack_from("!H", data, 4)[0]
+    return _HEADER.pack(0, 0x0100, qdcount, 0, 0, 0) + bytes(data[HEADER_SIZE:question_end])
+
+
+def same_question(cached: bytes, question: bytes) -> bool:
+    """Whether two wire question sections ask the same question; names compare case-insensitively."""
+    if len(cached) != len(question) or len(question) < 4:
+        return False
+
+    # Label lengths are below 64, so lower() only folds the ASCII letters of the name.
+    return cached[:-4].lower() == question[:-4].lower() and cached[-4:] == question[-4:]
+
+
+def with_transaction_id(data: bytes, transaction_id: int) -> bytes:
+    response = bytearray(data)
+    struct.pack_into("!H", response, 0, transaction_id)
+    return bytes(response)
+
+
+def is_truncated(data: bytes) -> bool:
+    """Whether the TC bit is set, i.e. the answer did not fit and should be fetched over TCP."""
+    return len(data) >= HEADER_SIZE and bool(struct.unpack_from("!H", data, 2)[0] & FLAG_TC)
+
+
+def truncate_for_udp(data: bytes, max_size: int) -> bytes:
+    """Fit a response into a UDP payload of at most `max_size` bytes (RFC 1035 section 4.2.1, RFC 6891 section 7).
+
+    A response that does not fit keeps only its question and EDNS OPT record, and gets the TC bit so
+    the client retries over TCP.
+    """
+    if len(data) <= max_size:
+        return data
+
+    id, flags, qdcount, ancount, nscount, arcount = _HEADER.unpack_from(data)
+    try:
+        offset = HEADER_SIZE
+        for _ in range(qdcount):
+            offset = skip_name(data, offset) + 4
+        question_end = offset
+
+        opt = b""
+        for index in range(ancount + nscount + arcount):
+            record_start = offset
+            offset = skip_name(data, offset)
+            if offset + _RR_FIXED.size > len(data):
+                raise ValueError("Resource record is truncated")
+
+            rtype, _, _, rdlength = _RR_FIXED.unpack_from(data, offset)
+            offset += _RR_FIXED.size + rdlength
+            if rtype == QTYPE_OPT and index >= ancount + nscount:
+                opt = data[record_start:offset]
+    except ValueError:
+        # Still tell the client to retry over TCP, where the whole response fits.
+        return _HEADER.pack(id, flags | FLAG_TC, 0, 0, 0, 0)
+
+    header = _HEADER.pack(id, flags | FLAG_TC, qdcount, 0, 0, 1 if opt else 0)
+    return header + data[HEADER_SIZE:question_end] + opt
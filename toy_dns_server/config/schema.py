@@ -1,21 +1,46 @@
-from pydantic import BaseModel, Field, IPvAnyAddress
-from typing import List, Literal, Union
+from pydantic import BaseModel, Field, IPvAnyAddress, model_validator
+from typing import List, Literal, Optional, Union
+
+
+class DNSTCPConfig(BaseModel):
+    enabled: bool = Field(..., description="Also serve DNS over TCP on the DNS address")
+    max_connections: int = Field(..., gt=0, description="Maximum number of open TCP connections")
+    idle_timeout_ms: int = Field(..., gt=0, description="Close TCP connections idle for this long, in milliseconds")
+    pipeline_depth: int = Field(..., gt=0, description="Maximum number of queries in flight on one TCP connection")
+
+
+class DNSUDPBatchingConfig(BaseModel):
+    enabled: bool = Field(..., description="Move UDP datagrams with recvmmsg/sendmmsg on Linux (asyncio engine)")
+    batch_size: int = Field(..., gt=0, le=1024, description="Maximum number of datagrams per recvmmsg/sendmmsg call")
 
 
 class DNSConfig(BaseModel):
     enabled: bool = Field(..., description="Enable DNS server")
     address: str = Field(..., description="DNS listening address in IP:PORT format")
+    engine: Literal["threaded", "asyncio"] = Field(..., description="UDP server engine: 'threaded' or 'asyncio'")
+    udp_batching: DNSUDPBatchingConfig
+    tcp: DNSTCPConfig
 
 
 class DoHHTTPConfig(BaseModel):
     listen_address: str = Field(..., description="Listen address for DoH HTTP mode")
 
 
+class DoHTLSSessionConfig(BaseModel):
+    tickets_per_handshake: int = Field(..., ge=0, description="TLS 1.3 session tickets issued per full handshake; 0 disables them")
+    stateless_tickets: bool = Field(
+        ..., description="Encrypt sessions into the tickets; false keeps them in the server-side session cache"
+    )
+    ticket_key_rotation_seconds: int = Field(..., gt=0, description="Interval between session ticket key rotations in seconds")
+
+
 class DoHTTPSecurityConfig(BaseModel):
     certificate_file: str = Field(..., description="Path to TLS certificate")
     key_file: str = Field(..., description="Path to TLS private key")
     min_tls_version: Literal["TLS12", "TLS13"] = Field(..., description="Minimum TLS version")
     max_tls_version: Literal["TLS12", "TLS13"] = Field(..., description="Maximum TLS version")
+    handshake_timeout_ms: int = Field(..., gt=0, description="Drop clients that do not finish the TLS handshake in time, in milliseconds")
+    session_resumption: DoHTLSSessionConfig
 
 
 class DoHHTTPSConfig(BaseModel):
@@ -23,31 +48,150 @@ class DoHHTTPSConfig(BaseModel):
     security: DoHTTPSecurityConfig
 
 
+class DoHHTTP2Config(BaseModel):
+    enabled: bool = Field(..., description="Offer HTTP/2 through ALPN in HTTPS mode (asyncio engine)")
+    max_concurrent_streams: int = Field(..., gt=0, description="Maximum number of concurrent streams per HTTP/2 connection")
+
+
+class DoHResponseCacheConfig(BaseModel):
+    enabled: bool = Field(..., description="Keep ready-made DoH answers in memory (asyncio engine)")
+    max_entries: int = Field(..., gt=0, description="Maximum number of DoH answers kept")
+    max_age_seconds: int = Field(..., gt=0, description="Upper bound for how long a DoH answer is reused, in seconds")
+
+
 class DoHConfig(BaseModel):
     enabled: bool = Field(..., description="Enable DNS-over-HTTPS server")
     mode: Literal["http", "https"] = Field(..., description="Mode: 'http' or 'https'")
+    engine: Literal["threaded", "asyncio"] = Field(..., description="HTTP server engine: 'threaded' or 'asyncio'")
+    keepalive_timeout_ms: int = Field(
+        ..., gt=0, description="Close idle keep-alive connections after this long, in milliseconds (asyncio engine)"
+    )
+    http2: DoHHTTP2Config
+    response_cache: DoHResponseCacheConfig
     http: DoHHTTPConfig
     https: DoHHTTPSConfig
 
 
 class ServerConfig(BaseModel):
+    workers: int = Field(..., ge=1, description="Number of worker processes sharing the listening sockets")
     dns: DNSConfig
     doh: DoHConfig
 
 
+class UpstreamHealthConfig(BaseModel):
+    failure_threshold: int = Field(..., gt=0, description="Consecutive failures after which an upstream server is backed off")
+    backoff_initial_ms: int = Field(..., gt=0, description="First backoff period of a failing upstream server in milliseconds")
+    backoff_max_ms: int = Field(..., gt=0, description="Upper bound for the exponential backoff in milliseconds")
+
+
+class UpstreamHedgingConfig(BaseModel):
+    enabled: bool = Field(..., description="Send slow queries to a second upstream server as well")
+    percentile: int = Field(..., gt=0, lt=100, description="RTT percentile of the first server after which a query is hedged")
+    min_delay_ms: int = Field(..., ge=0, description="Lower bound for the hedge delay in milliseconds")
+    budget_percent: int = Field(..., gt=0, le=100, description="Maximum share of queries that may be hedged")
+
+
+class UpstreamServerConfig(BaseModel):
+    address: IPvAnyAddress = Field(..., description="IP address of the upstream resolver")
+    transport: Literal["udp", "tcp", "tls"] = Field("udp", description="Transport: 'udp', 'tcp' or 'tls' (DNS over TLS)")
+    port: int = Field(0, ge=0, le=65535, description="Port of the upstream resolver; 0 uses 53, or 853 for 'tls'")
+    tls_server_name: Optional[str] = Field(
+        None, description="Name the TLS certificate is verified against; defaults to the address"
+    )
+
+    @model_validator(mode="before")
+    @classmethod
+    def _from_address(cls, value):
+        # A bare address is a plain UDP server.
+        if isinstance(value, dict):
+            return value
+        return {"address": value}
+
+    @model_validator(mode="after")
+    def _default_port(self):
+        if self.port == 0:
+            self.port = 853 if self.transport == "tls" else 53
+        return self
+
+    @property
+    def key(self) -> str:
+        """Identifies the server: the same address may be configured on several ports or transports."""
+        host = f"[{self.address}]" if self.address.version == 6 else str(self.address)
+        return f"{self.transport}://{host}:{self.port}"
+
+
+class UpstreamConnectionsConfig(BaseModel):
+    per_server: int = Field(..., gt=0, description="Maximum number of TCP or TLS connections kept open per upstream server")
+    idle_timeout_ms: int = Field(..., gt=0, description="Close upstream connections idle for this long, in milliseconds")
+    tls_ca_file: Optional[str] = Field(
+        ..., description="CA bundle used to verify DNS-over-TLS upstreams; null uses the system's trusted CAs"
+    )
+
+
 class UpstreamConfig(BaseModel):
-    servers: List[IPvAnyAddress] = Field(..., description="List of upstream DNS resolvers")
+    servers: List[UpstreamServerConfig] = Field(
+        ..., description="List of upstream DNS resolvers, as addresses or server entries with a transport"
+    )
     timeout_ms: int = Field(..., gt=0, description="Timeout for upstream DNS queries in milliseconds")
+    sockets_per_server: int = Field(..., gt=0, description="Number of long-lived UDP sockets kept open per upstream server")
+    connections: UpstreamConnectionsConfig
+    health: UpstreamHealthConfig
+    hedging: UpstreamHedgingConfig
+
+
+class CachePrefetchConfig(BaseModel):
+    enabled: bool = Field(..., description="Refresh popular cache entries before they expire")
+    threshold_percent: int = Field(..., gt=0, le=100, description="Refresh entries hit within the last N percent of their TTL")
+    min_hits: int = Field(..., ge=1, description="Minimum hits an entry needs before it is refreshed ahead of expiry")
+    concurrency: int = Field(..., gt=0, description="Maximum number of prefetch queries running at once")
+
+
+class CacheStaleConfig(BaseModel):
+    enabled: bool = Field(..., description="Answer from expired cache entries when upstream resolution fails or is slow")
+    window_seconds: int = Field(..., gt=0, description="How long expired entries are kept for stale answers")
+    answer_ttl_seconds: int = Field(..., ge=0, description="TTL given to records in stale answers")
+    client_timeout_ms: int = Field(..., gt=0, description="Time to wait for upstream before answering from a stale entry")
+
+
+class CacheNegativeConfig(BaseModel):
+    enabled: bool = Field(..., description="Cache NXDOMAIN and NODATA answers")
+    max_ttl_seconds: int = Field(..., gt=0, description="Upper bound for the TTL of negative cache entries")
+
+
+class CacheSnapshotConfig(BaseModel):
+    enabled: bool = Field(..., description="Persist the cache to disk and restore it on startup")
+    path: str = Field(..., description="Path of the cache snapshot file")
+    interval_seconds: int = Field(..., gt=0, description="Interval between periodic snapshots in seconds")
+
+
+class CacheSharedMemoryConfig(BaseModel):
+    path: str = Field(..., description="Path of the memory-mapped file holding the shared cache table")
+    slot_size_bytes: int = Field(..., ge=512, le=65536, multiple_of=8, description="Size of a single cache slot in bytes")
 
 
 class CacheConfig(BaseModel):
     enabled: bool
     ttl_seconds: Union[int, Literal["auto"]]
     max_entries: int
+    backend: Literal["memory", "shared_memory"] = Field(..., description="Cache storage: 'memory' or 'shared_memory'")
+    shared_memory: CacheSharedMemoryConfig
+    prefetch: CachePrefetchConfig
+    stale: CacheStaleConfig
+    negative: CacheNegativeConfig
+    snapshot: CacheSnapshotConfig
+
+
+class DNSSECVerificationConfig(BaseModel):
+    processes: int = Field(..., ge=0, description="Worker processes verifying signatures; 0 verifies in a thread instead")
+    queue_depth: int = Field(..., gt=0, description="Maximum number of batches waiting for a worker process")
 
 
 class ResolverSecurityConfig(BaseModel):
     dnssec_validation: bool
+    trust_anchors: list[str] = Field(
+        ..., description="DNSSEC trust anchors as DS records: '<owner> <key tag> <algorithm> <digest type> <digest>'"
+    )
+    verification: DNSSECVerificationConfig
 
 
 class ResolverConfig(BaseModel):
@@ -17,6 +17,8 @@ def main():
     main_file_dir = os.path.dirname(main_file_path)
     bootstraper = Bootstraper(main_file_dir)
     signal.signal(signal.SIGINT, lambda _signum, _frame: handle_sigint(bootstraper))
+    # Deployments stop the server with SIGTERM; take the same graceful path so the cache snapshot is written.
+    signal.signal(signal.SIGTERM, lambda _signum, _frame: handle_sigint(bootstraper))
 
     bootstraper.run()
 
@@ -1,11 +1,27 @@
-from prometheus_client import start_http_server
+from typing import Optional
+from prometheus_client import CollectorRegistry, REGISTRY, start_http_server
+from prometheus_client import multiprocess
 from toy_dns_server.config.schema import MetricsConfig
 
 class Exporter:
-    def __init__(self, config: MetricsConfig):
+    def __init__(self, config: MetricsConfig, multiprocess_dir: Optional[str] = None):
         self._config = config
+        self._multiprocess_dir = multiprocess_dir
 
     def run(self):
         address, port = self._config.exporter.listen_address.split(":")
         port = int(port)
-        start_http_server(port, addr=address)
+        start_http_server(port, addr=address, registry=self._registry())
+
+    def mark_process_dead(self, pid: int):
+        if self._multiprocess_dir is not None:
+            multiprocess.mark_process_dead(pid, self._multiprocess_dir)
+
+    def _registry(self):
+        if self._multiprocess_dir is None:
+            return REGISTRY
+
+        # Worker processes write their samples to `multiprocess_dir`; aggregate them on scrape.
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry, path=self._multiprocess_dir)
+        return registry
@@ -1,4 +1,4 @@
-from prometheus_client import Counter, Summary
+from prometheus_client import Counter, Gauge, Summary
 
 dns_query_counter = Counter(
     "dns_queries_total",
@@ -17,3 +17,134 @@ dnssec_validation_counter = Counter(
     "DNSSEC validation attempts",
     ["result"]
 )
+
+dnssec_key_cache_lookup_counter = Counter(
+    "dnssec_key_cache_lookups_total",
+    "Lookups of validated DNSKEY and DS RRsets",
+    ["rdtype", "result"]
+)
+
+dnssec_verification_cache_lookup_counter = Counter(
+    "dnssec_verification_cache_lookups_total",
+    "Lookups of memoized RRSIG verification results",
+    ["result"]
+)
+
+dnssec_verification_processes = Gauge(
+    "dnssec_verification_processes",
+    "Worker processes verifying DNSSEC signatures",
+    multiprocess_mode="livesum"
+)
+
+dnssec_verification_queue_depth = Gauge(
+    "dnssec_verification_queue_depth",
+    "Signature verification batches submitted to the worker processes and not finished yet",
+    multiprocess_mode="livesum"
+)
+
+dns_tcp_connections = Gauge(
+    "dns_tcp_connections",
+    "Open DNS over TCP client connections",
+    multiprocess_mode="livesum"
+)
+
+dns_tcp_rejected_connection_counter = Counter(
+    "dns_tcp_rejected_connections_total",
+    "DNS over TCP connections closed right away because max_connections was reached"
+)
+
+doh_tls_handshake_duration = Summary(
+    "doh_tls_handshake_duration_seconds",
+    "Time spent on DoH TLS handshakes, by result (full, resumed or failed)",
+    ["result"]
+)
+
+doh_response_cache_lookup_counter = Counter(
+    "doh_response_cache_lookups_total",
+    "Lookups of ready-made DoH answers, by result (hit or miss)",
+    ["result"]
+)
+
+dns_coalesced_query_counter = Counter(
+    "dns_coalesced_queries_total",
+    "DNS queries answered by joining an identical in-flight upstream query"
+)
+
+dns_prefetch_counter = Counter(
+    "dns_prefetches_total",
+    "Cache entries refreshed from upstream ahead of their expiry"
+)
+
+dns_prefetch_saved_hit_counter = Counter(
+    "dns_prefetch_saved_hits_total",
+    "Cache hits served by a prefetched entry after the entry it replaced would have expired"
+)
+
+dns_stale_answer_counter = Counter(
+    "dns_stale_answers_total",
+    "DNS queries answered from an expired cache entry",
+    ["reason"]
+)
+
+dns_cache_lookup_counter = Counter(
+    "dns_cache_lookups_total",
+    "DNS cache lookups by result and by whether the entry holds a positive or a negative (NXDOMAIN/NODATA) answer",
+    ["result", "entry_type", "handler_type"]
+)
+
+dns_cache_shared_hit_counter = Counter(
+    "dns_cache_shared_hits_total",
+    "DNS cache hits on entries populated by a query from another frontend",
+    ["handler_type", "cached_by"]
+)
+
+dns_upstream_rtt = Gauge(
+    "dns_upstream_rtt_seconds",
+    "Smoothed (EWMA) round-trip time of an upstream server",
+    ["server"],
+    multiprocess_mode="livemax"
+)
+
+dns_upstream_error_rate = Gauge(
+    "dns_upstream_error_rate",
+    "Smoothed (EWMA) share of failed queries to an upstream server",
+    ["server"],
+    multiprocess_mode="livemax"
+)
+
+dns_upstream_healthy = Gauge(
+    "dns_upstream_healthy",
+    "Whether an upstream server is in use (1) or backed off by its circuit breaker (0)",
+    ["server"],
+    multiprocess_mode="livemin"
+)
+
+dns_truncated_response_counter = Counter(
+    "dns_truncated_responses_total",
+    "UDP answers truncated to the client's payload size, with TC set for a retry over TCP",
+    ["handler_type"]
+)
+
+dns_udp_batch_size = Summary(
+    "dns_udp_batch_size",
+    "Datagrams moved per recvmmsg/sendmmsg call by the batched UDP listener",
+    ["operation"]
+)
+
+dns_upstream_connections = Gauge(
+    "dns_upstream_connections",
+    "Open TCP and DNS-over-TLS connections to the upstream servers",
+    ["transport"],
+    multiprocess_mode="livesum"
+)
+
+dns_upstream_truncated_counter = Counter(
+    "dns_upstream_truncated_total",
+    "Truncated UDP answers from upstream, retried over TCP"
+)
+
+dns_upstream_hedge_counter = Counter(
+    "dns_upstream_hedges_total",
+    "Hedged upstream queries: sent, answered first (won) or skipped for lack of budget",
+    ["outcome"]
+)
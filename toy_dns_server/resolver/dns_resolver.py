@@ -1,32 +1,61 @@
-import socket
-import random
 import asyncio
 import concurrent.futures
-from typing import Optional, Union, Tuple
-from dnslib import DNSRecord, EDNS0, RCODE, DNSHeader, RR, QTYPE, EDNSOption, DNSLabel
+import threading
+import time
+from typing import Optional, Union
 
 
 from toy_dns_server.log.logger import Logger
+from toy_dns_server.codec.query import RCODE_SERVFAIL, ParsedQuery
+from toy_dns_server.codec.response import with_transaction_id
 from toy_dns_server.config.schema import CacheConfig, ResolverConfig
 from toy_dns_server.cache.cache import DNSCache
+from toy_dns_server.resolver.hedging import HedgingPolicy
+from toy_dns_server.resolver.prefetcher import Prefetcher
+from toy_dns_server.resolver.singleflight import SingleFlight
+from toy_dns_server.resolver.upstream_manager import PROBE_QUERY, UpstreamManager
+from toy_dns_server.resolver.upstream_transport import UpstreamTransport
 from toy_dns_server.security.dnssec import DNSSECValidator
 from toy_dns_server.metrics.metrics import (
-    dnssec_validation_counter
+    dns_coalesced_query_counter,
+    dns_stale_answer_counter,
 )
 
 
 class DNSResolver:
+    """Forwards queries upstream and caches the responses.
+
+    One instance is shared by every frontend of a process. Everything past the cache runs as
+    coroutines on the resolver's own event loop, which lives in a thread of its own for as long as
+    the resolver does: async frontends await `resolve`, threaded ones hand queries over with
+    `submit`, and both can answer cache hits with `resolve_cached` without touching the loop.
+    """
     _logger: Logger
+    _loop: asyncio.AbstractEventLoop
+    _loop_thread: threading.Thread
     _timeout_seconds: float
-    _upstream_servers: list[str]
+    _upstream_transport: UpstreamTransport
+    _upstreams: UpstreamManager
+    _hedging: HedgingPolicy
+    _in_flight: SingleFlight
     _cache: Union[DNSCache, None] = None
+    _prefetcher: Optional[Prefetcher] = None
+    _stale_enabled: bool = False
+    _client_timeout_seconds: float
     _dnssec_validator: Optional[DNSSECValidator] = None
 
     def __init__(self, config: ResolverConfig):
         self._logger = Logger(self)
+        self._loop = asyncio.new_event_loop()
+        self._loop_thread = threading.Thread(target=self._loop.run_forever, name="resolver-loop", daemon=True)
+        self._loop_thread.start()
+
         upstream_config = config.upstream
         self._timeout_seconds = upstream_config.timeout_ms / 1000
-        self._upstream_servers = upstream_config.servers
+        self._upstream_transport = UpstreamTransport(upstream_config)
+        self._upstreams = UpstreamManager(upstream_config, self._probe_upstream)
+        self._hedging = HedgingPolicy(upstream_config.hedging, self._upstreams, self._timeout_seconds)
+        self._in_flight = SingleFlight()
 
         if config.cache is None:
             self._logger.warn("No cache configuration provided")
@@ -37,160 +66,258 @@ class DNSResolver:
 
         if config.security.dnssec_validation:
             self._logger.info("DNSSEC validation is enabled")
-            self._dnssec_validator = DNSSECValidator()
+            self._dnssec_validator = DNSSECValidator(config.security, self._lookup_upstream)
+
+    @property
+    def loop(self) -> asyncio.AbstractEventLoop:
+        """The event loop all resolution runs on. Async frontends can serve from it directly."""
+        return self._loop
+
+    async def resolve(self, query: ParsedQuery, cache_checked: bool = False) -> bytes:
+        """Answer `query`. Callers that just missed with `resolve_cached` pass `cache_checked`, so the
+        cache is not probed, and the miss not counted, a second time."""
+        if asyncio.get_running_loop() is not self._loop:
+            return await asyncio.wrap_future(self.submit(query, cache_checked))
+
+        if not cache_checked:
+            cached_response = self._get_from_cache(query)
+            if cached_response:
+                return cached_response
+
+        stale_response = self._get_stale_from_cache(query)
+        if stale_response:
+            return await self._resolve_with_stale(query, stale_response)
 
+        response, shared = await self._in_flight.do(query.cache_key, lambda: self._resolve_upstream(query))
+        return self._own_response(query, response, shared)
 
-    def resolve(self, original_query: bytes) -> bytes:
-        record = DNSRecord.parse(original_query)
-        cached_response = self._get_from_cache(record)
+    def submit(self, query: ParsedQuery, cache_checked: bool = False) -> concurrent.futures.Future:
+        """Resolve `query` on the resolver's loop, for callers outside of it."""
+        return asyncio.run_coroutine_threadsafe(self.resolve(query, cache_checked), self._loop)
+
+    def resolve_cached(self, query: ParsedQuery) -> Optional[bytes]:
+        cached_response = self._get_from_cache(query)
         if cached_response:
-            return self._return_cached_response(cached_response, record)
+            return cached_response
+
+        return None
+
+    def record_cached_hit(self, query: ParsedQuery):
+        """Count a hit for `query` answered by a frontend's own cache, so the entry keeps being prefetched."""
+        if self._cache:
+            self._cache.record_hit(query.cache_key, query.question, query.handler_type)
+
+    async def refresh(self, query: ParsedQuery) -> bytes:
+        """Resolve `query` upstream regardless of the cache, replacing the cached entry."""
+        response, _ = await self._in_flight.do(query.cache_key, lambda: self._resolve_upstream(query))
+        return response
+
+    def close(self):
+        if self._cache:
+            self._cache.close()
+
+        self._upstreams.close()
+        asyncio.run_coroutine_threadsafe(self._shutdown(), self._loop).result()
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._loop_thread.join()
+        self._loop.close()
+
+    async def _shutdown(self):
+        tasks = [task for task in asyncio.all_tasks() if task is not asyncio.current_task()]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
 
         if self._dnssec_validator:
-            return self._resolve_with_dnssec_fallback(record)
-        else:
-            return self._query_upstream(record, record.pack(), validate_dnssec=False)
+            self._dnssec_validator.close()
 
+        self._upstream_transport.close()
 
-    async def _query_server_async(self, server: str, packed_query: bytes, timeout: float):
+    async def _resolve_with_stale(self, query: ParsedQuery, stale_response: bytes) -> bytes:
+        # Refresh in the background; if it outlives the client response timer, answer stale meanwhile.
+        refresh = asyncio.ensure_future(
+            self._in_flight.do(query.cache_key, lambda: self._resolve_upstream(query))
+        )
         try:
-            loop = asyncio.get_event_loop()
-            sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-            sock.settimeout(timeout)
+            # Shielded, so the refresh keeps running after the timer fires.
+            response, _ = await asyncio.wait_for(asyncio.shield(refresh), self._client_timeout_seconds)
+        except asyncio.TimeoutError:
+            refresh.add_done_callback(self._log_background_refresh)
+            return self._serve_stale(query, stale_response, "timeout")
+        except Exception as e:
+            self._logger.warn(f"Failed to refresh stale entry for {query.qname}: {e}")
+            return self._serve_stale(query, stale_response, "upstream_failure")
 
-            await loop.sock_sendto(sock, packed_query, (str(server), 53))
-            response, _ = await loop.sock_recvfrom(sock, 4096)
-            sock.close()
-            return response
-        except (socket.timeout, socket.error, asyncio.TimeoutError) as e:
-            self._logger.warn(f"Failed to get async response from server {server}: {e}")
-            return None
+        return self._fresh_or_stale(query, response, stale_response)
 
-    def _resolve_with_dnssec_fallback(self, record: DNSRecord) -> bytes:
-        regular_record = DNSRecord.parse(record.pack())
-        dnssec_record = DNSRecord.parse(record.pack())
-        self._append_edns0(dnssec_record)
+    def _fresh_or_stale(self, query: ParsedQuery, response: bytes, stale_response: bytes) -> bytes:
+        if response[3] & 0x0F == RCODE_SERVFAIL:
+            return self._serve_stale(query, stale_response, "upstream_failure")
 
-        regular_query = regular_record.pack()
-        dnssec_query = dnssec_record.pack()
+        # The refresh may have been shared with another client; give it this client's transaction ID.
+        return with_transaction_id(response, query.id)
 
-        loop = asyncio.new_event_loop()
-        asyncio.set_event_loop(loop)
+    def _serve_stale(self, query: ParsedQuery, stale_response: bytes, reason: str) -> bytes:
+        self._logger.info(f"Answering {query.qname} from a stale cache entry ({reason})")
+        dns_stale_answer_counter.labels(reason).inc()
+        return stale_response
 
+    def _log_background_refresh(self, refresh: asyncio.Future):
+        if not refresh.cancelled() and refresh.exception() is not None:
+            self._logger.warn(f"Background refresh of a stale entry failed: {refresh.exception()}")
+
+    async def _resolve_upstream(self, query: ParsedQuery) -> bytes:
+        if self._dnssec_validator:
+            return await self._resolve_with_dnssec(query)
+
+        return await self._query_upstream(query, query.data)
+
+    def _own_response(self, query: ParsedQuery, response: bytes, shared: bool) -> bytes:
+        if not shared:
+            return response
+
+        # The response was produced for another client's query; give it this client's transaction ID.
+        self._logger.debug(f"Joined in-flight upstream query for {query.qname}")
+        dns_coalesced_query_counter.inc()
+        return with_transaction_id(response, query.id)
+
+    async def _resolve_with_dnssec(self, query: ParsedQuery) -> bytes:
+        # Always ask with the DO bit: a denial of existence is only trustworthy with its NSEC records.
+        response, failed_to_resolve = await self._exchange(query.with_dnssec_ok())
+        if response is None:
+            return self._build_servfail_response(query, 0, failed_to_resolve)
+
+        if not await self._dnssec_validator.validate(response):
+            return self._build_servfail_response(query, 1, 0)
+
+        self._set_to_cache(query, response)
+        return response
+
+    async def _query_upstream(self, query: ParsedQuery, packed_query: bytes) -> bytes:
+        response, failed_to_resolve = await self._exchange(packed_query)
+        if response is None:
+            return self._build_servfail_response(query, 0, failed_to_resolve)
+
+        self._set_to_cache(query, response)
+        return response
+
+    async def _lookup_upstream(self, packed_query: bytes) -> Optional[bytes]:
+        response, _ = await self._exchange(packed_query)
+        return response
+
+    async def _exchange(self, packed_query: bytes) -> tuple[Optional[bytes], int]:
+        """Send `packed_query` upstream, hedging to the next server when the first one is slow.
+
+        Servers are tried in the order the upstream manager recommends; the next one is only
+        used for a hedge or once every query in flight has failed or timed out.
+
+        Returns:
+            The first response received, or None if every server failed, and the number of failed attempts.
+        """
+        attempts = _Attempts(self._upstreams.ordered_servers())
+        failed = 0
+        while True:
+            now = time.monotonic()
+            failed += self._expire_attempts(attempts, now)
+            if not attempts.pending:
+                if not self._start_attempt(attempts, packed_query, now, hedge=False):
+                    return None, failed
+            elif attempts.hedge_due(now) and self._hedging.acquire():
+                self._start_attempt(attempts, packed_query, now, hedge=True)
+
+            done, _ = await asyncio.wait(
+                attempts.pending,
+                timeout=attempts.wake_at(self._timeout_seconds) - now,
+                return_when=asyncio.FIRST_COMPLETED,
+            )
+            for future in done:
+                response = self._finish_attempt(attempts, future)
+                if response is not None:
+                    return response, failed
+                failed += 1
+
+    def _start_attempt(self, attempts: "_Attempts", packed_query: bytes, now: float, hedge: bool) -> bool:
+        server = attempts.next_server()
+        if server is None:
+            return False
+
+        self._logger.debug(f"{'Hedging' if hedge else 'Forwarding'} query to upstream server: {server}")
+        future = self._upstream_transport.submit(server, packed_query)
+        attempts.pending[future] = (server, now, hedge)
+        if not hedge:
+            attempts.hedge_at = now + self._hedging.delay(server)
+        return True
+
+    def _finish_attempt(self, attempts: "_Attempts", future: asyncio.Future) -> Optional[bytes]:
+        server, start, hedge = attempts.pending.pop(future)
         try:
-            server = random.choice(self._upstream_servers)
-
-            tasks = [
-                loop.create_task(self._query_server_async(server, regular_query, self._timeout_seconds)),
-                loop.create_task(self._query_server_async(server, dnssec_query, self._timeout_seconds))
-            ]
-
-            done, pending = loop.run_until_complete(asyncio.wait(
-                tasks,
-                timeout=self._timeout_seconds,
-                return_when=asyncio.FIRST_COMPLETED
-            ))
-
-            for task in pending:
-                task.cancel()
-
-            if not done:
-                return self._build_servfail_response(record, 0, len(self._upstream_servers))
-
-            for task in done:
-                response = task.result()
-                if not response:
-                    continue
-
-                try:
-                    response_record = DNSRecord.parse(response)
-                    if response_record and len(response_record.rr) > 0:
-                        self._set_to_cache(record, response)
-                        return response
-                except Exception as e:
-                    self._logger.warn(f"Failed to parse response: {e}")
-
-            return self._query_upstream(record, regular_query, validate_dnssec=False)
-        finally:
-            loop.close()
-
-    def _query_upstream(self, record: DNSRecord, packed_query: bytes, validate_dnssec: bool = True) -> bytes:
-        failed_dnssec = 0
-        failed_to_resolve = 0
-        servers = self._upstream_servers[:]
-        random.shuffle(servers)
-
-        for server in servers:
-            self._logger.debug(f"Attempting to forward query to upstream server: {server}")
-            try:
-                with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sock:
-                    sock.settimeout(self._timeout_seconds)
-                    sock.sendto(packed_query, (str(server), 53))
-                    response, _ = sock.recvfrom(4096)
-
-                    if validate_dnssec and self._dnssec_validator:
-                        if not self._dnssec_validator.validate(response):
-                            self._logger.warn("DNSSEC validation failed")
-                            failed_dnssec += 1
-                            dnssec_validation_counter.labels("failed").inc()
-                            continue
-                        else:
-                            dnssec_validation_counter.labels("success").inc()
-
-                    self._set_to_cache(record, response)
-                    return response
-
-            except (socket.timeout, socket.error) as e:
-                self._logger.warn(f"Failed to get response from server {server}: {e}")
-                failed_to_resolve += 1
-
-        return self._build_servfail_response(record, failed_dnssec, failed_to_resolve)
-
-    def _build_servfail_response(self, record: DNSRecord, failed_dnssec: int, failed_to_resolve: int) -> bytes:
+            response = future.result()
+        except Exception as e:
+            self._logger.warn(f"Failed to get response from server {server}: {e}")
+            self._upstreams.record_failure(server)
+            return None
+
+        self._upstreams.record_success(server, time.monotonic() - start)
+        if hedge:
+            self._hedging.record_win()
+
+        for other, (other_server, _, other_hedge) in attempts.pending.items():
+            other.cancel()
+            if not other_hedge:
+                # The primary lost to a hedge sent after it; count that against it, or a server
+                # that silently drops queries would stay first in line forever.
+                self._upstreams.record_failure(other_server)
+        attempts.pending.clear()
+        return response
+
+    def _expire_attempts(self, attempts: "_Attempts", now: float) -> int:
+        expired = [
+            future for future, (_, start, _) in attempts.pending.items()
+            if now - start >= self._timeout_seconds
+        ]
+        for future in expired:
+            server, _, _ = attempts.pending.pop(future)
+            future.cancel()
+            self._logger.warn(f"Timed out waiting for upstream server {server}")
+            self._upstreams.record_failure(server)
+
+        return len(expired)
+
+    def _probe_upstream(self, server: str):
+        # Called from the upstream manager's prober thread.
+        probe = self._upstream_transport.query(server, PROBE_QUERY, self._timeout_seconds)
+        asyncio.run_coroutine_threadsafe(probe, self._loop).result()
+
+    def _build_servfail_response(self, query: ParsedQuery, failed_dnssec: int, failed_to_resolve: int) -> bytes:
         self._logger.error(
-            f"Failed to resolve query {record.q.qname}. "
+            f"Failed to resolve query {query.qname}. "
             f"Failed DNSSEC: {failed_dnssec}, Failed to resolve: {failed_to_resolve}"
         )
-        servfail = DNSRecord(
-            DNSHeader(id=record.header.id, qr=1, ra=1, rcode=RCODE.SERVFAIL),
-            q=record.q
-        )
-        return servfail.pack()
-
-    def _return_cached_response(self, cached: DNSRecord, original: DNSRecord) -> bytes:
-        cached.header.id = original.header.id
-        return cached.pack()
-
-    def _append_edns0(self, record: DNSRecord):
-        rname = record.q.qname
-        opt = EDNS0(rname,
-                    flags="do", # DNSSEC OK
-                    # ext_rcode=0, # no extended error codes
-                    # ext_rcode=1, # return extended error codes
-                    ext_rcode=1,
-                    udp_len=4096,
-                    version=1, # EDNS version
-                    opts=[EDNSOption(1,b'')] # todo: figure out what is 1 responsible for
-                )
-        record.add_ar(opt)
+        return query.servfail_response()
 
     def _initialize_cache(self, cache_config: CacheConfig):
         if not cache_config.enabled:
             self._logger.info("DNS cache is disabled")
             return
 
-        self._cache = DNSCache(cache_config.ttl_seconds, cache_config.max_entries)
+        self._cache = DNSCache(cache_config)
         self._logger.info("DNS cache initialized")
 
-    def _get_from_cache(self, record: DNSRecord) -> Optional[DNSRecord]:
-        if not self._cache:
-            return None
+        if cache_config.stale.enabled:
+            self._client_timeout_seconds = cache_config.stale.client_timeout_ms / 1000
+            self._stale_enabled = True
+            self._logger.info("Serving stale cache entries is enabled")
+
+        if cache_config.prefetch.enabled:
+            self._prefetcher = Prefetcher(self.refresh, cache_config.prefetch.concurrency, self._loop)
+            self._cache.set_refresh_handler(self._prefetcher.schedule)
+            self._logger.info("DNS cache prefetching is enabled")
 
-        key = self._query_cache_key(record)
-        if not key:
+    def _get_from_cache(self, query: ParsedQuery) -> Optional[bytes]:
+        if not self._cache:
             return None
 
-        response_data = self._cache.get(key)
+        response_data = self._cache.get(query.cache_key, query.question, query.id, query.handler_type)
         if response_data:
             self._logger.debug("Cache hit")
             return response_data
@@ -198,22 +325,47 @@ class DNSResolver:
         self._logger.debug("Cache miss")
         return None
 
-    def _set_to_cache(self, query: DNSRecord, response_data: bytes):
-        if not self._cache:
-            return
+    def _get_stale_from_cache(self, query: ParsedQuery) -> Optional[bytes]:
+        if not self._cache or not self._stale_enabled:
+            return None
+
+        return self._cache.get_stale(query.cache_key, query.question, query.id, query.handler_type)
 
-        key = self._query_cache_key(query)
-        if not key:
+    def _set_to_cache(self, query: ParsedQuery, response_data: bytes):
+        if not self._cache:
             return
 
-        self._cache.set(key, response_data)
+        self._cache.set(query.cache_key, query.question, response_data, query.handler_type)
         self._logger.debug("Cached response")
 
 
-    def _query_cache_key(self, record: DNSRecord) -> Optional[str]:
-        try:
-            q = record.q
-            return f"{str(q.qname)}|{q.qtype}|{q.qclass}"
-        except Exception as e:
-            self._logger.warn(f"Failed to parse DNS query for cache key: {e}")
+class _Attempts:
+    """Bookkeeping for one upstream exchange: the servers left to try and the queries in flight."""
+    __slots__ = ("servers", "pending", "hedge_at", "hedged")
+
+    def __init__(self, servers: list[str]):
+        self.servers = servers
+        # future -> (server, start time, whether it is a hedge)
+        self.pending: dict = {}
+        self.hedge_at = 0.0
+        self.hedged = False
+
+    def next_server(self) -> Optional[str]:
+        if not self.servers:
             return None
+
+        return self.servers.pop(0)
+
+    def hedge_due(self, now: float) -> bool:
+        """Whether the hedge for the current query should go out now. Each query gets at most one."""
+        if self.hedged or not self.servers or now < self.hedge_at:
+            return False
+
+        self.hedged = True
+        return True
+
+    def wake_at(self, timeout: float) -> float:
+        wake_at = min(start + timeout for _, start, _ in self.pending.values())
+        if not self.hedged and self.servers:
+            wake_at = min(wake_at, self.hedge_at)
+        return wake_at
@@ -0,0 +1,54 @@
+import threading
+
+from toy_dns_server.config.schema import UpstreamHedgingConfig
+from toy_dns_server.metrics.metrics import dns_upstream_hedge_counter
+from toy_dns_server.resolver.upstream_manager import UpstreamManager
+
+
+class HedgingPolicy:
+    """Decides when a query still waiting on its first upstream is also sent to a second one.
+
+    The hedge delay is a percentile of the primary server's recent RTTs, so only the slowest few
+    percent of queries are hedged. Hedges are paid for from a token bucket that every query tops
+    up by `budget_percent / 100`, which caps the extra upstream load at that share of queries.
+    """
+    MAX_TOKENS = 10.0
+
+    def __init__(self, config: UpstreamHedgingConfig, upstreams: UpstreamManager, timeout_seconds: float):
+        self._enabled = config.enabled
+        self._percentile = config.percentile
+        self._min_delay = config.min_delay_ms / 1000
+        self._refill = config.budget_percent / 100
+        self._upstreams = upstreams
+        self._timeout_seconds = timeout_seconds
+        self._tokens = self.MAX_TOKENS
+        self._lock = threading.Lock()
+
+    def delay(self, server: str) -> float:
+        """Seconds to wait for `server` before hedging. Queries are never hedged past the upstream timeout."""
+        if not self._enabled:
+            return self._timeout_seconds
+
+        with self._lock:
+            self._tokens = min(self.MAX_TOKENS, self._tokens + self._refill)
+
+        rtt = self._upstreams.rtt_percentile(server, self._percentile)
+        if rtt is None:
+            # No samples yet; hedge only once the primary is clearly slow.
+            return self._timeout_seconds / 2
+
+        return min(self._timeout_seconds, max(self._min_delay, rtt))
+
+    def acquire(self) -> bool:
+        with self._lock:
+            if self._tokens < 1:
+                dns_upstream_hedge_counter.labels("skipped").inc()
+                return False
+
+            self._tokens -= 1
+
+        dns_upstream_hedge_counter.labels("sent").inc()
+        return True
+
+    def record_win(self):
+        dns_upstream_hedge_counter.labels("won").inc()
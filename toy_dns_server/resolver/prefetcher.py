@@ -0,0 +1,57 @@
+import asyncio
+import threading
+from typing import Awaitable, Callable
+
+from toy_dns_server.codec.query import ParsedQuery, parse_query
+from toy_dns_server.log.logger import Logger
+from toy_dns_server.metrics.metrics import dns_prefetch_counter
+
+
+class Prefetcher:
+    """Refreshes cache entries in the background before they expire.
+
+    Refreshes run as tasks on `loop`, at most `concurrency` at a time. Refreshes already queued or
+    running for a key are not scheduled again, and once `max_pending` refreshes are waiting, further
+    requests are dropped. `schedule` may be called from any thread.
+    """
+
+    _logger: Logger
+
+    def __init__(
+        self,
+        refresh: Callable[[ParsedQuery], Awaitable[bytes]],
+        concurrency: int,
+        loop: asyncio.AbstractEventLoop,
+    ):
+        self._logger = Logger(self)
+        self._refresh = refresh
+        self._loop = loop
+        self._max_pending = concurrency * 16
+        self._slots = asyncio.Semaphore(concurrency)
+        self._pending: set[str] = set()
+        self._lock = threading.Lock()
+
+    def schedule(self, key: str, query_data: bytes):
+        with self._lock:
+            if key in self._pending:
+                return
+
+            if len(self._pending) >= self._max_pending:
+                self._logger.debug(f"Prefetch queue is full, not refreshing {key}")
+                return
+
+            self._pending.add(key)
+
+        dns_prefetch_counter.inc()
+        asyncio.run_coroutine_threadsafe(self._prefetch(key, query_data), self._loop)
+
+    async def _prefetch(self, key: str, query_data: bytes):
+        try:
+            async with self._slots:
+                await self._refresh(parse_query(query_data, "prefetch"))
+            self._logger.debug(f"Prefetched {key}")
+        except Exception as e:
+            self._logger.warn(f"Failed to prefetch {key}: {e}")
+        finally:
+            with self._lock:
+                self._pending.discard(key)
@@ -0,0 +1,44 @@
+import asyncio
+from typing import Awaitable, Callable, TypeVar
+
+T = TypeVar("T")
+
+
+class SingleFlight:
+    """Deduplicates concurrent calls sharing a key: the first caller runs the call, later callers
+    wait for its result.
+
+    Must only be used from a single event loop.
+    """
+
+    def __init__(self):
+        self._calls: dict[str, asyncio.Future] = {}
+
+    async def do(self, key: str, fn: Callable[[], Awaitable[T]]) -> tuple[T, bool]:
+        """Run `fn` unless a call for `key` is already in flight.
+
+        Returns:
+            The result and whether it was shared from another caller.
+        """
+        future = self._calls.get(key)
+        if future is not None:
+            # Shield the shared future: a cancelled waiter must not cancel the call for everyone else.
+            return await asyncio.shield(future), True
+
+        future = asyncio.get_running_loop().create_future()
+        self._calls[key] = future
+        try:
+            result = await fn()
+        except BaseException as e:
+            self._calls.pop(key, None)
+            if isinstance(e, asyncio.CancelledError):
+                future.cancel()
+            else:
+                future.set_exception(e)
+                # Mark the exception as retrieved, in case nobody joined the call.
+                future.exception()
+            raise
+
+        self._calls.pop(key, None)
+        future.set_result(result)
+        return result, False
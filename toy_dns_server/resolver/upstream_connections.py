@@ -0,0 +1,226 @@
+import asyncio
+import secrets
+import ssl
+import struct
+from typing import Optional
+
+from toy_dns_server.config.schema import UpstreamConnectionsConfig, UpstreamServerConfig
+from toy_dns_server.log.logger import Logger
+from toy_dns_server.metrics.metrics import dns_upstream_connections
+
+_LENGTH = struct.Struct("!H")
+
+
+class UpstreamConnectionPool:
+    """Persistent TCP and DNS-over-TLS (RFC 7858) connections to the upstream servers.
+
+    Up to `per_server` connections are opened to a server on demand: a query goes to an idle
+    connection, or to a new one while the limit allows, and is otherwise pipelined onto the least
+    busy connection. Every query gets a transaction ID unique on its connection and is matched to
+    its response by that ID, so responses may arrive in any order. Connections are closed once
+    they sit idle for `idle_timeout_ms`. All methods must be called on the same event loop.
+    """
+    _logger: Logger
+
+    def __init__(self, servers: list[UpstreamServerConfig], config: UpstreamConnectionsConfig):
+        self._logger = Logger(self)
+        self._per_server = config.per_server
+        self._idle_timeout = config.idle_timeout_ms / 1000
+        self._servers = {server.key: server for server in servers}
+        self._connections: dict[str, list[_Connection]] = {server: [] for server in self._servers}
+        self._opening: dict[str, list[asyncio.Task]] = {server: [] for server in self._servers}
+        self._tls_context: Optional[ssl.SSLContext] = None
+        if any(server.transport == "tls" for server in servers):
+            self._tls_context = ssl.create_default_context(cafile=config.tls_ca_file)
+            self._tls_context.minimum_version = ssl.TLSVersion.TLSv1_2
+
+    async def query(self, server: str, packed_query: bytes, timeout: float) -> bytes:
+        try:
+            return await asyncio.wait_for(self.submit(server, packed_query), timeout)
+        except asyncio.TimeoutError:
+            raise TimeoutError(f"Timed out waiting for upstream {server}")
+
+    def submit(self, server: str, packed_query: bytes) -> asyncio.Future:
+        return asyncio.ensure_future(self._exchange(str(server), packed_query))
+
+    def close(self):
+        for opening in self._opening.values():
+            for task in opening:
+                task.cancel()
+
+        for connections in self._connections.values():
+            for connection in connections:
+                connection.close()
+
+    async def _exchange(self, server: str, packed_query: bytes) -> bytes:
+        connection = await self._connection(server)
+        try:
+            return await connection.send(packed_query)
+        except ConnectionError:
+            if not connection.answered:
+                raise
+
+        # The server may close a connection just as it is reused; retry once on another one.
+        self._logger.debug(f"Connection to upstream {server} was lost, retrying on a new one")
+        connection = await self._connection(server)
+        return await connection.send(packed_query)
+
+    async def _connection(self, server: str) -> "_Connection":
+        connections = [connection for connection in self._connections[server] if not connection.closed]
+        self._connections[server] = connections
+        opening = self._opening[server]
+        at_limit = len(connections) + len(opening) >= self._per_server
+
+        least_busy = min(connections, key=lambda connection: connection.in_flight, default=None)
+        if least_busy is not None and (least_busy.in_flight == 0 or at_limit):
+            return least_busy
+
+        if at_limit:
+            # Every connection the limit allows is still being opened; wait for one of them.
+            return await asyncio.shield(opening[0])
+
+        task = asyncio.ensure_future(self._open(server))
+        opening.append(task)
+        task.add_done_callback(opening.remove)
+        return await asyncio.shield(task)
+
+    async def _open(self, server: str) -> "_Connection":
+        config = self._servers[server]
+        self._logger.debug(f"Opening connection to upstream {server}")
+        address = str(config.address)
+        if config.transport == "tls":
+            reader, writer = await asyncio.open_connection(
+                address, config.port, ssl=self._tls_context, server_hostname=config.tls_server_name or address
+            )
+        else:
+            reader, writer = await asyncio.open_connection(address, config.port)
+
+        connection = _Connection(server, config.transport, reader, writer, self._idle_timeout, self._logger)
+        self._connections[server].append(connection)
+        return connection
+
+
+class _Connection:
+    """One pipelined connection to an upstream server, with a task reading its responses."""
+
+    def __init__(
+        self,
+        server: str,
+        transport: str,
+        reader: asyncio.StreamReader,
+        writer: asyncio.StreamWriter,
+        idle_timeout: float,
+        logger: Logger,
+    ):
+        self.server = server
+        self.closed = False
+        self.answered = 0
+        self._transport = transport
+        self._reader = reader
+        self._writer = writer
+        self._idle_timeout = idle_timeout
+        self._logger = logger
+        # transaction ID on this connection -> (waiter, ID of the original query)
+        self._pending: dict[int, tuple[asyncio.Future, int]] = {}
+        self._receiver = asyncio.ensure_future(self._receive())
+        dns_upstream_connections.labels(transport).inc()
+
+    @property
+    def in_flight(self) -> int:
+        return len(self._pending)
+
+    async def send(self, packed_query: bytes) -> bytes:
+        if self.closed:
+            raise ConnectionError(f"Connection to upstream {self.server} is closed")
+
+        key = self._allocate_id()
+        future = asyncio.get_running_loop().create_future()
+        self._pending[key] = (future, struct.unpack_from("!H", packed_query)[0])
+
+        outgoing = bytearray(_LENGTH.pack(len(packed_query)) + packed_query)
+        struct.pack_into("!H", outgoing, _LENGTH.size, key)
+        try:
+            try:
+                self._writer.write(outgoing)
+                await self._writer.drain()
+            except OSError as e:
+                self._fail(ConnectionError(f"Failed to send query to upstream {self.server}: {e}"))
+
+            return await future
+        finally:
+            self._pending.pop(key, None)
+
+    def close(self):
+        self._fail(ConnectionError(f"Connection to upstream {self.server} was closed"))
+
+    def _allocate_id(self) -> int:
+        while True:
+            key = secrets.randbits(16)
+            if key not in self._pending:
+                return key
+
+    async def _receive(self):
+        try:
+            while True:
+                response = await self._read_message()
+                if response is None:
+                    break
+                self._dispatch(response)
+        except OSError as e:
+            self._logger.warn(f"Connection to upstream {self.server} failed: {e}")
+        finally:
+            self._fail(ConnectionError(f"Upstream {self.server} closed the connection"))
+
+    async def _read_message(self) -> Optional[bytes]:
+        """Read the next length-prefixed message. Returns None on EOF or once the connection is idle."""
+        while True:
+            try:
+                header = await asyncio.wait_for(self._reader.readexactly(_LENGTH.size), self._idle_timeout)
+                break
+            except asyncio.TimeoutError:
+                # Only a connection without outstanding queries is idle.
+                if not self._pending:
+                    self._logger.debug(f"Closing idle connection to upstream {self.server}")
+                    return None
+            except asyncio.IncompleteReadError:
+                return None
+
+        try:
+            return await self._reader.readexactly(_LENGTH.unpack(header)[0])
+        except asyncio.IncompleteReadError:
+            return None
+
+    def _dispatch(self, response: bytes):
+        try:
+            key = struct.unpack_from("!H", response)[0]
+        except struct.error:
+            self._logger.warn(f"Dropping malformed response from upstream {self.server}")
+            return
+
+        waiter = self._pending.pop(key, None)
+        if waiter is None:
+            self._logger.debug(f"Dropping unexpected or late response from upstream {self.server}")
+            return
+
+        self.answered += 1
+        future, original_id = waiter
+        restored = bytearray(response)
+        struct.pack_into("!H", restored, 0, original_id)
+        if not future.done():
+            future.set_result(bytes(restored))
+
+    def _fail(self, error: Exception):
+        """Close the connection and fail every query still waiting on it."""
+        if self.closed:
+            return
+
+        self.closed = True
+        dns_upstream_connections.labels(self._transport).dec()
+        self._writer.close()
+        if self._receiver is not asyncio.current_task():
+            self._receiver.cancel()
+        pending = list(self._pending.values())
+        self._pending.clear()
+        for future, _ in pending:
+            if not future.done():
+                future.set_exception(error)
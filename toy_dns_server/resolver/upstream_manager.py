@@ -0,0 +1,175 @@
+import struct
+import threading
+import time
+from collections import deque
+from typing import Callable, Optional
+
+from toy_dns_server.config.schema import UpstreamConfig
+from toy_dns_server.log.logger import Logger
+from toy_dns_server.metrics.metrics import (
+    dns_upstream_error_rate,
+    dns_upstream_healthy,
+    dns_upstream_rtt,
+)
+
+# ". IN NS" with recursion desired; cheap for any recursive resolver to answer.
+PROBE_QUERY = struct.pack("!HHHHHH", 0, 0x0100, 1, 0, 0, 0) + b"\x00" + struct.pack("!HH", 2, 1)
+
+
+class UpstreamState:
+    __slots__ = ("server", "rtt", "rtt_samples", "error_rate", "consecutive_failures", "backoff", "open_until")
+
+    def __init__(self, server: str, sample_size: int):
+        self.server = server
+        self.rtt: Optional[float] = None
+        self.rtt_samples: deque[float] = deque(maxlen=sample_size)
+        self.error_rate = 0.0
+        self.consecutive_failures = 0
+        self.backoff = 0.0
+        self.open_until: Optional[float] = None
+
+    @property
+    def healthy(self) -> bool:
+        return self.open_until is None
+
+
+class UpstreamManager:
+    """Tracks the health of the upstream servers and decides which ones to ask, in which order.
+
+    Every server keeps an EWMA of its RTT and of its error rate. Healthy servers are ordered by
+    expected latency: the RTT, plus the upstream timeout weighted by the error rate.
+
+    After `failure_threshold` consecutive failures a server's circuit opens and it gets no queries.
+    Once its backoff has passed, a background probe queries it; success closes the circuit, while
+    failure doubles the backoff, up to `backoff_max_ms`.
+    """
+    EWMA_ALPHA = 0.2
+    RTT_SAMPLE_SIZE = 100
+    PROBE_CHECK_INTERVAL_SECONDS = 0.5
+
+    _logger: Logger
+
+    def __init__(self, config: UpstreamConfig, probe: Callable[[str], None]):
+        self._logger = Logger(self)
+        self._timeout_seconds = config.timeout_ms / 1000
+        self._failure_threshold = config.health.failure_threshold
+        self._backoff_initial = config.health.backoff_initial_ms / 1000
+        self._backoff_max = config.health.backoff_max_ms / 1000
+        self._probe = probe
+        self._states = {
+            server.key: UpstreamState(server.key, self.RTT_SAMPLE_SIZE) for server in config.servers
+        }
+        self._lock = threading.Lock()
+        self._closed = threading.Event()
+        self._prober = threading.Thread(target=self._probe_loop, name="upstream-prober", daemon=True)
+        self._prober.start()
+
+        for state in self._states.values():
+            self._export(state)
+
+    def ordered_servers(self) -> list[str]:
+        """Healthy servers, fastest first. Falls back to every server when none is healthy."""
+        with self._lock:
+            states = list(self._states.values())
+
+        healthy = [state for state in states if state.healthy]
+        if not healthy:
+            # Better a slow answer than none: try everyone, the ones closest to recovery first.
+            return [state.server for state in sorted(states, key=lambda state: state.open_until)]
+
+        return [state.server for state in sorted(healthy, key=self._expected_latency)]
+
+    def record_success(self, server: str, rtt: float):
+        with self._lock:
+            state = self._states.get(server)
+            if state is None:
+                return
+
+            state.rtt = rtt if state.rtt is None else state.rtt + self.EWMA_ALPHA * (rtt - state.rtt)
+            state.rtt_samples.append(rtt)
+            state.error_rate -= self.EWMA_ALPHA * state.error_rate
+            state.consecutive_failures = 0
+            recovered = not state.healthy
+            state.open_until = None
+            state.backoff = 0.0
+
+        if recovered:
+            self._logger.info(f"Upstream {server} recovered")
+        self._export(state)
+
+    def record_failure(self, server: str):
+        with self._lock:
+            state = self._states.get(server)
+            if state is None:
+                return
+
+            state.error_rate += self.EWMA_ALPHA * (1 - state.error_rate)
+            state.consecutive_failures += 1
+            opened = state.healthy and state.consecutive_failures >= self._failure_threshold
+            if opened:
+                self._open_circuit(state)
+
+        if opened:
+            self._logger.warn(
+                f"Upstream {server} failed {state.consecutive_failures} times in a row, "
+                f"backing off for {state.backoff:.1f}s"
+            )
+        self._export(state)
+
+    def rtt_percentile(self, server: str, percentile: int) -> Optional[float]:
+        """The `percentile`th percentile of the server's recent RTTs, or None without samples."""
+        state = self._states.get(server)
+        if state is None:
+            return None
+
+        with self._lock:
+            samples = sorted(state.rtt_samples)
+
+        if not samples:
+            return None
+
+        return samples[min(len(samples) - 1, len(samples) * percentile // 100)]
+
+    def close(self):
+        self._closed.set()
+        self._prober.join()
+
+    def _expected_latency(self, state: UpstreamState) -> float:
+        # A server without RTT samples counts as instant, so it gets measured.
+        rtt = state.rtt if state.rtt is not None else 0.0
+        return (1 - state.error_rate) * rtt + state.error_rate * self._timeout_seconds
+
+    def _open_circuit(self, state: UpstreamState):
+        """Must be called with the lock held."""
+        state.backoff = min(self._backoff_max, state.backoff * 2 if state.backoff else self._backoff_initial)
+        state.open_until = time.monotonic() + state.backoff
+
+    def _probe_loop(self):
+        while not self._closed.wait(self.PROBE_CHECK_INTERVAL_SECONDS):
+            now = time.monotonic()
+            with self._lock:
+                due = [state.server for state in self._states.values() if not state.healthy and state.open_until <= now]
+
+            for server in due:
+                self._probe_server(server)
+
+    def _probe_server(self, server: str):
+        self._logger.debug(f"Probing upstream {server}")
+        start = time.monotonic()
+        try:
+            self._probe(server)
+        except Exception as e:
+            with self._lock:
+                state = self._states[server]
+                self._open_circuit(state)
+
+            self._logger.debug(f"Probe of upstream {server} failed ({e}), backing off for {state.backoff:.1f}s")
+            return
+
+        self.record_success(server, time.monotonic() - start)
+
+    def _export(self, state: UpstreamState):
+        dns_upstream_healthy.labels(state.server).set(1 if state.healthy else 0)
+        dns_upstream_error_rate.labels(state.server).set(state.error_rate)
+        if state.rtt is not None:
+            dns_upstream_rtt.labels(state.server).set(state.rtt)
@@ -0,0 +1,152 @@
+import asyncio
+import itertools
+import secrets
+import socket
+import struct
+from typing import Optional
+
+from toy_dns_server.config.schema import UpstreamServerConfig
+from toy_dns_server.log.logger import Logger
+
+
+class UpstreamSocketPool:
+    """Long-lived, connected UDP sockets to the upstream servers.
+
+    Outgoing queries get a fresh random transaction ID, so queries from many clients can share
+    the same sockets. The sockets are watched by the event loop the pool is first used on, which
+    matches responses to their waiters by (ID, question) and restores the client's original ID
+    before handing the response back. All methods must be called on that loop.
+    """
+    # Large enough for any UDP payload; truncation is up to the upstream and its EDNS buffer size.
+    RECEIVE_BUFFER_SIZE = 65535
+
+    _logger: Logger
+
+    def __init__(self, servers: list[UpstreamServerConfig], sockets_per_server: int):
+        self._logger = Logger(self)
+        self._sockets_per_server = sockets_per_server
+        self._servers = {server.key: server for server in servers}
+        self._sockets: dict[str, list[socket.socket]] = {}
+        self._round_robin: dict[str, itertools.cycle] = {}
+        self._pending: dict[tuple[int, bytes], tuple[asyncio.Future, int, socket.socket]] = {}
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+
+    async def query(self, server: str, packed_query: bytes, timeout: float) -> bytes:
+        try:
+            return await asyncio.wait_for(self.submit(server, packed_query), timeout)
+        except asyncio.TimeoutError:
+            raise TimeoutError(f"Timed out waiting for upstream {server}")
+
+    def submit(self, server: str, packed_query: bytes) -> asyncio.Future:
+        self._ensure_started()
+        server = str(server)
+        question = _question_key(packed_query)
+        original_id = struct.unpack_from("!H", packed_query)[0]
+        future = self._loop.create_future()
+
+        sock = next(self._round_robin[server])
+        key = self._allocate_key(question)
+        self._pending[key] = (future, original_id, sock)
+        future.add_done_callback(lambda _: self._forget(key))
+
+        outgoing = bytearray(packed_query)
+        struct.pack_into("!H", outgoing, 0, key[0])
+        try:
+            sock.send(outgoing)
+        except OSError as e:
+            future.set_exception(e)
+
+        return future
+
+    def close(self):
+        pending = list(self._pending.values())
+        self._pending.clear()
+        for future, _, _ in pending:
+            future.cancel()
+
+        for sockets in self._sockets.values():
+            for sock in sockets:
+                self._loop.remove_reader(sock)
+                sock.close()
+
+    def _ensure_started(self):
+        if self._loop is not None:
+            return
+
+        self._loop = asyncio.get_running_loop()
+        for server in self._servers:
+            self._sockets[server] = [self._open_socket(server) for _ in range(self._sockets_per_server)]
+            self._round_robin[server] = itertools.cycle(self._sockets[server])
+
+        self._logger.info(
+            f"Upstream socket pool started with {self._sockets_per_server} sockets "
+            f"per server for {len(self._servers)} servers"
+        )
+
+    def _open_socket(self, server: str) -> socket.socket:
+        config = self._servers[server]
+        family = socket.AF_INET6 if config.address.version == 6 else socket.AF_INET
+        sock = socket.socket(family, socket.SOCK_DGRAM)
+        sock.setblocking(False)
+        sock.connect((str(config.address), config.port))
+        self._loop.add_reader(sock, self._drain, sock, server)
+        return sock
+
+    def _allocate_key(self, question: bytes) -> tuple[int, bytes]:
+        while True:
+            key = (secrets.randbits(16), question)
+            if key not in self._pending:
+                return key
+
+    def _forget(self, key: tuple[int, bytes]):
+        self._pending.pop(key, None)
+
+    def _drain(self, sock: socket.socket, server: str):
+        while True:
+            try:
+                response = sock.recv(self.RECEIVE_BUFFER_SIZE)
+            except BlockingIOError:
+                return
+            except OSError as e:
+                # ICMP errors (e.g. port unreachable) surface here on connected sockets.
+                self._logger.warn(f"Upstream socket for {server} reported an error: {e}")
+                self._fail_socket(sock, e)
+                return
+
+            self._dispatch(response, server)
+
+    def _dispatch(self, response: bytes, server: str):
+        try:
+            key = (struct.unpack_from("!H", response)[0], _question_key(response))
+        except (struct.error, IndexError):
+            self._logger.warn(f"Dropping malformed response from upstream {server}")
+            return
+
+        waiter = self._pending.pop(key, None)
+        if waiter is None:
+            self._logger.debug(f"Dropping unexpected or late response from upstream {server}")
+            return
+
+        future, original_id, _ = waiter
+        restored = bytearray(response)
+        struct.pack_into("!H", restored, 0, original_id)
+        if not future.done():
+            future.set_result(bytes(restored))
+
+    def _fail_socket(self, sock: socket.socket, error: Exception):
+        failed = [key for key, (_, _, waiter_sock) in self._pending.items() if waiter_sock is sock]
+        for key in failed:
+            future, _, _ = self._pending.pop(key)
+            if not future.done():
+                future.set_exception(error)
+
+
+def _question_key(packet: bytes) -> bytes:
+    """Return the question section (QNAME, QTYPE, QCLASS) of a packet, lowercased for matching."""
+    offset = 12
+    length = packet[offset]
+    while length:
+        offset += length + 1
+        length = packet[offset]
+
+    return bytes(packet[12:offset + 5]).lower()
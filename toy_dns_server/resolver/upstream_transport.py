@@ -0,0 +1,57 @@
+import asyncio
+
+from toy_dns_server.codec.response import is_truncated
+from toy_dns_server.config.schema import UpstreamConfig
+from toy_dns_server.log.logger import Logger
+from toy_dns_server.metrics.metrics import dns_upstream_truncated_counter
+from toy_dns_server.resolver.upstream_connections import UpstreamConnectionPool
+from toy_dns_server.resolver.upstream_pool import UpstreamSocketPool
+
+
+class UpstreamTransport:
+    """Sends queries to the upstream servers over the transport configured for each of them.
+
+    UDP servers are asked over the shared UDP sockets; a truncated (TC) answer is retried over TCP
+    to the same server. TCP and TLS servers are asked over pooled, pipelined connections. All
+    methods must be called on the resolver's event loop.
+    """
+    _logger: Logger
+
+    def __init__(self, config: UpstreamConfig):
+        self._logger = Logger(self)
+        udp_servers = [server for server in config.servers if server.transport == "udp"]
+        # UDP servers get TCP connections too, for retrying truncated answers.
+        self._tcp_fallbacks = {
+            server.key: server.model_copy(update={"transport": "tcp"}) for server in udp_servers
+        }
+        self._datagrams = UpstreamSocketPool(udp_servers, config.sockets_per_server)
+        self._connections = UpstreamConnectionPool(
+            [server for server in config.servers if server.transport != "udp"] + list(self._tcp_fallbacks.values()),
+            config.connections,
+        )
+
+    async def query(self, server: str, packed_query: bytes, timeout: float) -> bytes:
+        try:
+            return await asyncio.wait_for(self.submit(server, packed_query), timeout)
+        except asyncio.TimeoutError:
+            raise TimeoutError(f"Timed out waiting for upstream {server}")
+
+    def submit(self, server: str, packed_query: bytes) -> asyncio.Future:
+        server = str(server)
+        if server not in self._tcp_fallbacks:
+            return self._connections.submit(server, packed_query)
+
+        return asyncio.ensure_future(self._exchange_udp(server, packed_query))
+
+    def close(self):
+        self._datagrams.close()
+        self._connections.close()
+
+    async def _exchange_udp(self, server: str, packed_query: bytes) -> bytes:
+        response = await self._datagrams.submit(server, packed_query)
+        if not is_truncated(response):
+            return response
+
+        self._logger.debug(f"Truncated response from upstream {server}, retrying over TCP")
+        dns_upstream_truncated_counter.inc()
+        return await self._connections.submit(self._tcp_fallbacks[server].key, packed_query)
@@ -1,73 +1,549 @@
-import dns.message
+import base64
+import time
+from typing import Awaitable, Callable, Optional
+
 import dns.dnssec
+import dns.message
 import dns.name
+import dns.rdata
+import dns.rdataclass
+import dns.rcode
 import dns.rdatatype
-import dns.resolver
+import dns.rrset
 
+from toy_dns_server.config.schema import ResolverSecurityConfig
 from toy_dns_server.log.logger import Logger
 from toy_dns_server.metrics.metrics import (
-    dnssec_validation_counter
+    dnssec_key_cache_lookup_counter,
+    dnssec_validation_counter,
 )
+from toy_dns_server.security.key_cache import TrustedKeyCache
+from toy_dns_server.security.signature_verifier import SignatureVerifier, VerificationItem
+
+NSEC3_OPT_OUT = 0x01
+
 
 class DNSSECValidator:
-    """This DNSSECValidator is more of an example, than a production-ready implementation.
-    It is missing multiple features, such as caching, and root trust anchor handling.
+    """Validates signed answers along the chain of trust, from the configured trust anchors down.
+
+    Every RRSIG is checked against the DNSKEY RRset of its signer zone. That RRset is trusted once
+    one of its keys matches a trusted DS record and signs it; the DS RRset in turn is checked against
+    the parent zone's keys, up to a trust anchor. DNSKEY and DS RRsets are fetched through
+    `exchange` (the resolver's own upstreams) and cached once validated, so a warm cache needs no
+    extra queries. The signatures themselves are checked by a `SignatureVerifier`.
+
+    A zone whose parent proves, with signed NSEC or NSEC3 records, that it is an unsigned
+    delegation is insecure: its answers pass without validation. Anything else must be signed, so
+    an RRset without RRSIGs is only accepted once such a proof is found above its owner name.
+    NXDOMAIN and NODATA answers must carry signed NSEC or NSEC3 records proving the denial, and so
+    must answers expanded from a wildcard, proving that no closer match exists.
     """
-    def __init__(self):
+    _logger: Logger
+
+    def __init__(self, config: ResolverSecurityConfig, exchange: Callable[[bytes], Awaitable[Optional[bytes]]]):
         self._logger = Logger(self)
+        self._exchange = exchange
+        self._keys = TrustedKeyCache()
+        self._verifier = SignatureVerifier(config.verification)
+        self._trust_anchors = _parse_trust_anchors(config.trust_anchors)
 
-    def validate(self, response_wire: bytes) -> bool:
+    async def validate(self, response_wire: bytes) -> bool:
+        """Returns False if the response is bogus and must not be served."""
         try:
             msg = dns.message.from_wire(response_wire)
-            name = msg.question[0].name
+            if msg.rcode() not in (dns.rcode.NOERROR, dns.rcode.NXDOMAIN):
+                # Errors carry no data to validate.
+                return True
+
+            question = msg.question[0]
+            self._logger.debug(f"Validating DNSSEC for {question.name}")
+            secure = await self._validate_answer(msg)
+            target = _chain_target(msg, question.name)
+            if msg.rcode() == dns.rcode.NXDOMAIN or not _answers(msg, target, question.rdtype):
+                secure = await self._validate_denial(msg, target, question.rdtype) and secure
+        except Exception as e:
+            self._logger.warn(f"DNSSEC validation failed: {e}")
+            self._observe_metrics("bogus")
+            return False
+
+        self._observe_metrics("secure" if secure else "insecure")
+        return True
+
+    def close(self):
+        self._verifier.close()
+
+    def _observe_metrics(self, result: str):
+        dnssec_validation_counter.labels(result=result).inc()
+
+    async def _validate_answer(self, msg: dns.message.Message) -> bool:
+        """Returns:
+            True if every RRset of the answer section is secure, False if any is insecure.
+
+        Raises:
+            dns.dnssec.ValidationFailure: If any RRset is bogus.
+        """
+        signatures = {
+            (rrset.name, rrset.covers): rrset
+            for rrset in msg.answer
+            if rrset.rdtype == dns.rdatatype.RRSIG
+        }
+
+        secure = True
+        items = []
+        expansions = []
+        for rrset in msg.answer:
+            if rrset.rdtype == dns.rdatatype.RRSIG:
+                continue
+
+            rrsigs = signatures.get((rrset.name, rrset.rdtype))
+            if rrsigs is None:
+                # Stripped signatures must not pass for an unsigned zone.
+                if not await self._is_insecure(rrset.name):
+                    raise dns.dnssec.ValidationFailure(
+                        f"No RRSIG for {rrset.name} {dns.rdatatype.to_text(rrset.rdtype)} in a signed zone"
+                    )
+                secure = False
+                continue
+
+            item = await self._verification_item(rrset, rrsigs)
+            if item is None:
+                secure = False
+                continue
+
+            items.append(item)
+            # An RRSIG over fewer labels than the owner has signs the wildcard this RRset was expanded from.
+            labels = min(rrsig.labels for rrsig in rrsigs)
+            if labels < len(rrset.name) - 1:
+                expansions.append((rrset.name, labels))
+
+        await self._verifier.verify(items)
+        for name, labels in expansions:
+            await self._prove_wildcard_expansion(msg, name, labels)
+        return secure
+
+    async def _prove_wildcard_expansion(self, msg: dns.message.Message, name: dns.name.Name, labels: int):
+        """Check that the authority section proves `name` has no closer match than its wildcard (RFC 4035 section 5.3.4).
+
+        Raises:
+            dns.dnssec.ValidationFailure: If the proof is missing or does not cover `name`.
+        """
+        denials = await self._verified_denials(msg)
+        if denials is None:
+            raise dns.dnssec.ValidationFailure(f"Denial proving the wildcard expansion of {name} is not signed")
+
+        nsec = [rrset for rrset in denials if rrset.rdtype == dns.rdatatype.NSEC]
+        if nsec:
+            proven = any(_nsec_covers(rrset, name) for rrset in nsec)
+        else:
+            # The name one label below the wildcard's parent must not exist.
+            next_closer = name.split(labels + 2)[1]
+            proven = any(_nsec3_covers(rrset, _nsec3_hash(next_closer, rrset[0])) for rrset in denials)
+        if not proven:
+            raise dns.dnssec.ValidationFailure(f"No proof that {name} has no closer match than a wildcard")
+
+    async def _verified_denials(self, msg: dns.message.Message) -> Optional[list[dns.rrset.RRset]]:
+        """The NSEC or NSEC3 RRsets of the authority section, once their signatures and the SOA's check out.
+
+        Returns:
+            The denial RRsets, or None if their signer is insecure.
+
+        Raises:
+            dns.dnssec.ValidationFailure: If any signature is bogus.
+        """
+        records = []
+        for rrset in msg.authority:
+            if rrset.rdtype not in (dns.rdatatype.NSEC, dns.rdatatype.NSEC3, dns.rdatatype.SOA):
+                continue
+
+            rrsigs = msg.get_rrset(msg.authority, rrset.name, dns.rdataclass.IN, dns.rdatatype.RRSIG, rrset.rdtype)
+            if rrsigs is not None:
+                records.append((rrset, rrsigs))
+
+        items = []
+        for rrset, rrsigs in records:
+            item = await self._verification_item(rrset, rrsigs)
+            if item is None:
+                return None
+            items.append(item)
+        await self._verifier.verify(items)
 
-            self._logger.debug(f"Validating DNSSEC for {name}")
+        return [rrset for rrset, _ in records if rrset.rdtype != dns.rdatatype.SOA]
 
-            for rrset in msg.answer:
-                if rrset.rdtype == dns.rdatatype.RRSIG:
-                    continue
+    async def _validate_denial(self, msg: dns.message.Message, name: dns.name.Name, rdtype: int) -> bool:
+        """Check the NSEC or NSEC3 records proving that `name`, or its `rdtype` RRset, does not exist.
 
-                if not self._validate_rrset_with_rrsig(msg, rrset):
-                    self._observe_metrics(False)
-                    return False
+        Returns:
+            True if the denial is secure, False if `name` is in an insecure zone.
 
-            self._logger.info("DNSSEC validation successful")
-            self._observe_metrics("success")
+        Raises:
+            dns.dnssec.ValidationFailure: If the denial is bogus.
+        """
+        denials = await self._verified_denials(msg)
+        if denials is None:
+            return False
+        if not denials:
+            if await self._is_insecure(name):
+                return False
+            raise dns.dnssec.ValidationFailure(f"No signed denial of existence for {name}")
+
+        nxdomain = msg.rcode() == dns.rcode.NXDOMAIN
+        nsec = [rrset for rrset in denials if rrset.rdtype == dns.rdatatype.NSEC]
+        if nsec:
+            proven = _nsec_denies(nsec, name, rdtype, nxdomain)
+        else:
+            proven = _nsec3_denies(denials, name, rdtype, nxdomain)
+        if not proven:
+            raise dns.dnssec.ValidationFailure(f"Denial of existence for {name} does not cover it")
+
+        return True
+
+    async def _is_insecure(self, name: dns.name.Name) -> bool:
+        """Whether `name` is at or below a delegation proven to have no DS record, so it is unsigned.
+
+        Names outside every trust anchor are insecure too: no chain of trust covers them.
+        """
+        anchors = [anchor for anchor in self._trust_anchors if name.is_subdomain(anchor)]
+        if not anchors:
             return True
 
-        except Exception as e:
-            self._logger.warn(f"DNSSEC validation failed: {e}")
-            self._observe_metrics(False)
+        anchor = max(anchors, key=lambda zone: len(zone.labels))
+        for depth in range(len(anchor.labels) + 1, len(name.labels) + 1):
+            zone = name.split(depth)[1]
+            if zone in self._trust_anchors:
+                continue
+            if await self._delegation(zone) is None:
+                return True
+
+        return False
+
+    async def _validate_rrset(
+        self,
+        rrset: dns.rrset.RRset,
+        rrsigs: dns.rrset.RRset,
+        child: Optional[dns.name.Name] = None,
+    ) -> bool:
+        """Check `rrset` against the trusted keys of its signer. Returns False if the signer is insecure."""
+        item = await self._verification_item(rrset, rrsigs, child)
+        if item is None:
             return False
 
-    def _observe_metrics(self, validation_result: bool):
-        result = "valid" if validation_result else "invalid"
-        dnssec_validation_counter.labels(result=result).inc()
+        await self._verifier.verify([item])
+        return True
+
+    async def _verification_item(
+        self,
+        rrset: dns.rrset.RRset,
+        rrsigs: dns.rrset.RRset,
+        child: Optional[dns.name.Name] = None,
+    ) -> Optional[VerificationItem]:
+        """Pair `rrset` with the trusted keys of its signer, or return None if the signer is insecure.
+
+        `child` is the zone a DS RRset or DS denial is about; it must be signed from above that zone.
+        """
+        signer = _signer(rrset.name, rrsigs, child)
+        keys = await self._trusted_dnskeys(signer)
+        if keys is None:
+            return None
+
+        return VerificationItem(rrset, rrsigs, keys)
+
+    async def _trusted_dnskeys(self, zone: dns.name.Name) -> Optional[dns.rrset.RRset]:
+        """The validated DNSKEY RRset of `zone`, or None if the zone is insecure."""
+        found, keys = self._cached(zone, dns.rdatatype.DNSKEY)
+        if found:
+            return keys
+
+        ds = await self._trusted_ds(zone)
+        if ds is None:
+            return None
+
+        response = await self._fetch(zone, dns.rdatatype.DNSKEY)
+        keys = response.get_rrset(response.answer, zone, dns.rdataclass.IN, dns.rdatatype.DNSKEY)
+        rrsigs = response.get_rrset(
+            response.answer, zone, dns.rdataclass.IN, dns.rdatatype.RRSIG, dns.rdatatype.DNSKEY
+        )
+        if keys is None or rrsigs is None:
+            raise dns.dnssec.ValidationFailure(f"No signed DNSKEY RRset for {zone}")
+
+        entry_points = [key for key in keys if any(_matches_ds(zone, key, record) for record in ds)]
+        if not entry_points:
+            raise dns.dnssec.ValidationFailure(f"No DNSKEY of {zone} matches its DS records")
+
+        trusted_keys = dns.rrset.from_rdata_list(zone, keys.ttl, entry_points)
+        await self._verifier.verify([VerificationItem(keys, rrsigs, trusted_keys)])
+        self._keys.set(zone, dns.rdatatype.DNSKEY, keys, _cache_ttl(keys, rrsigs))
+        return keys
+
+    async def _trusted_ds(self, zone: dns.name.Name) -> Optional[dns.rrset.RRset]:
+        """The validated DS RRset of `zone`, or None if the zone is insecure."""
+        ds = await self._delegation(zone)
+        if ds is not None and len(ds) == 0:
+            raise dns.dnssec.ValidationFailure(f"No proof that {zone} is unsigned")
+
+        return ds
+
+    async def _delegation(self, zone: dns.name.Name) -> Optional[dns.rrset.RRset]:
+        """What the parent says about `zone` as a zone cut.
+
+        Returns:
+            The validated DS RRset of a signed zone; None for an unsigned delegation, proven by signed
+            NSEC or NSEC3 records; and an empty RRset when `zone` is not proven to be either, which
+            is how a name that is not a zone cut at all looks.
+        """
+        anchor = self._trust_anchors.get(zone)
+        if anchor is not None:
+            return anchor
+
+        if zone == dns.name.root:
+            raise dns.dnssec.ValidationFailure("No trust anchor for the root zone")
+
+        found, ds = self._cached(zone, dns.rdatatype.DS)
+        if found:
+            return ds
+
+        response = await self._fetch(zone, dns.rdatatype.DS)
+        ds = response.get_rrset(response.answer, zone, dns.rdataclass.IN, dns.rdatatype.DS)
+        if ds is None:
+            ttl = await self._prove_no_ds(zone, response)
+            if ttl is None:
+                no_cut = dns.rrset.RRset(zone, dns.rdataclass.IN, dns.rdatatype.DS)
+                self._keys.set(zone, dns.rdatatype.DS, no_cut, _negative_ttl(response))
+                return no_cut
+
+            self._logger.debug(f"{zone} has no DS record, treating it as insecure")
+            self._keys.set(zone, dns.rdatatype.DS, None, ttl)
+            return None
+
+        rrsigs = response.get_rrset(response.answer, zone, dns.rdataclass.IN, dns.rdatatype.RRSIG, dns.rdatatype.DS)
+        if rrsigs is None:
+            raise dns.dnssec.ValidationFailure(f"No RRSIG for the DS RRset of {zone}")
+
+        if not await self._validate_rrset(ds, rrsigs, child=zone):
+            self._keys.set(zone, dns.rdatatype.DS, None, ds.ttl)
+            return None
+
+        self._keys.set(zone, dns.rdatatype.DS, ds, _cache_ttl(ds, rrsigs))
+        return ds
+
+    async def _prove_no_ds(self, zone: dns.name.Name, response: dns.message.Message) -> Optional[float]:
+        """Find a signed NSEC or NSEC3 record proving that `zone` is a delegation without a DS record.
 
-    def _validate_rrset_with_rrsig(self, msg: dns.message.Message, rrset: dns.rrset.RRset) -> bool:
-        covered_type = rrset.rdtype
-
-        for rr in msg.answer:
-            if rr.rdtype == dns.rdatatype.RRSIG and rr.name == rrset.name:
-                for rdata in rr:
-                    if rdata.covered == covered_type:
-                        try:
-                            dnskey_rrset = self._get_dnskey(msg.question[0].name)
-                            dns.dnssec.validate(rrset, rdata, {msg.question[0].name: dnskey_rrset})
-                            return True
-                        except Exception as e:
-                            self._logger.warn(f"Validation failed for type {covered_type}: {e}")
-                            return False
-
-        self._logger.warn(f"No RRSIG for {covered_type}")
+        Returns:
+            How long the denial may be cached, or None if the response holds no such proof.
+        """
+        for rrset in response.authority:
+            if rrset.rdtype not in (dns.rdatatype.NSEC, dns.rdatatype.NSEC3) or not _denies_ds(zone, rrset):
+                continue
+
+            rrsigs = response.get_rrset(
+                response.authority, rrset.name, dns.rdataclass.IN, dns.rdatatype.RRSIG, rrset.rdtype
+            )
+            if rrsigs is None:
+                continue
+
+            await self._validate_rrset(rrset, rrsigs, child=zone)
+            return _cache_ttl(rrset, rrsigs)
+
+        return None
+
+    def _cached(self, zone: dns.name.Name, rdtype: int) -> tuple[bool, Optional[dns.rrset.RRset]]:
+        found, rrset = self._keys.get(zone, rdtype)
+        dnssec_key_cache_lookup_counter.labels(dns.rdatatype.to_text(rdtype), "hit" if found else "miss").inc()
+        return found, rrset
+
+    async def _fetch(self, name: dns.name.Name, rdtype: int) -> dns.message.Message:
+        self._logger.debug(f"Fetching {dns.rdatatype.to_text(rdtype)} for {name}")
+        query = dns.message.make_query(name, rdtype, want_dnssec=True)
+        response = await self._exchange(query.to_wire())
+        if response is None:
+            raise dns.dnssec.ValidationFailure(f"Failed to fetch {dns.rdatatype.to_text(rdtype)} for {name}")
+
+        return dns.message.from_wire(response)
+
+
+def _parse_trust_anchors(trust_anchors: list[str]) -> dict[dns.name.Name, dns.rrset.RRset]:
+    """Parse DS records written as "<owner> <key tag> <algorithm> <digest type> <digest>"."""
+    records: dict[dns.name.Name, list] = {}
+    for trust_anchor in trust_anchors:
+        owner, rdata = trust_anchor.split(None, 1)
+        records.setdefault(dns.name.from_text(owner), []).append(
+            dns.rdata.from_text(dns.rdataclass.IN, dns.rdatatype.DS, rdata)
+        )
+
+    return {name: dns.rrset.from_rdata_list(name, 0, rdatas) for name, rdatas in records.items()}
+
+
+def _signer(name: dns.name.Name, rrsigs: dns.rrset.RRset, child: Optional[dns.name.Name]) -> dns.name.Name:
+    for rrsig in rrsigs:
+        signer = rrsig.signer
+        if not name.is_subdomain(signer):
+            continue
+        if child is not None and (signer == child or not child.is_subdomain(signer)):
+            continue
+
+        return signer
+
+    raise dns.dnssec.ValidationFailure(f"No usable signer for {name}")
+
+
+def _matches_ds(zone: dns.name.Name, key: dns.rdata.Rdata, ds: dns.rdata.Rdata) -> bool:
+    if ds.key_tag != dns.dnssec.key_id(key) or ds.algorithm != key.algorithm:
         return False
 
+    try:
+        return dns.dnssec.make_ds(zone, key, ds.digest_type) == ds
+    except dns.dnssec.UnsupportedAlgorithm:
+        return False
 
-    def _get_dnskey(self, name: dns.name.Name):
-        try:
-            zone = name.parent() if name.labels > 2 else name
-            answer = dns.resolver.resolve(zone, 'DNSKEY')
-            return answer
-        except Exception as e:
-            self._logger.warn(f"Failed to retrieve DNSKEY for {name}: {e}")
-            raise
+
+def _denies_ds(zone: dns.name.Name, rrset: dns.rrset.RRset) -> bool:
+    """Whether `rrset` shows `zone` to be a delegation without DS records (RFC 4035 section 5.2)."""
+    rdata = rrset[0]
+    if rrset.rdtype == dns.rdatatype.NSEC:
+        return rrset.name == zone and _is_unsigned_delegation(rdata)
+
+    zone_hash = _nsec3_hash(zone, rdata)
+    if _nsec3_owner_hash(rrset) == zone_hash:
+        return _is_unsigned_delegation(rdata)
+
+    # With opt-out, an NSEC3 record covering the name means unsigned delegations were skipped.
+    return bool(rdata.flags & NSEC3_OPT_OUT) and _nsec3_covers(rrset, zone_hash)
+
+
+def _is_unsigned_delegation(rdata: dns.rdata.Rdata) -> bool:
+    # An NS record without SOA marks a delegation; a name inside the zone proves nothing about cuts.
+    return (
+        _has_type(rdata, dns.rdatatype.NS)
+        and not _has_type(rdata, dns.rdatatype.SOA)
+        and not _has_type(rdata, dns.rdatatype.DS)
+    )
+
+
+def _nsec_denies(nsecs: list[dns.rrset.RRset], name: dns.name.Name, rdtype: int, nxdomain: bool) -> bool:
+    """Whether the NSEC records prove that `name` does not exist, or has no `rdtype` RRset (RFC 4035 section 5.4)."""
+    if not nxdomain:
+        for rrset in nsecs:
+            if rrset.name == name:
+                return not _has_type(rrset[0], rdtype) and not _has_type(rrset[0], dns.rdatatype.CNAME)
+
+    covering = next((rrset for rrset in nsecs if _nsec_covers(rrset, name)), None)
+    if covering is None:
+        return False
+
+    # The closest encloser is the longest ancestor `name` shares with either end of the covering
+    # NSEC; a wildcard below it would have matched `name`, so it must not exist either.
+    shared_labels = max(name.fullcompare(covering.name)[2], name.fullcompare(covering[0].next)[2])
+    wildcard = dns.name.Name((b"*",) + name.split(shared_labels)[1].labels)
+    for rrset in nsecs:
+        if _nsec_covers(rrset, wildcard):
+            return True
+        if not nxdomain and rrset.name == wildcard:
+            # NODATA from a wildcard that exists, but not with this type.
+            return not _has_type(rrset[0], rdtype) and not _has_type(rrset[0], dns.rdatatype.CNAME)
+
+    return False
+
+
+def _nsec3_denies(nsec3s: list[dns.rrset.RRset], name: dns.name.Name, rdtype: int, nxdomain: bool) -> bool:
+    """Whether the NSEC3 records prove that `name` does not exist, or has no `rdtype` RRset (RFC 5155 section 8)."""
+    def matching(candidate: dns.name.Name) -> Optional[dns.rrset.RRset]:
+        return next((rrset for rrset in nsec3s if _nsec3_owner_hash(rrset) == _nsec3_hash(candidate, rrset[0])), None)
+
+    def covering(candidate: dns.name.Name) -> Optional[dns.rrset.RRset]:
+        return next((rrset for rrset in nsec3s if _nsec3_covers(rrset, _nsec3_hash(candidate, rrset[0]))), None)
+
+    if not nxdomain:
+        match = matching(name)
+        if match is not None:
+            return not _has_type(match[0], rdtype) and not _has_type(match[0], dns.rdatatype.CNAME)
+
+    # Closest encloser proof: the closest ancestor that exists, and the name one label below it covered.
+    closest_encloser, next_closer = name, None
+    while matching(closest_encloser) is None:
+        if closest_encloser == dns.name.root:
+            return False
+        next_closer, closest_encloser = closest_encloser, closest_encloser.parent()
+
+    if next_closer is None:
+        return False
+    cover = covering(next_closer)
+    if cover is None:
+        return False
+    if cover[0].flags & NSEC3_OPT_OUT:
+        # Unsigned delegations may hide in the skipped span; they are insecure either way.
+        return True
+
+    wildcard = dns.name.Name((b"*",) + closest_encloser.labels)
+    if not nxdomain:
+        # NODATA from a wildcard that exists, but not with this type.
+        match = matching(wildcard)
+        return match is not None and not _has_type(match[0], rdtype) and not _has_type(match[0], dns.rdatatype.CNAME)
+
+    return covering(wildcard) is not None
+
+
+def _nsec_covers(rrset: dns.rrset.RRset, name: dns.name.Name) -> bool:
+    owner, next_name = rrset.name, rrset[0].next
+    if owner < next_name:
+        return owner < name < next_name
+    # The last NSEC of the zone points back to the apex.
+    return name > owner or name < next_name
+
+
+def _nsec3_hash(name: dns.name.Name, rdata: dns.rdata.Rdata) -> str:
+    return dns.dnssec.nsec3_hash(name, rdata.salt, rdata.iterations, rdata.algorithm)
+
+
+def _nsec3_owner_hash(rrset: dns.rrset.RRset) -> str:
+    return rrset.name.labels[0].decode("ascii").upper()
+
+
+def _nsec3_covers(rrset: dns.rrset.RRset, name_hash: str) -> bool:
+    owner_hash = _nsec3_owner_hash(rrset)
+    next_hash = base64.b32hexencode(rrset[0].next).decode("ascii")
+    if owner_hash < next_hash:
+        return owner_hash < name_hash < next_hash
+    return name_hash > owner_hash or name_hash < next_hash
+
+
+def _chain_target(msg: dns.message.Message, name: dns.name.Name) -> dns.name.Name:
+    """Follow the CNAME chain of the answer section from `name` to the name it ends at."""
+    seen = set()
+    while name not in seen:
+        seen.add(name)
+        cname = msg.get_rrset(msg.answer, name, dns.rdataclass.IN, dns.rdatatype.CNAME)
+        if cname is None:
+            break
+        name = cname[0].target
+
+    return name
+
+
+def _answers(msg: dns.message.Message, name: dns.name.Name, rdtype: int) -> bool:
+    if rdtype in (dns.rdatatype.CNAME, dns.rdatatype.ANY):
+        return any(rrset.name == name for rrset in msg.answer)
+    return msg.get_rrset(msg.answer, name, dns.rdataclass.IN, rdtype) is not None
+
+
+def _negative_ttl(response: dns.message.Message) -> float:
+    for rrset in response.authority:
+        if rrset.rdtype == dns.rdatatype.SOA:
+            return float(min(rrset.ttl, rrset[0].minimum))
+
+    return 0.0
+
+
+def _has_type(rdata: dns.rdata.Rdata, rdtype: int) -> bool:
+    window, bit = divmod(rdtype, 256)
+    for number, bitmap in rdata.windows:
+        if number == window:
+            index = bit // 8
+            return index < len(bitmap) and bool(bitmap[index] & (0x80 >> (bit % 8)))
+
+    return False
+
+
+def _cache_ttl(rrset: dns.rrset.RRset, rrsigs: dns.rrset.RRset) -> float:
+    # Never trust keys past the moment their signatures expire.
+    expiration = min(rrsig.expiration for rrsig in rrsigs)
+    return max(0.0, min(float(rrset.ttl), expiration - time.time()))
@@ -0,0 +1,53 @@
+import threading
+import time
+from typing import Optional
+
+import dns.name
+import dns.rrset
+
+
+class TrustedKeyCache:
+    """DNSKEY and DS RRsets that have already been validated, kept until their TTL runs out.
+
+    A zone can also be cached as insecure (stored as None): its parent proved it has no DS record,
+    so nothing it signs can be validated. An empty DS RRset records a name that is not proven to be
+    a zone cut, so it is not looked up again on every validation.
+    """
+    MAX_ENTRIES = 10000
+
+    def __init__(self):
+        self._entries: dict[tuple[dns.name.Name, int], tuple[Optional[dns.rrset.RRset], float]] = {}
+        self._lock = threading.Lock()
+
+    def get(self, zone: dns.name.Name, rdtype: int) -> tuple[bool, Optional[dns.rrset.RRset]]:
+        """Returns:
+            Whether the cache holds the RRset, and the RRset itself (None for an insecure zone).
+        """
+        with self._lock:
+            cached = self._entries.get((zone, rdtype))
+
+        if cached is None:
+            return False, None
+
+        rrset, expires_at = cached
+        if time.monotonic() >= expires_at:
+            return False, None
+
+        return True, rrset
+
+    def set(self, zone: dns.name.Name, rdtype: int, rrset: Optional[dns.rrset.RRset], ttl: float):
+        now = time.monotonic()
+        with self._lock:
+            if len(self._entries) >= self.MAX_ENTRIES:
+                self._evict_expired(now)
+            if len(self._entries) >= self.MAX_ENTRIES:
+                # Still full of live keys; drop the oldest insertion.
+                del self._entries[next(iter(self._entries))]
+
+            self._entries[(zone, rdtype)] = (rrset, now + ttl)
+
+    def _evict_expired(self, now: float):
+        """Must be called with the lock held."""
+        expired = [key for key, (_, expires_at) in self._entries.items() if now >= expires_at]
+        for key in expired:
+            del self._entries[key]
@@ -0,0 +1,163 @@
+import asyncio
+import hashlib
+import multiprocessing
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Optional
+
+import dns.dnssec
+import dns.message
+import dns.name
+import dns.rrset
+
+from toy_dns_server.config.schema import DNSSECVerificationConfig
+from toy_dns_server.log.logger import Logger
+from toy_dns_server.metrics.metrics import (
+    dnssec_verification_cache_lookup_counter,
+    dnssec_verification_processes,
+    dnssec_verification_queue_depth,
+)
+
+# One RRset to check: the RRset, its RRSIGs and the DNSKEY RRset of the signer, each as a DNS message.
+WireItem = tuple[bytes, bytes, bytes]
+
+
+class VerificationItem:
+    """An RRset, its RRSIGs and the signer's keys, encoded once so they can be hashed and shipped to a worker."""
+    __slots__ = ("wire", "digest", "expires_at")
+
+    def __init__(self, rrset: dns.rrset.RRset, rrsigs: dns.rrset.RRset, keys: dns.rrset.RRset):
+        self.wire = (_to_wire(rrset), _to_wire(rrsigs), _to_wire(keys))
+        # Caches count TTLs down, which must not make the same signed data look new.
+        self.digest = hashlib.blake2b(
+            b"".join(_to_wire(_without_ttl(r)) for r in (rrset, rrsigs, keys)), digest_size=16
+        ).digest()
+        self.expires_at = float(min(rrsig.expiration for rrsig in rrsigs))
+
+
+class SignatureVerifier:
+    """Checks RRSIGs in a pool of worker processes, so the CPU-bound crypto does not hold the GIL.
+
+    Results are memoized by a digest of the RRset, its signatures and the keys, TTLs left out, until
+    the signatures expire, so the same signed data is verified only once. Failures are only kept for
+    `FAILURE_MEMO_SECONDS`, so a transient bad answer does not stick to good data. At most `queue_depth` batches wait for the
+    pool; callers beyond that wait until one finishes. With `processes` set to 0, signatures are
+    verified in a thread of the event loop's default executor instead.
+    """
+    MAX_MEMOIZED = 100000
+    FAILURE_MEMO_SECONDS = 5.0
+
+    _logger: Logger
+
+    def __init__(self, config: DNSSECVerificationConfig):
+        self._logger = Logger(self)
+        self._processes = config.processes
+        self._executor: Optional[ProcessPoolExecutor] = None
+        if self._processes > 0:
+            # Forking a process that runs threads can copy held locks into the child; spawn fresh interpreters.
+            self._executor = ProcessPoolExecutor(
+                max_workers=self._processes, mp_context=multiprocessing.get_context("spawn")
+            )
+        self._slots = asyncio.Semaphore(config.queue_depth)
+        self._queued = 0
+        self._results: OrderedDict[bytes, tuple[Optional[str], float]] = OrderedDict()
+        self._lock = threading.Lock()
+        dnssec_verification_processes.set(self._processes)
+
+    async def verify(self, items: list[VerificationItem]):
+        """Verify every item, sending the ones not seen before to the pool as one batch.
+
+        Raises:
+            dns.dnssec.ValidationFailure: If any RRset has no valid signature from the given keys.
+        """
+        now = time.time()
+        errors = {}
+        unknown = []
+        with self._lock:
+            for item in items:
+                memoized = self._results.get(item.digest)
+                if memoized is not None and now < memoized[1]:
+                    dnssec_verification_cache_lookup_counter.labels("hit").inc()
+                    errors[item.digest] = memoized[0]
+                else:
+                    dnssec_verification_cache_lookup_counter.labels("miss").inc()
+                    unknown.append(item)
+
+        if unknown:
+            results = await self._verify_batch([item.wire for item in unknown])
+            with self._lock:
+                for item, error in zip(unknown, results):
+                    errors[item.digest] = error
+                    self._memoize(item, error)
+
+        for error in errors.values():
+            if error is not None:
+                raise dns.dnssec.ValidationFailure(error)
+
+    def close(self):
+        if self._executor is not None:
+            self._executor.shutdown(cancel_futures=True)
+
+    async def _verify_batch(self, batch: list[WireItem]) -> list[Optional[str]]:
+        loop = asyncio.get_running_loop()
+        if self._executor is None:
+            return await loop.run_in_executor(None, verify_batch, batch)
+
+        async with self._slots:
+            self._set_queued(1)
+            try:
+                return await loop.run_in_executor(self._executor, verify_batch, batch)
+            except BrokenProcessPool as e:
+                self._logger.error(f"Verification pool is broken ({e}), verifying in a thread")
+                return await loop.run_in_executor(None, verify_batch, batch)
+            finally:
+                self._set_queued(-1)
+
+    def _set_queued(self, delta: int):
+        with self._lock:
+            self._queued += delta
+            dnssec_verification_queue_depth.set(self._queued)
+
+    def _memoize(self, item: VerificationItem, error: Optional[str]):
+        """Must be called with the lock held."""
+        expires_at = item.expires_at
+        if error is not None:
+            expires_at = min(expires_at, time.time() + self.FAILURE_MEMO_SECONDS)
+        self._results[item.digest] = (error, expires_at)
+        self._results.move_to_end(item.digest)
+        while len(self._results) > self.MAX_MEMOIZED:
+            self._results.popitem(last=False)
+
+
+def verify_batch(batch: list[WireItem]) -> list[Optional[str]]:
+    """Runs in a worker process. Returns, for each item, None if it verified or the reason it did not."""
+    results = []
+    for rrset_wire, rrsigs_wire, keys_wire in batch:
+        try:
+            rrset, rrsigs, keys = _from_wire(rrset_wire), _from_wire(rrsigs_wire), _from_wire(keys_wire)
+            dns.dnssec.validate(rrset, rrsigs, {keys.name: keys})
+            results.append(None)
+        except Exception as e:
+            results.append(str(e) or type(e).__name__)
+
+    return results
+
+
+def _to_wire(rrset: dns.rrset.RRset) -> bytes:
+    # A message per RRset, so a DNSKEY RRset and the keys that sign it do not get merged.
+    message = dns.message.Message(id=0)
+    message.answer.append(rrset)
+    return message.to_wire()
+
+
+def _without_ttl(rrset: dns.rrset.RRset) -> dns.rrset.RRset:
+    rrset = rrset.copy()
+    rrset.ttl = 0
+    return rrset
+
+
+def _from_wire(wire: bytes) -> dns.rrset.RRset:
+    return dns.message.from_wire(wire).answer[0]
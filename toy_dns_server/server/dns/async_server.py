@@ -0,0 +1,188 @@
+import asyncio
+import socket
+import threading
+import time
+from typing import Optional
+
+from toy_dns_server.codec.query import ParsedQuery, parse_query
+from toy_dns_server.codec.response import truncate_for_udp
+from toy_dns_server.config.schema import DNSUDPBatchingConfig
+from toy_dns_server.log.logger import Logger
+from toy_dns_server.resolver.dns_resolver import DNSResolver
+from toy_dns_server.server.dns.mmsg import MMsgDatagramTransport, is_supported as mmsg_supported
+from toy_dns_server.metrics.metrics import (
+    dns_query_counter,
+    dns_query_duration,
+    dns_truncated_response_counter,
+)
+
+
+class DNSDatagramProtocol(asyncio.DatagramProtocol):
+    _logger: Logger
+    _resolver: DNSResolver
+    _transport: Optional[asyncio.DatagramTransport] = None
+
+    def __init__(self, resolver: DNSResolver):
+        self._logger = Logger(self)
+        self._resolver = resolver
+        self._pending: set[asyncio.Task] = set()
+
+    def connection_made(self, transport: asyncio.DatagramTransport):
+        self._transport = transport
+
+    def datagram_received(self, data: bytes, addr):
+        start = time.time()
+        client_ip, client_port = addr[0], addr[1]
+
+        self._logger.debug("Handling DNS query")
+        self._logger.debug(f"Received DNS query from {client_ip}:{client_port}")
+
+        try:
+            query = parse_query(data)
+
+            self._logger.debug(f"Parsed DNS request: {query.qname}")
+
+            response_data = self._resolver.resolve_cached(query)
+        except Exception as e:
+            self._logger.error(f"Failed to handle DNS query from {client_ip}:{client_port}: {e}")
+            self._observe_metrics("0", "error", start)
+            return
+
+        if response_data is not None:
+            self._respond(response_data, addr, query, start)
+            return
+
+        task = asyncio.ensure_future(self._resolve(query, addr, start))
+        self._pending.add(task)
+        task.add_done_callback(self._pending.discard)
+
+    def error_received(self, exc: Exception):
+        self._logger.warn(f"UDP socket error: {exc}")
+
+    async def wait_pending(self):
+        if self._pending:
+            await asyncio.gather(*self._pending, return_exceptions=True)
+
+    async def _resolve(self, query: ParsedQuery, addr, start: float):
+        try:
+            response_data = await self._resolver.resolve(query, cache_checked=True)
+        except Exception as e:
+            self._logger.error(f"Failed to handle DNS query from {addr[0]}:{addr[1]}: {e}")
+            self._observe_metrics("0", "error", start)
+            return
+
+        self._respond(response_data, addr, query, start)
+
+    def _respond(self, response_data: bytes, addr, query: ParsedQuery, start: float):
+        if self._transport is None or self._transport.is_closing():
+            self._logger.warn(f"Transport closed, dropping response to {addr[0]}:{addr[1]}")
+            self._observe_metrics(query.qtype, "error", start)
+            return
+
+        if len(response_data) > query.udp_payload_size:
+            response_data = truncate_for_udp(response_data, query.udp_payload_size)
+            dns_truncated_response_counter.labels("dns").inc()
+
+        self._transport.sendto(response_data, addr)
+        self._logger.info(f"Responded to {addr[0]}:{addr[1]}")
+        self._observe_metrics(query.qtype, "success", start)
+
+    def _observe_metrics(self, qtype: str, status: str, startTime: float):
+        duration = time.time() - startTime
+        self._logger.debug(f"Query duration: {duration:.2f} seconds")
+
+        dns_query_counter.labels(
+            query_type=qtype,
+            status=status,
+            handler_type="dns"
+        ).inc()
+
+        dns_query_duration.labels(
+            query_type=qtype,
+            status=status,
+            handler_type="dns"
+        ).observe(duration)
+
+
+class AsyncUDPServer:
+    """Event loop based counterpart of `ThreadedUDPServer`.
+
+    Exposes the same `serve_forever`/`shutdown`/`server_close` surface, so `DNSServer`
+    can drive either engine the same way. The endpoint runs on the resolver's event loop,
+    so queries are resolved without leaving it.
+
+    With `udp_batching` enabled on Linux, datagrams are moved with recvmmsg/sendmmsg through
+    `MMsgDatagramTransport`; elsewhere the regular asyncio endpoint is used.
+    """
+    _logger: Logger
+
+    def __init__(
+        self,
+        server_address,
+        resolver: DNSResolver,
+        batching: DNSUDPBatchingConfig,
+        reuse_port: bool = False,
+    ):
+        self._logger = Logger(self)
+        self.server_address = server_address
+        self.resolver = resolver
+        self.batching = batching
+        self.reuse_port = reuse_port
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._stop_event: Optional[asyncio.Event] = None
+        self._shutdown_requested = threading.Event()
+
+    def serve_forever(self):
+        self._loop = self.resolver.loop
+        try:
+            asyncio.run_coroutine_threadsafe(self._serve(), self._loop).result()
+        finally:
+            self._loop = None
+
+    def shutdown(self):
+        self._shutdown_requested.set()
+        loop = self._loop
+        if loop is not None and self._stop_event is not None:
+            loop.call_soon_threadsafe(self._stop_event.set)
+
+    def server_close(self):
+        pass
+
+    async def _serve(self):
+        loop = asyncio.get_running_loop()
+        self._stop_event = asyncio.Event()
+        if self._shutdown_requested.is_set():
+            return
+
+        if self.batching.enabled and mmsg_supported():
+            protocol = DNSDatagramProtocol(self.resolver)
+            transport = MMsgDatagramTransport(loop, self._bind_socket(), protocol, self.batching.batch_size)
+            self._logger.debug(f"Batched UDP endpoint bound to {self.server_address}")
+        else:
+            if self.batching.enabled:
+                self._logger.warn("recvmmsg/sendmmsg are not available, falling back to unbatched UDP")
+            transport, protocol = await loop.create_datagram_endpoint(
+                lambda: DNSDatagramProtocol(self.resolver),
+                local_addr=self.server_address,
+                reuse_port=self.reuse_port or None,
+            )
+            self._logger.debug(f"Async UDP endpoint bound to {self.server_address}")
+
+        try:
+            await self._stop_event.wait()
+        finally:
+            await protocol.wait_pending()
+            transport.close()
+
+    def _bind_socket(self) -> socket.socket:
+        host, port = self.server_address
+        sock = socket.socket(socket.AF_INET6 if ":" in host else socket.AF_INET, socket.SOCK_DGRAM)
+        try:
+            if self.reuse_port:
+                sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+            sock.bind((host, port))
+            sock.setblocking(False)
+        except OSError:
+            sock.close()
+            raise
+        return sock
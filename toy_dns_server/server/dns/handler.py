@@ -1,12 +1,14 @@
 import socketserver
 import time
-from dnslib import DNSRecord
 
+from toy_dns_server.codec.query import parse_query
+from toy_dns_server.codec.response import truncate_for_udp
 from toy_dns_server.log.logger import Logger
 from toy_dns_server.resolver.dns_resolver import DNSResolver
 from toy_dns_server.metrics.metrics import (
     dns_query_counter,
     dns_query_duration,
+    dns_truncated_response_counter,
 )
 
 class DNSRequestHandler(socketserver.BaseRequestHandler):
@@ -23,13 +25,16 @@ class DNSRequestHandler(socketserver.BaseRequestHandler):
         self._logger.debug(f"Received DNS query from {client_ip}:{client_port}")
 
         try:
-            dns_request = DNSRecord.parse(data)
-            qname = str(dns_request.q.qname)
-            qtype = dns_request.q.qtype
+            query = parse_query(data)
+            qname = query.qname
+            qtype = query.qtype
 
             self._logger.debug(f"Parsed DNS request: {qname}")
 
-            response_data = self._resolver.resolve(data)
+            response_data = self._resolver.resolve_cached(query) or self._resolver.submit(query, cache_checked=True).result()
+            if len(response_data) > query.udp_payload_size:
+                response_data = truncate_for_udp(response_data, query.udp_payload_size)
+                dns_truncated_response_counter.labels("dns").inc()
             socket_instance.sendto(response_data, self.client_address)
 
             self._logger.info(f"Responded to {client_ip}:{client_port}")
@@ -0,0 +1,279 @@
+import asyncio
+import ctypes
+import errno
+import os
+import socket
+import struct
+import sys
+from functools import lru_cache
+from typing import Optional
+
+from toy_dns_server.metrics.metrics import dns_udp_batch_size
+
+# Same as socketserver.UDPServer; DNS queries are far smaller.
+MAX_DATAGRAM_SIZE = 8192
+SOCKADDR_SIZE = 128  # sizeof(struct sockaddr_storage)
+
+
+class _IOVec(ctypes.Structure):
+    _fields_ = [
+        ("iov_base", ctypes.c_void_p),
+        ("iov_len", ctypes.c_size_t),
+    ]
+
+
+class _MsgHdr(ctypes.Structure):
+    _fields_ = [
+        ("msg_name", ctypes.c_void_p),
+        ("msg_namelen", ctypes.c_uint32),
+        ("msg_iov", ctypes.POINTER(_IOVec)),
+        ("msg_iovlen", ctypes.c_size_t),
+        ("msg_control", ctypes.c_void_p),
+        ("msg_controllen", ctypes.c_size_t),
+        ("msg_flags", ctypes.c_int),
+    ]
+
+
+class _MMsgHdr(ctypes.Structure):
+    _fields_ = [
+        ("msg_hdr", _MsgHdr),
+        ("msg_len", ctypes.c_uint),
+    ]
+
+
+@lru_cache(maxsize=None)
+def _libc() -> Optional[ctypes.CDLL]:
+    if not sys.platform.startswith("linux"):
+        return None
+
+    try:
+        libc = ctypes.CDLL(None, use_errno=True)
+        libc.recvmmsg.argtypes = [ctypes.c_int, ctypes.POINTER(_MMsgHdr), ctypes.c_uint, ctypes.c_int, ctypes.c_void_p]
+        libc.sendmmsg.argtypes = [ctypes.c_int, ctypes.POINTER(_MMsgHdr), ctypes.c_uint, ctypes.c_int]
+    except (OSError, AttributeError):
+        return None
+    return libc
+
+
+@lru_cache(maxsize=None)
+def is_supported() -> bool:
+    """Whether both libc and the kernel provide recvmmsg/sendmmsg."""
+    libc = _libc()
+    if libc is None:
+        return False
+
+    # Nothing is queued on a fresh socket, so a kernel with recvmmsg reports EAGAIN, not ENOSYS.
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as probe:
+        header = _MMsgHdr()
+        if libc.recvmmsg(probe.fileno(), ctypes.byref(header), 1, socket.MSG_DONTWAIT, None) >= 0:
+            return True
+        return ctypes.get_errno() != errno.ENOSYS
+
+
+class MMsgSocket:
+    """Moves up to `batch_size` datagrams per syscall on a non-blocking UDP socket.
+
+    The message headers and receive buffers are allocated once and reused for every call.
+    """
+
+    def __init__(self, sock: socket.socket, batch_size: int):
+        self._libc = _libc()
+        self._sock = sock
+        self._batch_size = batch_size
+
+        self._recv_buffers = ctypes.create_string_buffer(MAX_DATAGRAM_SIZE * batch_size)
+        self._recv_names = ctypes.create_string_buffer(SOCKADDR_SIZE * batch_size)
+        self._recv_iovecs = (_IOVec * batch_size)()
+        self._recv_headers = (_MMsgHdr * batch_size)()
+        self._send_names = ctypes.create_string_buffer(SOCKADDR_SIZE * batch_size)
+        self._send_iovecs = (_IOVec * batch_size)()
+        self._send_headers = (_MMsgHdr * batch_size)()
+
+        buffers = ctypes.addressof(self._recv_buffers)
+        recv_names = ctypes.addressof(self._recv_names)
+        send_names = ctypes.addressof(self._send_names)
+        for i in range(batch_size):
+            self._recv_iovecs[i].iov_base = buffers + i * MAX_DATAGRAM_SIZE
+            self._recv_iovecs[i].iov_len = MAX_DATAGRAM_SIZE
+            self._recv_headers[i].msg_hdr.msg_iov = ctypes.pointer(self._recv_iovecs[i])
+            self._recv_headers[i].msg_hdr.msg_iovlen = 1
+            self._recv_headers[i].msg_hdr.msg_name = recv_names + i * SOCKADDR_SIZE
+            self._send_headers[i].msg_hdr.msg_iov = ctypes.pointer(self._send_iovecs[i])
+            self._send_headers[i].msg_hdr.msg_iovlen = 1
+            self._send_headers[i].msg_hdr.msg_name = send_names + i * SOCKADDR_SIZE
+
+    def recv(self) -> list[tuple[bytes, tuple]]:
+        """Read the datagrams waiting on the socket, at most `batch_size`. Raises BlockingIOError if there are none."""
+        for i in range(self._batch_size):
+            self._recv_headers[i].msg_hdr.msg_namelen = SOCKADDR_SIZE
+            self._recv_headers[i].msg_hdr.msg_flags = 0
+
+        count = self._libc.recvmmsg(self._sock.fileno(), self._recv_headers, self._batch_size, socket.MSG_DONTWAIT, None)
+        if count < 0:
+            _raise_errno()
+        dns_udp_batch_size.labels("receive").observe(count)
+
+        datagrams = []
+        buffers = ctypes.addressof(self._recv_buffers)
+        names = ctypes.addressof(self._recv_names)
+        for i in range(count):
+            header = self._recv_headers[i]
+            if header.msg_hdr.msg_flags & socket.MSG_TRUNC:
+                continue
+            datagrams.append((
+                ctypes.string_at(buffers + i * MAX_DATAGRAM_SIZE, header.msg_len),
+                _decode_sockaddr(ctypes.string_at(names + i * SOCKADDR_SIZE, header.msg_hdr.msg_namelen)),
+            ))
+        return datagrams
+
+    def send(self, datagrams: list[tuple[bytes, tuple]]) -> int:
+        """Send up to `batch_size` of `datagrams`, returning how many went out.
+
+        Raises BlockingIOError if the socket buffer is full, or the error of the first datagram.
+        """
+        datagrams = datagrams[:self._batch_size]
+        payloads = []
+        names_address = ctypes.addressof(self._send_names)
+        for i, (data, addr) in enumerate(datagrams):
+            name = _encode_sockaddr(self._sock.family, addr)
+            ctypes.memmove(names_address + i * SOCKADDR_SIZE, name, len(name))
+            payload = ctypes.c_char_p(data)
+            payloads.append(payload)
+            self._send_iovecs[i].iov_base = ctypes.cast(payload, ctypes.c_void_p)
+            self._send_iovecs[i].iov_len = len(data)
+            self._send_headers[i].msg_hdr.msg_namelen = len(name)
+
+        sent = self._libc.sendmmsg(self._sock.fileno(), self._send_headers, len(datagrams), 0)
+        if sent < 0:
+            _raise_errno()
+        dns_udp_batch_size.labels("send").observe(sent)
+        return sent
+
+
+class MMsgDatagramTransport(asyncio.DatagramTransport):
+    """A datagram transport for the event loop that reads and writes in batches.
+
+    Each time the socket is readable, one recvmmsg pulls a burst of datagrams, which are handed
+    to the protocol one by one. Whatever the protocol answers meanwhile, typically cache hits,
+    is flushed with a single sendmmsg once the burst is done. Answers sent later are queued and
+    flushed together at the end of the event loop iteration.
+    """
+
+    def __init__(
+        self,
+        loop: asyncio.AbstractEventLoop,
+        sock: socket.socket,
+        protocol: asyncio.DatagramProtocol,
+        batch_size: int,
+    ):
+        super().__init__({"socket": sock, "sockname": sock.getsockname()})
+        self._loop = loop
+        self._sock = sock
+        self._protocol = protocol
+        self._mmsg = MMsgSocket(sock, batch_size)
+        self._send_queue: list[tuple[bytes, tuple]] = []
+        self._flush_handle: Optional[asyncio.Handle] = None
+        self._in_burst = False
+        self._waiting_writable = False
+        self._closing = False
+
+        self._protocol.connection_made(self)
+        self._loop.add_reader(sock.fileno(), self._read_ready)
+
+    def sendto(self, data, addr=None):
+        if self._closing:
+            return
+
+        self._send_queue.append((bytes(data), addr))
+        if self._flush_handle is None and not self._in_burst and not self._waiting_writable:
+            self._flush_handle = self._loop.call_soon(self._flush)
+
+    def is_closing(self) -> bool:
+        return self._closing
+
+    def close(self):
+        if self._closing:
+            return
+
+        self._flush()
+        self._closing = True
+        self._loop.remove_reader(self._sock.fileno())
+        if self._waiting_writable:
+            self._loop.remove_writer(self._sock.fileno())
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+        self._sock.close()
+        self._loop.call_soon(self._protocol.connection_lost, None)
+
+    def abort(self):
+        self._send_queue.clear()
+        self.close()
+
+    def get_write_buffer_size(self) -> int:
+        return len(self._send_queue)
+
+    def _read_ready(self):
+        try:
+            datagrams = self._mmsg.recv()
+        except (BlockingIOError, InterruptedError):
+            return
+        except OSError as e:
+            self._protocol.error_received(e)
+            return
+
+        self._in_burst = True
+        try:
+            for data, addr in datagrams:
+                self._protocol.datagram_received(data, addr)
+        finally:
+            self._in_burst = False
+        self._flush()
+
+    def _flush(self):
+        self._flush_handle = None
+        if self._waiting_writable:
+            return
+
+        while self._send_queue:
+            try:
+                sent = self._mmsg.send(self._send_queue)
+            except (BlockingIOError, InterruptedError):
+                self._waiting_writable = True
+                self._loop.add_writer(self._sock.fileno(), self._write_ready)
+                return
+            except OSError as e:
+                # The error belongs to the first datagram; drop it and go on with the rest.
+                self._protocol.error_received(e)
+                sent = 1
+            del self._send_queue[:sent]
+
+    def _write_ready(self):
+        self._waiting_writable = False
+        self._loop.remove_writer(self._sock.fileno())
+        self._flush()
+
+
+def _raise_errno():
+    code = ctypes.get_errno()
+    raise OSError(code, os.strerror(code))
+
+
+def _decode_sockaddr(name: bytes) -> tuple:
+    family = struct.unpack_from("=H", name)[0]
+    port = struct.unpack_from("!H", name, 2)[0]
+    if family == socket.AF_INET6:
+        flowinfo, = struct.unpack_from("!I", name, 4)
+        scope_id, = struct.unpack_from("=I", name, 24)
+        return socket.inet_ntop(socket.AF_INET6, name[8:24]), port, flowinfo, scope_id
+    return socket.inet_ntop(socket.AF_INET, name[4:8]), port
+
+
+def _encode_sockaddr(family: int, addr: tuple) -> bytes:
+    if family == socket.AF_INET6:
+        flowinfo = addr[2] if len(addr) > 2 else 0
+        scope_id = addr[3] if len(addr) > 3 else 0
+        return (
+            struct.pack("=H", socket.AF_INET6) + struct.pack("!HI", addr[1], flowinfo)
+            + socket.inet_pton(socket.AF_INET6, addr[0]) + struct.pack("=I", scope_id)
+        )
+    return struct.pack("=H", socket.AF_INET) + struct.pack("!H", addr[1]) + socket.inet_pton(socket.AF_INET, addr[0]) + bytes(8)
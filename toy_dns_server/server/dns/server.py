@@ -1,44 +1,67 @@
 import socketserver
+from typing import Optional, Union
 
 from toy_dns_server.log.logger import Logger
 from toy_dns_server.resolver.dns_resolver import DNSResolver
+from toy_dns_server.server.dns.async_server import AsyncUDPServer
 from toy_dns_server.server.dns.handler import DNSRequestHandler
+from toy_dns_server.server.dns.tcp_server import AsyncTCPServer
 from toy_dns_server.config.schema import ConfigSchema
 
 class ThreadedUDPServer(socketserver.ThreadingMixIn, socketserver.UDPServer):
     daemon_threads = True
     allow_reuse_address = True
 
-    def __init__(self, server_address, RequestHandlerClass, resolver: DNSResolver):
+    def __init__(self, server_address, RequestHandlerClass, resolver: DNSResolver, reuse_port: bool = False):
         self.resolver = resolver  # Inject resolver into handler
+        self.allow_reuse_port = reuse_port
         super().__init__(server_address, RequestHandlerClass)
 
 
 class DNSServer:
     _logger: Logger
     _resolver: DNSResolver
-    _server: ThreadedUDPServer
+    _server: Union[ThreadedUDPServer, AsyncUDPServer]
+    _tcp_server: Optional[AsyncTCPServer] = None
 
-    def __init__(self, config: ConfigSchema):
+    def __init__(self, config: ConfigSchema, resolver: DNSResolver):
         dns_server_config = config.server.dns
-        resolver_config = config.resolver
         host, port_str = dns_server_config.address.split(":")
         port = int(port_str)
 
         self._logger = Logger(self)
-        self._resolver = DNSResolver(resolver_config)
-        self._server = ThreadedUDPServer(
-            (host, port),
-            DNSRequestHandler,
-            self._resolver
-        )
+        self._resolver = resolver
+        self._engine = dns_server_config.engine
+        reuse_port = config.server.workers > 1
+        if self._engine == "asyncio":
+            self._server = AsyncUDPServer((host, port), self._resolver, dns_server_config.udp_batching, reuse_port)
+        elif self._engine == "threaded":
+            self._server = ThreadedUDPServer(
+                (host, port),
+                DNSRequestHandler,
+                self._resolver,
+                reuse_port
+            )
+        else:
+            raise ValueError(f"Unsupported DNS server engine: {self._engine}")
+
+        if dns_server_config.tcp.enabled:
+            try:
+                self._tcp_server = AsyncTCPServer((host, port), self._resolver, dns_server_config.tcp, reuse_port)
+            except Exception:
+                self._server.server_close()
+                raise
 
     def run(self):
-        self._logger.info(f"Starting DNS server on {self._server.server_address}")
+        self._logger.info(f"Starting DNS server ({self._engine} engine) on {self._server.server_address}")
+        if self._tcp_server is not None:
+            self._tcp_server.start()
         self._server.serve_forever()
 
     def stop(self):
         self._logger.info("Stopping DNS server")
+        if self._tcp_server is not None:
+            self._tcp_server.stop()
         self._server.shutdown()
         self._server.server_close()
         self._logger.info("DNS server stopped")
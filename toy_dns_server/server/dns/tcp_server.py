@@ -0,0 +1,157 @@
+import asyncio
+import struct
+import time
+from typing import Optional
+
+from toy_dns_server.codec.query import parse_query
+from toy_dns_server.config.schema import DNSTCPConfig
+from toy_dns_server.log.logger import Logger
+from toy_dns_server.resolver.dns_resolver import DNSResolver
+from toy_dns_server.metrics.metrics import (
+    dns_query_counter,
+    dns_query_duration,
+    dns_tcp_connections,
+    dns_tcp_rejected_connection_counter,
+)
+
+_LENGTH = struct.Struct("!H")
+
+
+class AsyncTCPServer:
+    """DNS over TCP (RFC 7766), served on the resolver's event loop.
+
+    Every message is prefixed with its 2-byte length. Clients may pipeline queries: each one is
+    resolved as soon as it is read and answered as soon as it is resolved, so responses can come
+    back out of order. A connection is closed once it has been idle, with no queries outstanding,
+    for `idle_timeout_ms`; connections beyond `max_connections` are closed right away.
+    """
+    _logger: Logger
+
+    def __init__(self, server_address, resolver: DNSResolver, config: DNSTCPConfig, reuse_port: bool = False):
+        self._logger = Logger(self)
+        self.server_address = server_address
+        self._resolver = resolver
+        self._loop = resolver.loop
+        self._max_connections = config.max_connections
+        self._idle_timeout = config.idle_timeout_ms / 1000
+        self._pipeline_depth = config.pipeline_depth
+        self._connections: dict[asyncio.StreamWriter, asyncio.Task] = {}
+        self._server: asyncio.Server = asyncio.run_coroutine_threadsafe(
+            self._bind(reuse_port), self._loop
+        ).result()
+
+    def start(self):
+        asyncio.run_coroutine_threadsafe(self._server.start_serving(), self._loop).result()
+        self._logger.info(f"Serving DNS over TCP on {self.server_address}")
+
+    def stop(self):
+        asyncio.run_coroutine_threadsafe(self._close(), self._loop).result()
+
+    async def _bind(self, reuse_port: bool) -> asyncio.Server:
+        host, port = self.server_address
+        return await asyncio.start_server(
+            self._serve_connection,
+            host,
+            port,
+            reuse_address=True,
+            reuse_port=reuse_port or None,
+            start_serving=False,
+        )
+
+    async def _close(self):
+        self._server.close()
+        connections = list(self._connections.items())
+        for writer, _ in connections:
+            writer.close()
+
+        await asyncio.gather(*(task for _, task in connections), return_exceptions=True)
+        await self._server.wait_closed()
+
+    async def _serve_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        peer = writer.get_extra_info("peername")
+        if len(self._connections) >= self._max_connections:
+            self._logger.warn(f"Too many TCP connections, closing the one from {peer[0]}:{peer[1]}")
+            dns_tcp_rejected_connection_counter.inc()
+            writer.close()
+            return
+
+        self._connections[writer] = asyncio.current_task()
+        dns_tcp_connections.inc()
+        self._logger.debug(f"Accepted TCP connection from {peer[0]}:{peer[1]}")
+
+        pending: set[asyncio.Task] = set()
+        slots = asyncio.Semaphore(self._pipeline_depth)
+        write_lock = asyncio.Lock()
+        try:
+            while True:
+                data = await self._read_message(reader, pending)
+                if data is None:
+                    break
+
+                # Stop reading once `pipeline_depth` queries are in flight on this connection.
+                await slots.acquire()
+                task = asyncio.ensure_future(self._answer(data, writer, write_lock, peer))
+                pending.add(task)
+                task.add_done_callback(lambda done: (pending.discard(done), slots.release()))
+        except (ConnectionError, asyncio.CancelledError):
+            pass
+        finally:
+            if pending:
+                await asyncio.gather(*pending, return_exceptions=True)
+
+            del self._connections[writer]
+            dns_tcp_connections.dec()
+            writer.close()
+            self._logger.debug(f"Closed TCP connection from {peer[0]}:{peer[1]}")
+
+    async def _read_message(self, reader: asyncio.StreamReader, pending: set) -> Optional[bytes]:
+        """Read the next length-prefixed message. Returns None on EOF or once the connection is idle."""
+        while True:
+            try:
+                header = await asyncio.wait_for(reader.readexactly(_LENGTH.size), self._idle_timeout)
+                break
+            except asyncio.TimeoutError:
+                # Only a connection without outstanding queries is idle.
+                if not pending:
+                    return None
+            except asyncio.IncompleteReadError:
+                return None
+
+        try:
+            return await asyncio.wait_for(reader.readexactly(_LENGTH.unpack(header)[0]), self._idle_timeout)
+        except (asyncio.TimeoutError, asyncio.IncompleteReadError):
+            return None
+
+    async def _answer(self, data: bytes, writer: asyncio.StreamWriter, write_lock: asyncio.Lock, peer):
+        start = time.time()
+        try:
+            query = parse_query(data)
+            self._logger.debug(f"Parsed DNS request: {query.qname}")
+            response_data = self._resolver.resolve_cached(query) or await self._resolver.resolve(query, cache_checked=True)
+
+            async with write_lock:
+                writer.write(_LENGTH.pack(len(response_data)) + response_data)
+                await writer.drain()
+        except Exception as e:
+            self._logger.error(f"Failed to handle DNS query over TCP from {peer[0]}:{peer[1]}: {e}")
+            self._observe_metrics("0", "error", start)
+            return
+
+        self._logger.info(f"Responded to {peer[0]}:{peer[1]} over TCP")
+        self._observe_metrics(query.qtype, "success", start)
+
+    def _observe_metrics(self, qtype: str, status: str, startTime: float):
+        duration = time.time() - startTime
+        self._logger.debug(f"Query duration: {duration:.2f} seconds")
+
+        dns_query_counter.labels(
+            query_type=qtype,
+            status=status,
+            handler_type="dns"
+        ).inc()
+
+        dns_query_duration.labels(
+            query_type=qtype,
+            status=status,
+            handler_type="dns"
+        ).observe(duration)
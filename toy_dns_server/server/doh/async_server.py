@@ -0,0 +1,309 @@
+import asyncio
+import socket
+import time
+from typing import Optional
+
+from toy_dns_server.codec.query import ParsedQuery, parse_query
+from toy_dns_server.config.schema import DoHConfig
+from toy_dns_server.log.logger import Logger
+from toy_dns_server.resolver.dns_resolver import DNSResolver
+from toy_dns_server.server.doh.http2 import HTTP2Connection
+from toy_dns_server.server.doh.messages import (
+    DNS_MESSAGE_TYPE,
+    REASONS,
+    HTTPError,
+    HTTPRequest,
+    HTTPResponse,
+    decode_get_query,
+)
+from toy_dns_server.server.doh.response_cache import DoHResponseCache, dns_response, freshness_lifetime
+from toy_dns_server.server.doh.tls import ServerTLS, observe_handshake
+from toy_dns_server.metrics.metrics import (
+    dns_query_counter,
+    dns_query_duration,
+)
+
+MAX_HEADER_BYTES = 16384
+MAX_QUERY_BYTES = 65535
+
+
+class AsyncDoHServer:
+    """DNS over HTTPS (RFC 8484) on the resolver's event loop, with a small HTTP/1.1 server.
+
+    Connections are kept alive between requests until the client closes them or they sit idle for
+    `keepalive_timeout_ms`, so a client pays for the TCP and TLS handshakes once. Queries come
+    either as the body of a POST or base64url-encoded in the `dns` parameter of a GET. Requests on
+    one HTTP/1.1 connection are answered in order, as the protocol requires; with TLS, clients can
+    negotiate HTTP/2 through ALPN instead and have their queries answered concurrently.
+
+    Connections are accepted by a loop of our own rather than `asyncio.start_server`, so the TLS
+    handshake runs in each connection's task, bounded by the handshake timeout, with the context
+    current at that moment. A slow client only delays itself, and ticket key rotations reach new
+    connections.
+
+    Answers carry a `Cache-Control: max-age` taken from their smallest TTL, so HTTP caches in front
+    of the server can absorb repeated GET queries, and are kept in a `DoHResponseCache`.
+    """
+    _logger: Logger
+
+    def __init__(
+        self,
+        server_address,
+        resolver: DNSResolver,
+        config: DoHConfig,
+        tls: Optional[ServerTLS] = None,
+        reuse_port: bool = False,
+    ):
+        self._logger = Logger(self)
+        self.server_address = server_address
+        self._resolver = resolver
+        self._loop = resolver.loop
+        self._keepalive_timeout = config.keepalive_timeout_ms / 1000
+        self._max_concurrent_streams = config.http2.max_concurrent_streams
+        self._tls = tls
+        self._response_cache: Optional[DoHResponseCache] = None
+        if config.response_cache.enabled:
+            self._response_cache = DoHResponseCache(config.response_cache)
+        self._connections: set[asyncio.Task] = set()
+        self._accept_task: Optional[asyncio.Task] = None
+        self._stopped = asyncio.Event()
+        host, port = server_address
+        self._socket = socket.create_server(
+            (host, port),
+            family=socket.AF_INET6 if ":" in host else socket.AF_INET,
+            reuse_port=reuse_port,
+        )
+        self._socket.setblocking(False)
+
+    def run(self):
+        scheme = "HTTPS" if self._tls else "HTTP"
+        self._logger.info(f"Starting DoH {scheme} server (asyncio engine) on {self.server_address}")
+        asyncio.run_coroutine_threadsafe(self._serve(), self._loop).result()
+
+    def stop(self):
+        self._logger.info("Stopping DoH server")
+        asyncio.run_coroutine_threadsafe(self._close(), self._loop).result()
+        self._logger.info("DoH server stopped")
+
+    async def _serve(self):
+        self._accept_task = asyncio.ensure_future(self._accept())
+        await self._stopped.wait()
+
+    async def _close(self):
+        if self._accept_task is not None:
+            self._accept_task.cancel()
+            await asyncio.gather(self._accept_task, return_exceptions=True)
+        self._socket.close()
+
+        connections = list(self._connections)
+        for task in connections:
+            task.cancel()
+        await asyncio.gather(*connections, return_exceptions=True)
+        self._stopped.set()
+
+    async def _accept(self):
+        while True:
+            try:
+                conn, peer = await self._loop.sock_accept(self._socket)
+            except OSError as e:
+                self._logger.error(f"Failed to accept DoH connection: {e}")
+                await asyncio.sleep(0.1)
+                continue
+
+            task = asyncio.ensure_future(self._serve_connection(conn, peer))
+            self._connections.add(task)
+            task.add_done_callback(self._connections.discard)
+
+    async def _serve_connection(self, conn: socket.socket, peer):
+        try:
+            reader, writer = await self._open_streams(conn)
+        except (OSError, asyncio.CancelledError):
+            return
+
+        try:
+            ssl_object = writer.get_extra_info("ssl_object")
+            if ssl_object is not None and ssl_object.selected_alpn_protocol() == "h2":
+                await HTTP2Connection(
+                    reader,
+                    writer,
+                    lambda request: self._respond(request, peer),
+                    self._max_concurrent_streams,
+                    MAX_QUERY_BYTES,
+                    self._keepalive_timeout,
+                ).serve()
+            else:
+                await self._serve_http1(reader, writer, peer)
+        except (OSError, asyncio.CancelledError):
+            pass
+        finally:
+            writer.close()
+
+    async def _open_streams(self, conn: socket.socket) -> tuple[asyncio.StreamReader, asyncio.StreamWriter]:
+        """Wrap an accepted socket in streams, after the TLS handshake if there is one."""
+        reader = asyncio.StreamReader(limit=MAX_HEADER_BYTES)
+        protocol = asyncio.StreamReaderProtocol(reader)
+        if self._tls is None:
+            transport, _ = await self._loop.connect_accepted_socket(lambda: protocol, conn)
+        else:
+            start = time.monotonic()
+            try:
+                transport, _ = await self._loop.connect_accepted_socket(
+                    lambda: protocol,
+                    conn,
+                    ssl=self._tls.context(),
+                    ssl_handshake_timeout=self._tls.handshake_timeout,
+                )
+            except OSError:
+                observe_handshake(None, time.monotonic() - start)
+                raise
+            observe_handshake(transport.get_extra_info("ssl_object"), time.monotonic() - start)
+
+        return reader, asyncio.StreamWriter(transport, protocol, reader, self._loop)
+
+    async def _serve_http1(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter, peer):
+        while True:
+            try:
+                request = await self._read_request(reader)
+            except HTTPError as e:
+                await self._send(writer, _error_response(e), "HTTP/1.1", keep_alive=False)
+                break
+
+            if request is None:
+                break
+
+            response = await self._respond(request, peer)
+            await self._send(writer, response, request.version, request.keep_alive)
+            if not request.keep_alive:
+                break
+
+    async def _read_request(self, reader: asyncio.StreamReader) -> Optional[HTTPRequest]:
+        """Read the next request. Returns None on EOF or once the connection has been idle too long."""
+        try:
+            head = await asyncio.wait_for(reader.readuntil(b"\r\n\r\n"), self._keepalive_timeout)
+        except (asyncio.TimeoutError, asyncio.IncompleteReadError):
+            return None
+        except asyncio.LimitOverrunError:
+            raise HTTPError(431, "Request header too large")
+
+        try:
+            request_line, *header_lines = head[:-4].decode("latin-1").split("\r\n")
+            method, target, version = request_line.split(" ")
+            headers = {}
+            for line in header_lines:
+                name, value = line.split(":", 1)
+                headers[name.strip().lower()] = value.strip()
+        except ValueError:
+            raise HTTPError(400, "Malformed request")
+
+        if not version.startswith("HTTP/1."):
+            raise HTTPError(400, "Unsupported HTTP version")
+
+        if "transfer-encoding" in headers:
+            raise HTTPError(501, "Transfer-Encoding is not supported")
+
+        try:
+            content_length = int(headers.get("content-length", 0))
+        except ValueError:
+            raise HTTPError(400, "Invalid Content-Length")
+
+        if content_length > MAX_QUERY_BYTES:
+            raise HTTPError(413, "Payload Too Large")
+
+        try:
+            body = await asyncio.wait_for(reader.readexactly(content_length), self._keepalive_timeout)
+        except (asyncio.TimeoutError, asyncio.IncompleteReadError):
+            return None
+
+        return HTTPRequest(method, target, version, headers, body)
+
+    async def _respond(self, request: HTTPRequest, peer) -> HTTPResponse:
+        start = time.time()
+        try:
+            query_data = self._query_data(request)
+            self._logger.debug(f"Received DoH query from {peer[0]}:{peer[1]}")
+            try:
+                query = parse_query(query_data, "doh")
+            except ValueError as e:
+                raise HTTPError(400, f"Malformed DNS query: {e}")
+            self._logger.debug(f"Parsed DNS query: {query.qname}")
+            response = await self._answer(query)
+        except HTTPError as e:
+            self._log_request(request, e.status, peer)
+            self._observe_metrics("0", "error", start)
+            return _error_response(e)
+        except Exception as e:
+            self._logger.error(f"Failed to handle DoH query: {e}")
+            self._log_request(request, 500, peer)
+            self._observe_metrics("0", "error", start)
+            return _error_response(HTTPError(500, "Internal Server Error"))
+
+        self._log_request(request, 200, peer)
+        self._observe_metrics(query.qtype, "success", start)
+        return response
+
+    async def _answer(self, query: ParsedQuery) -> HTTPResponse:
+        if self._response_cache is not None:
+            cached = self._response_cache.get(query.cache_key, query.id)
+            if cached is not None:
+                # The resolver's entry must still see the hit, or it is never prefetched.
+                self._resolver.record_cached_hit(query)
+                return cached
+
+        response_data = self._resolver.resolve_cached(query) or await self._resolver.resolve(query, cache_checked=True)
+        max_age = freshness_lifetime(response_data)
+        if self._response_cache is not None and max_age is not None:
+            self._response_cache.set(query.cache_key, response_data, max_age)
+
+        return dns_response(response_data, max_age)
+
+    def _query_data(self, request: HTTPRequest) -> bytes:
+        if request.method == "POST":
+            if request.headers.get("content-type") != DNS_MESSAGE_TYPE:
+                raise HTTPError(415, "Unsupported Media Type")
+            if not request.body:
+                raise HTTPError(400, "No DNS query data provided")
+            return request.body
+
+        if request.method == "GET":
+            return decode_get_query(request.target)
+
+        raise HTTPError(405, "Method Not Allowed")
+
+    async def _send(self, writer: asyncio.StreamWriter, response: HTTPResponse, version: str, keep_alive: bool):
+        headers = dict(response.headers)
+        headers["Content-Length"] = str(len(response.body))
+        if version == "HTTP/1.0" and keep_alive:
+            headers["Connection"] = "keep-alive"
+        elif not keep_alive:
+            headers["Connection"] = "close"
+
+        head = f"HTTP/1.1 {response.status} {REASONS[response.status]}\r\n"
+        head += "".join(f"{name}: {value}\r\n" for name, value in headers.items())
+        writer.write(head.encode("latin-1") + b"\r\n" + response.body)
+        await writer.drain()
+
+    def _log_request(self, request: HTTPRequest, status: int, peer):
+        self._logger.info(f'{peer[0]} - "{request.method} {request.target} {request.version}" {status}')
+
+    def _observe_metrics(self, qtype: str, status: str, startTime: float):
+        duration = time.time() - startTime
+        self._logger.debug(f"Query duration: {duration:.2f} seconds")
+
+        dns_query_counter.labels(
+            query_type=qtype,
+            status=status,
+            handler_type="doh"
+        ).inc()
+
+        dns_query_duration.labels(
+            query_type=qtype,
+            status=status,
+            handler_type="doh"
+        ).observe(duration)
+
+
+def _error_response(error: HTTPError) -> HTTPResponse:
+    headers = {"Content-Type": "text/plain"}
+    if error.status == 405:
+        headers["Allow"] = "GET, POST"
+    return HTTPResponse(error.status, headers, f"{error}\n".encode())
@@ -0,0 +1,169 @@
+import asyncio
+from typing import Awaitable, Callable
+
+import h2.config
+import h2.connection
+import h2.errors
+import h2.events
+import h2.exceptions
+import h2.settings
+
+from toy_dns_server.log.logger import Logger
+from toy_dns_server.server.doh.messages import HTTPRequest, HTTPResponse
+
+READ_SIZE = 65536
+
+
+class HTTP2Connection:
+    """Serves one HTTP/2 connection (RFC 9113) negotiated through ALPN.
+
+    Every stream is answered by its own task, so concurrent queries on the connection are resolved
+    in parallel and answered as soon as each one is ready. The client may open at most
+    `max_concurrent_streams` streams at once. Request bodies are acknowledged as they are read, so
+    the client is never stalled by our receive window, and response bodies are sent no faster
+    than the client's flow-control window allows.
+    """
+    _logger: Logger
+
+    def __init__(
+        self,
+        reader: asyncio.StreamReader,
+        writer: asyncio.StreamWriter,
+        respond: Callable[[HTTPRequest], Awaitable[HTTPResponse]],
+        max_concurrent_streams: int,
+        max_body_bytes: int,
+        idle_timeout: float,
+    ):
+        self._logger = Logger(self)
+        self._reader = reader
+        self._writer = writer
+        self._respond = respond
+        self._max_body_bytes = max_body_bytes
+        self._idle_timeout = idle_timeout
+        self._conn = h2.connection.H2Connection(
+            h2.config.H2Configuration(client_side=False, header_encoding="utf-8")
+        )
+        self._conn.local_settings = h2.settings.Settings(
+            client=False,
+            initial_values={h2.settings.SettingCodes.MAX_CONCURRENT_STREAMS: max_concurrent_streams},
+        )
+        # stream ID -> (request headers, body read so far)
+        self._requests: dict[int, tuple[list, bytearray]] = {}
+        self._streams: dict[int, asyncio.Task] = {}
+        self._window_updated = asyncio.Event()
+
+    async def serve(self):
+        self._conn.initiate_connection()
+        await self._flush()
+        try:
+            while True:
+                data = await self._read()
+                if not data:
+                    break
+
+                try:
+                    events = self._conn.receive_data(data)
+                except h2.exceptions.ProtocolError as e:
+                    self._logger.warn(f"HTTP/2 protocol error: {e}")
+                    break
+
+                if not self._handle_events(events):
+                    break
+                await self._flush()
+        finally:
+            for task in self._streams.values():
+                task.cancel()
+            await asyncio.gather(*self._streams.values(), return_exceptions=True)
+            await self._flush()
+
+    async def _read(self) -> bytes:
+        while True:
+            try:
+                return await asyncio.wait_for(self._reader.read(READ_SIZE), self._idle_timeout)
+            except asyncio.TimeoutError:
+                # Only a connection without streams in progress is idle.
+                if not self._streams and not self._requests:
+                    self._conn.close_connection()
+                    return b""
+
+    def _handle_events(self, events: list) -> bool:
+        """Returns False once the client has closed the connection."""
+        for event in events:
+            if isinstance(event, h2.events.RequestReceived):
+                self._requests[event.stream_id] = (event.headers, bytearray())
+            elif isinstance(event, h2.events.DataReceived):
+                self._receive_body(event)
+            elif isinstance(event, h2.events.StreamEnded):
+                self._start_stream(event.stream_id)
+            elif isinstance(event, h2.events.StreamReset):
+                self._requests.pop(event.stream_id, None)
+                task = self._streams.pop(event.stream_id, None)
+                if task is not None:
+                    task.cancel()
+            elif isinstance(event, (h2.events.WindowUpdated, h2.events.RemoteSettingsChanged)):
+                self._window_updated.set()
+            elif isinstance(event, h2.events.ConnectionTerminated):
+                return False
+
+        return True
+
+    def _receive_body(self, event: h2.events.DataReceived):
+        self._conn.acknowledge_received_data(event.flow_controlled_length, event.stream_id)
+        request = self._requests.get(event.stream_id)
+        if request is None:
+            return
+
+        body = request[1]
+        body.extend(event.data)
+        if len(body) > self._max_body_bytes:
+            del self._requests[event.stream_id]
+            self._conn.reset_stream(event.stream_id, h2.errors.ErrorCodes.REFUSED_STREAM)
+
+    def _start_stream(self, stream_id: int):
+        request = self._requests.pop(stream_id, None)
+        if request is None:
+            return
+
+        headers, body = request
+        pseudo = {name: value for name, value in headers if name.startswith(":")}
+        task = asyncio.ensure_future(self._answer(stream_id, HTTPRequest(
+            pseudo.get(":method", ""),
+            pseudo.get(":path", ""),
+            "HTTP/2",
+            {name: value for name, value in headers if not name.startswith(":")},
+            bytes(body),
+        )))
+        self._streams[stream_id] = task
+        task.add_done_callback(lambda _: self._streams.pop(stream_id, None))
+
+    async def _answer(self, stream_id: int, request: HTTPRequest):
+        response = await self._respond(request)
+        headers = [(":status", str(response.status))]
+        headers += [(name.lower(), value) for name, value in response.headers.items()]
+        headers.append(("content-length", str(len(response.body))))
+        try:
+            self._conn.send_headers(stream_id, headers, end_stream=not response.body)
+            await self._send_body(stream_id, response.body)
+            await self._flush()
+        except h2.exceptions.StreamClosedError:
+            self._logger.debug(f"HTTP/2 stream {stream_id} was closed before its response was sent")
+
+    async def _send_body(self, stream_id: int, body: bytes):
+        view = memoryview(body)
+        while view:
+            window = self._conn.local_flow_control_window(stream_id)
+            if window <= 0:
+                await self._flush()
+                self._window_updated.clear()
+                await self._window_updated.wait()
+                continue
+
+            size = min(window, len(view), self._conn.max_outbound_frame_size)
+            self._conn.send_data(stream_id, view[:size].tobytes(), end_stream=size == len(view))
+            view = view[size:]
+
+    async def _flush(self):
+        data = self._conn.data_to_send()
+        if data and not self._writer.is_closing():
+            self._writer.write(data)
+            await self._writer.drain()
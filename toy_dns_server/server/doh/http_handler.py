@@ -6,7 +6,9 @@ from toy_dns_server.metrics.metrics import (
     dns_query_counter,
     dns_query_duration,
 )
-from dnslib import DNSRecord
+from toy_dns_server.codec.query import parse_query
+from toy_dns_server.server.doh.messages import HTTPError, decode_get_query
+from toy_dns_server.server.doh.response_cache import freshness_lifetime
 import traceback
 
 class DNSOverHTTPHandler(BaseHTTPRequestHandler):
@@ -26,7 +28,16 @@ class DNSOverHTTPHandler(BaseHTTPRequestHandler):
         metrics = self._handle_request()
         self._observe_metrics(metrics["qtype"], metrics["status"], start_time)
 
-
+    def do_GET(self):
+        start_time = time.time()
+        try:
+            query_data = decode_get_query(self.path)
+        except HTTPError as e:
+            self.send_error(e.status, str(e))
+            metrics = _error_response_metric
+        else:
+            metrics = self._answer(query_data)
+        self._observe_metrics(metrics["qtype"], metrics["status"], start_time)
 
     def _handle_request(self):
         content_type = self.headers.get("Content-Type")
@@ -48,18 +59,29 @@ class DNSOverHTTPHandler(BaseHTTPRequestHandler):
             if not query_data:
                 self.send_error(400, "Empty DNS query data")
                 return _error_response_metric
+        except Exception as e:
+            self._logger.error(f"Failed to handle DoH query: {e}\n{traceback.format_exc()}")
+            self.send_error(500, "Internal Server Error")
+            return _error_response_metric
 
+        return self._answer(query_data)
+
+    def _answer(self, query_data: bytes):
+        try:
             self._logger.debug(f"Received DoH query from {self.client_address[0]}:{self.client_address[1]}")
-            dns_request = DNSRecord.parse(query_data)
-            self._logger.debug(f"Parsed DNS query: {dns_request.q.qname}")
+            query = parse_query(query_data, "doh")
+            self._logger.debug(f"Parsed DNS query: {query.qname}")
 
-            qtype = dns_request.q.qtype
+            qtype = query.qtype
 
-            response_data = self.resolver.resolve(query_data)
+            response_data = self.resolver.resolve_cached(query) or self.resolver.submit(query, cache_checked=True).result()
 
             self.send_response(200)
             self.send_header("Content-Type", "application/dns-message")
             self.send_header("Content-Length", str(len(response_data)))
+            max_age = freshness_lifetime(response_data)
+            if max_age is not None:
+                self.send_header("Cache-Control", f"max-age={max_age}")
             self.end_headers()
             self.wfile.write(response_data)
 
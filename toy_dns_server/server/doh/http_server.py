@@ -9,12 +9,19 @@ from toy_dns_server.server.doh.doh_handler import make_doh_handler
 class DoHHTTPServer:
     _logger: Logger
 
-    def __init__(self, config: DoHHTTPConfig, resolver: DNSResolver):
+    def __init__(self, config: DoHHTTPConfig, resolver: DNSResolver, reuse_port: bool = False):
         self._logger = Logger(self)
         self._logger.debug("Creating DoH HTTP server")
         host, port = config.listen_address.split(":")
         handler_cls = make_doh_handler(resolver)
-        self._httpd = ThreadingHTTPServer((host, int(port)), handler_cls)
+        self._httpd = ThreadingHTTPServer((host, int(port)), handler_cls, bind_and_activate=False)
+        self._httpd.allow_reuse_port = reuse_port
+        try:
+            self._httpd.server_bind()
+            self._httpd.server_activate()
+        except Exception:
+            self._httpd.server_close()
+            raise
 
     def run(self):
         self._logger.info(f"Starting DoH HTTP server on {self._httpd.server_address}")
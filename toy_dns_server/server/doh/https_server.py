@@ -1,4 +1,3 @@
-from posixpath import abspath
 import ssl
 from http.server import ThreadingHTTPServer
 
@@ -6,31 +5,27 @@ from toy_dns_server.log.logger import Logger
 from toy_dns_server.config.schema import DoHHTTPSConfig
 from toy_dns_server.resolver.dns_resolver import DNSResolver
 from toy_dns_server.server.doh.doh_handler import make_doh_handler
+from toy_dns_server.server.doh.tls import ServerTLS
 
 class DoHHTTPSServer:
     _logger: Logger
 
-    def __init__(self, config: DoHHTTPSConfig, resolver: DNSResolver):
+    def __init__(self, config: DoHHTTPSConfig, resolver: DNSResolver, reuse_port: bool = False):
         self._logger = Logger(self)
         self._logger.debug("Creating DoH HTTPS server")
         host, port = config.listen_address.split(":")
 
         handler_cls = make_doh_handler(resolver)
-        self._httpd = ThreadingHTTPServer((host, int(port)), handler_cls)
+        self._httpd = _TLSThreadingHTTPServer((host, int(port)), handler_cls, bind_and_activate=False)
+        self._httpd.allow_reuse_port = reuse_port
+        try:
+            self._httpd.server_bind()
+            self._httpd.server_activate()
+        except Exception:
+            self._httpd.server_close()
+            raise
 
-        self._logger.debug("Wrapping HTTP server with SSL context")
-        context = ssl.SSLContext(self._tls_version(config.security.min_tls_version))
-
-        abs_certfile_path = abspath(config.security.certificate_file)
-        abs_keyfile_path = abspath(config.security.key_file)
-        self._logger.debug(f"Loading certificate from {abs_certfile_path}")
-        self._logger.debug(f"Loading key from {abs_keyfile_path}")
-
-        context.load_cert_chain(
-            certfile=abs_certfile_path,
-            keyfile=abs_keyfile_path
-        )
-        self._httpd.socket = context.wrap_socket(self._httpd.socket, server_side=True)
+        self._httpd.tls = ServerTLS(config.security, ["http/1.1"])
 
     def run(self):
         self._logger.info(f"Starting DoH HTTPS server on {self._httpd.server_address}")
@@ -42,14 +37,31 @@ class DoHHTTPSServer:
         self._httpd.server_close()
         self._logger.info("DoH HTTPS server stopped")
 
-    def _tls_version(self, version: str):
-        if version == "TLS13":
-            return ssl.PROTOCOL_TLSv1_3
-        elif version == "TLS12":
-            return ssl.PROTOCOL_TLSv1_2
-        elif version == "TLS11":
-            return ssl.PROTOCOL_TLSv1_1
-        elif version == "TLS10":
-            return ssl.PROTOCOL_TLSv1
-        else:
-            raise ValueError(f"Unsupported TLS version: {version}")
+
+class _TLSThreadingHTTPServer(ThreadingHTTPServer):
+    """Runs the TLS handshake in the connection's own thread rather than in `accept`, so a slow
+    client cannot hold up the connections queued behind it."""
+    tls: ServerTLS
+
+    def finish_request(self, request, client_address):
+        try:
+            tls_sock = self.tls.wrap(request)
+        except OSError:
+            return
+
+        try:
+            super().finish_request(tls_sock, client_address)
+        finally:
+            _send_close_notify(tls_sock)
+            # Wrapping detached `request`, so it is this socket that has to be shut down.
+            self.shutdown_request(tls_sock)
+
+
+def _send_close_notify(tls_sock: ssl.SSLSocket):
+    """End the TLS session cleanly; OpenSSL drops sessions of unclean connections from its cache."""
+    tls_sock.settimeout(0)
+    try:
+        tls_sock.unwrap()
+    except (OSError, ValueError):
+        # Not waiting for the client's close_notify, or the connection is already gone.
+        pass
@@ -0,0 +1,64 @@
+import base64
+import binascii
+from urllib.parse import parse_qs, urlsplit
+
+DNS_MESSAGE_TYPE = "application/dns-message"
+
+REASONS = {
+    200: "OK",
+    400: "Bad Request",
+    405: "Method Not Allowed",
+    411: "Length Required",
+    413: "Payload Too Large",
+    415: "Unsupported Media Type",
+    431: "Request Header Fields Too Large",
+    500: "Internal Server Error",
+    501: "Not Implemented",
+}
+
+
+class HTTPError(Exception):
+    def __init__(self, status: int, message: str):
+        super().__init__(message)
+        self.status = status
+
+
+class HTTPRequest:
+    """A request as read by either protocol: header names are lowercased, `version` is e.g. "HTTP/2"."""
+    __slots__ = ("method", "target", "version", "headers", "body")
+
+    def __init__(self, method: str, target: str, version: str, headers: dict[str, str], body: bytes):
+        self.method = method
+        self.target = target
+        self.version = version
+        self.headers = headers
+        self.body = body
+
+    @property
+    def keep_alive(self) -> bool:
+        connection = self.headers.get("connection", "").lower()
+        if self.version == "HTTP/1.0":
+            return connection == "keep-alive"
+        return connection != "close"
+
+
+class HTTPResponse:
+    __slots__ = ("status", "headers", "body")
+
+    def __init__(self, status: int, headers: dict[str, str], body: bytes):
+        self.status = status
+        self.headers = headers
+        self.body = body
+
+
+def decode_get_query(target: str) -> bytes:
+    """Extract the DNS query from the `dns` parameter of a GET request target (RFC 8484, section 4.1)."""
+    encoded = parse_qs(urlsplit(target).query).get("dns")
+    if not encoded:
+        raise HTTPError(400, "Missing dns parameter")
+
+    try:
+        # base64url without padding.
+        return base64.urlsafe_b64decode(encoded[0] + "=" * (-len(encoded[0]) % 4))
+    except (binascii.Error, ValueError):
+        raise HTTPError(400, "Invalid dns parameter")
@@ -0,0 +1,73 @@
+import time
+from collections import OrderedDict
+from typing import Optional
+
+from toy_dns_server.codec.response import RCODE_NOERROR, RCODE_NXDOMAIN, scan_response, with_transaction_id
+from toy_dns_server.config.schema import DoHResponseCacheConfig
+from toy_dns_server.metrics.metrics import doh_response_cache_lookup_counter
+from toy_dns_server.server.doh.messages import DNS_MESSAGE_TYPE, HTTPResponse
+
+
+class DoHResponseCache:
+    """Ready-made DoH answers, keyed by the normalized question.
+
+    Answers are stored with transaction ID 0, so every client asking the same question gets the
+    same bytes, as RFC 8484 section 4.1 intends; a client that sent another ID gets it patched
+    back in. An entry lives for the answer's freshness lifetime, at most `max_age_seconds`. Its
+    records keep the TTLs they had when it was stored, so hits carry an `Age` header for clients
+    and HTTP caches to subtract (RFC 8484 section 5.1). Must only be used from a single event loop.
+    """
+
+    def __init__(self, config: DoHResponseCacheConfig):
+        self._max_entries = config.max_entries
+        self._max_age = config.max_age_seconds
+        # key -> (answer with ID 0, max-age, time stored)
+        self._entries: OrderedDict[str, tuple[bytes, int, float]] = OrderedDict()
+
+    def get(self, key: str, transaction_id: int) -> Optional[HTTPResponse]:
+        cached = self._entries.get(key)
+        now = time.monotonic()
+        if cached is None or now >= cached[2] + min(cached[1], self._max_age):
+            doh_response_cache_lookup_counter.labels("miss").inc()
+            return None
+
+        doh_response_cache_lookup_counter.labels("hit").inc()
+        self._entries.move_to_end(key)
+        body, max_age, stored_at = cached
+        if transaction_id:
+            body = with_transaction_id(body, transaction_id)
+
+        return dns_response(body, max_age, int(now - stored_at))
+
+    def set(self, key: str, response_data: bytes, max_age: int):
+        if max_age <= 0:
+            return
+
+        self._entries[key] = (with_transaction_id(response_data, 0), max_age, time.monotonic())
+        self._entries.move_to_end(key)
+        while len(self._entries) > self._max_entries:
+            self._entries.popitem(last=False)
+
+
+def dns_response(body: bytes, max_age: Optional[int], age: Optional[int] = None) -> HTTPResponse:
+    headers = {"Content-Type": DNS_MESSAGE_TYPE}
+    if max_age is not None:
+        headers["Cache-Control"] = f"max-age={max_age}"
+    if age is not None:
+        headers["Age"] = str(age)
+
+    return HTTPResponse(200, headers, body)
+
+
+def freshness_lifetime(response_data: bytes) -> Optional[int]:
+    """The smallest TTL of the answer (RFC 8484 section 5.1), or None if it should not be cached."""
+    try:
+        layout = scan_response(response_data)
+    except ValueError:
+        return None
+
+    if layout.rcode not in (RCODE_NOERROR, RCODE_NXDOMAIN):
+        return None
+    if layout.is_negative:
+        return layout.negative_ttl
+    return layout.min_answer_ttl
@@ -1,25 +1,33 @@
 from toy_dns_server.config.schema import ConfigSchema
+from toy_dns_server.log.logger import Logger
+from toy_dns_server.server.doh.async_server import AsyncDoHServer
 from toy_dns_server.server.doh.http_server import DoHHTTPServer
 from toy_dns_server.server.doh.https_server import DoHHTTPSServer
+from toy_dns_server.server.doh.tls import ServerTLS
 
 from toy_dns_server.resolver.dns_resolver import DNSResolver
 
 class DoHServer:
+    _logger: Logger
     _config: ConfigSchema
+    _resolver: DNSResolver
     _server = None
 
-    def __init__(self, config: ConfigSchema):
+    def __init__(self, config: ConfigSchema, resolver: DNSResolver):
+        self._logger = Logger(self)
         self._config = config
+        self._resolver = resolver
         self._server = None
 
     def run(self):
         doh_config = self._config.server.doh
-        resolver_config = self._config.resolver
-        resolver = DNSResolver(resolver_config)
-        if doh_config.mode == "http":
-            self._server = DoHHTTPServer(doh_config.http, resolver)
+        reuse_port = self._config.server.workers > 1
+        if doh_config.engine == "asyncio":
+            self._server = self._create_async_server(reuse_port)
+        elif doh_config.mode == "http":
+            self._server = DoHHTTPServer(doh_config.http, self._resolver, reuse_port)
         elif doh_config.mode == "https":
-            self._server = DoHHTTPSServer(doh_config.https, resolver)
+            self._server = DoHHTTPSServer(doh_config.https, self._resolver, reuse_port)
         else:
             raise ValueError(f"Unsupported DoH mode: {doh_config.mode}")
         self._server.run()
@@ -27,3 +35,17 @@ class DoHServer:
     def stop(self):
         if self._server:
             self._server.stop()
+
+    def _create_async_server(self, reuse_port: bool) -> AsyncDoHServer:
+        doh_config = self._config.server.doh
+        if doh_config.mode == "http":
+            listen_address, tls = doh_config.http.listen_address, None
+        elif doh_config.mode == "https":
+            listen_address = doh_config.https.listen_address
+            alpn_protocols = ["h2", "http/1.1"] if doh_config.http2.enabled else ["http/1.1"]
+            tls = ServerTLS(doh_config.https.security, alpn_protocols)
+        else:
+            raise ValueError(f"Unsupported DoH mode: {doh_config.mode}")
+
+        host, port = listen_address.split(":")
+        return AsyncDoHServer((host, int(port)), self._resolver, doh_config, tls, reuse_port)
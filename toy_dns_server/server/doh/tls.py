@@ -0,0 +1,103 @@
+import socket
+import ssl
+import threading
+import time
+from posixpath import abspath
+from typing import Optional
+
+from toy_dns_server.config.schema import DoHTTPSecurityConfig
+from toy_dns_server.log.logger import Logger
+from toy_dns_server.metrics.metrics import doh_tls_handshake_duration
+
+_TLS_VERSIONS = {
+    "TLS12": ssl.TLSVersion.TLSv1_2,
+    "TLS13": ssl.TLSVersion.TLSv1_3,
+}
+
+
+class ServerTLS:
+    """TLS contexts for the DoH server, with session resumption.
+
+    Resuming clients skip the certificate exchange and key agreement of a full handshake, using
+    either a TLS 1.3 session ticket or a TLS 1.2 session ID. Tickets are stateless by default,
+    encrypted with keys held by the current context; with `stateless_tickets` off, sessions are
+    kept in the context's server-side session cache instead. Python cannot replace ticket keys in
+    place, so keys are rotated by building a fresh context every `ticket_key_rotation_seconds`;
+    sessions issued before a rotation fall back to a full handshake.
+
+    Handshakes are left to the caller, which runs them off the accept path with
+    `handshake_timeout`, and reports each one through `observe_handshake`.
+    """
+    _logger: Logger
+
+    def __init__(self, config: DoHTTPSecurityConfig, alpn_protocols: list[str]):
+        self._logger = Logger(self)
+        self._config = config
+        self._alpn_protocols = alpn_protocols
+        self.handshake_timeout = config.handshake_timeout_ms / 1000
+        self._rotation_interval = config.session_resumption.ticket_key_rotation_seconds
+        self._lock = threading.Lock()
+        self._context = self._create_context()
+        self._rotate_at = time.monotonic() + self._rotation_interval
+
+    def context(self) -> ssl.SSLContext:
+        """The context for a new connection, rotating the ticket keys when they are due."""
+        with self._lock:
+            if time.monotonic() >= self._rotate_at:
+                self._logger.info("Rotating TLS session ticket keys")
+                self._context = self._create_context()
+                self._rotate_at = time.monotonic() + self._rotation_interval
+
+            return self._context
+
+    def wrap(self, sock: socket.socket) -> ssl.SSLSocket:
+        """Run the handshake on an accepted socket, blocking the calling thread for at most `handshake_timeout`."""
+        start = time.monotonic()
+        tls_sock = self.context().wrap_socket(sock, server_side=True, do_handshake_on_connect=False)
+        try:
+            tls_sock.settimeout(self.handshake_timeout)
+            tls_sock.do_handshake()
+            tls_sock.settimeout(None)
+        except OSError:
+            observe_handshake(None, time.monotonic() - start)
+            tls_sock.close()
+            raise
+
+        observe_handshake(tls_sock, time.monotonic() - start)
+        return tls_sock
+
+    def _create_context(self) -> ssl.SSLContext:
+        config = self._config
+        context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+        context.minimum_version = _TLS_VERSIONS[config.min_tls_version]
+        context.maximum_version = _TLS_VERSIONS[config.max_tls_version]
+        context.set_alpn_protocols(self._alpn_protocols)
+
+        abs_certfile_path = abspath(config.certificate_file)
+        abs_keyfile_path = abspath(config.key_file)
+        self._logger.debug(f"Loading certificate from {abs_certfile_path}")
+        self._logger.debug(f"Loading key from {abs_keyfile_path}")
+        context.load_cert_chain(
+            certfile=abs_certfile_path,
+            keyfile=abs_keyfile_path
+        )
+
+        resumption = config.session_resumption
+        context.num_tickets = resumption.tickets_per_handshake
+        if not resumption.stateless_tickets:
+            # OpenSSL then issues tickets that only reference its server-side session cache.
+            context.options |= ssl.OP_NO_TICKET
+
+        return context
+
+
+def observe_handshake(tls: Optional[ssl.SSLObject | ssl.SSLSocket], duration: float):
+    """Record a handshake; `tls` is None if it failed."""
+    if tls is None:
+        result = "failed"
+    elif tls.session_reused:
+        result = "resumed"
+    else:
+        result = "full"
+
+    doh_tls_handshake_duration.labels(result).observe(duration)
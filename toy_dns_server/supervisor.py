@@ -0,0 +1,84 @@
+import multiprocessing
+import time
+from typing import Callable, Optional
+
+from toy_dns_server.log.logger import Logger
+
+
+class WorkerSupervisor:
+    """Runs `workers` copies of `target` in separate processes and restarts the ones that die.
+
+    Workers are started with the `spawn` method, so they never inherit the parent's threads
+    (metrics exporter, logging handlers) in an inconsistent state.
+    """
+    POLL_INTERVAL_SECONDS = 1.0
+    STOP_TIMEOUT_SECONDS = 10.0
+
+    _logger: Logger
+
+    def __init__(self, workers: int, target: Callable, args: tuple = (), on_worker_exit: Optional[Callable[[int], None]] = None):
+        self._logger = Logger(self)
+        self._workers = workers
+        self._target = target
+        self._args = args
+        self._on_worker_exit = on_worker_exit
+        self._context = multiprocessing.get_context("spawn")
+        self._processes: list[Optional[multiprocessing.Process]] = [None] * workers
+        self._stopping = False
+
+    def run(self):
+        self._logger.info(f"Starting {self._workers} worker processes...")
+        for index in range(self._workers):
+            self._start_worker(index)
+
+        while not self._stopping:
+            time.sleep(self.POLL_INTERVAL_SECONDS)
+            self._restart_dead_workers()
+
+    def stop(self):
+        if self._stopping:
+            return
+
+        self._stopping = True
+        self._logger.info("Stopping worker processes...")
+        for process in self._processes:
+            if process is not None and process.is_alive():
+                process.terminate()
+
+        deadline = time.time() + self.STOP_TIMEOUT_SECONDS
+        for process in self._processes:
+            if process is None:
+                continue
+
+            process.join(max(0, deadline - time.time()))
+            if process.is_alive():
+                self._logger.warn(f"Worker {process.pid} did not stop in time, killing it")
+                process.kill()
+                process.join()
+
+            self._handle_worker_exit(process)
+
+        self._logger.info("Worker processes stopped.")
+
+    def _start_worker(self, index: int):
+        process = self._context.Process(
+            target=self._target,
+            args=(*self._args, index),
+            name=f"toy-dns-worker-{index}",
+        )
+        process.start()
+        self._processes[index] = process
+        self._logger.info(f"Worker {index} started with PID {process.pid}")
+
+    def _restart_dead_workers(self):
+        for index, process in enumerate(self._processes):
+            if process is None or process.is_alive() or self._stopping:
+                continue
+
+            self._logger.error(f"Worker {index} (PID {process.pid}) exited with code {process.exitcode}, restarting")
+            self._handle_worker_exit(process)
+            self._start_worker(index)
+
+    def _handle_worker_exit(self, process: multiprocessing.Process):
+        if self._on_worker_exit is not None and process.pid is not None:
+            self._on_worker_exit(process.pid)